@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+# Imports
+from histograms import time_histogram, CHART_STEPS
+from regions import region_counts, region_report
+import numpy as np
+
+# Global variables / constants
+COORD_SCALE = 10**6 # Coordinate sums are integer micro-degrees, so merging is exact in any order
+
+# Class definitions
+class LocationTotals:
+    """
+    Number of located incidents and the sums of their coordinates, the
+    summary of a job. Sums are kept as integer micro-degrees.
+    """
+    __slots__ = ('located', 'lat_sum', 'lon_sum')
+
+    def __init__(self, located=0, lat_sum=0, lon_sum=0):
+        self.located = int(located)
+        self.lat_sum = int(lat_sum)
+        self.lon_sum = int(lon_sum)
+
+    @classmethod
+    def from_coordinates(cls, latitudes, longitudes):
+        """
+        Totals of a set of located incidents.
+
+        Args:
+            latitudes (array): Validated latitudes.
+            longitudes (array): Validated longitudes.
+
+        Returns:
+            totals (LocationTotals): Their totals.
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        return cls(len(latitudes), int(np.round(latitudes * COORD_SCALE).sum()), int(np.round(longitudes * COORD_SCALE).sum()))
+
+    def merge(self, other):
+        """Totals of both incident sets"""
+        return LocationTotals(self.located + other.located, self.lat_sum + other.lat_sum, self.lon_sum + other.lon_sum)
+
+    def negate(self):
+        """Totals that remove these incidents when merged"""
+        return LocationTotals(-self.located, -self.lat_sum, -self.lon_sum)
+
+    def average(self):
+        """
+        Returns:
+            average (tuple): Average latitude and longitude, None without
+                             located incidents.
+        """
+        if self.located == 0:
+            return None
+        return self.lat_sum / self.located / COORD_SCALE, self.lon_sum / self.located / COORD_SCALE
+
+    def to_json(self):
+        """Compact form, [located, lat_sum, lon_sum]"""
+        return [self.located, self.lat_sum, self.lon_sum]
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(*value)
+
+    def __eq__(self, other):
+        return isinstance(other, LocationTotals) and self.to_json() == other.to_json()
+
+class TimeHistogram:
+    """
+    Incident counts per chart bucket of one step. Only buckets holding
+    incidents are kept, the timeframe fills in the empty ones.
+    """
+    __slots__ = ('step', 'counts')
+
+    def __init__(self, step, counts=None):
+        if step not in CHART_STEPS:
+            raise ValueError(f'step must be one of {", ".join(CHART_STEPS)}')
+        self.step = step
+        self.counts = {label: int(count) for label, count in (counts or {}).items() if count}
+
+    @classmethod
+    def from_published(cls, published, start_date, end_date, step, weights=None):
+        """
+        Histogram of incidents, see histograms.time_histogram.
+
+        Args:
+            published (array): datetime64 publish times of the incidents.
+            start_date (date): First day of the timeframe.
+            end_date (date): Last day of the timeframe.
+            step (string): One of CHART_STEPS.
+            weights (array): Optional number of incidents behind every
+                             publish time.
+
+        Returns:
+            histogram (TimeHistogram): The counts of the buckets.
+        """
+        chart = time_histogram(published, start_date, end_date, step, weights)
+        return cls(step, {label: count[0] for label, count in chart.items()})
+
+    def merge(self, other):
+        """Counts of both incident sets, bucket by bucket"""
+        if other.step != self.step:
+            raise ValueError(f'Cannot merge {self.step} and {other.step} histograms')
+        counts = dict(self.counts)
+        for label, count in other.counts.items():
+            counts[label] = counts.get(label, 0) + count
+        return TimeHistogram(self.step, counts)
+
+    def negate(self):
+        """Histogram that removes these incidents when merged"""
+        return TimeHistogram(self.step, {label: -count for label, count in self.counts.items()})
+
+    def chart(self, start_date, end_date):
+        """
+        Formats the histogram for a timeframe.
+
+        Returns:
+            chart (dict): Bucket label mapped to a one element list holding
+                          its incident count, every bucket of the timeframe
+                          in chronological order.
+        """
+        return {label: [self.counts.get(label, 0)] for label in time_histogram([], start_date, end_date, self.step)}
+
+    def to_json(self):
+        """Compact form, {'step': step, 'counts': {label: count}}"""
+        return {'step': self.step, 'counts': self.counts}
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value['step'], value['counts'])
+
+    def __eq__(self, other):
+        return isinstance(other, TimeHistogram) and self.to_json() == other.to_json()
+
+class RegionCounts:
+    """Incident counts per cell of a region grid"""
+    __slots__ = ('center', 'tolerance', 'grid', 'counts')
+
+    def __init__(self, center, tolerance, grid, counts=None):
+        self.center = (float(center[0]), float(center[1]))
+        self.tolerance = float(tolerance)
+        self.grid = (int(grid[0]), int(grid[1]))
+        self.counts = np.zeros(self.grid, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64).reshape(self.grid)
+
+    @classmethod
+    def from_coordinates(cls, latitudes, longitudes, center, tolerance, grid):
+        """
+        Region counts of a set of located incidents, see regions.region_counts.
+
+        Returns:
+            regions (RegionCounts): The counts of the grid.
+        """
+        return cls(center, tolerance, grid, region_counts(latitudes, longitudes, center, tolerance, grid))
+
+    def merge(self, other):
+        """Counts of both incident sets, cell by cell"""
+        if (other.center, other.tolerance, other.grid) != (self.center, self.tolerance, self.grid):
+            raise ValueError('Cannot merge region counts of different grids')
+        return RegionCounts(self.center, self.tolerance, self.grid, self.counts + other.counts)
+
+    def negate(self):
+        """Counts that remove these incidents when merged"""
+        return RegionCounts(self.center, self.tolerance, self.grid, -self.counts)
+
+    def report(self):
+        """Formats the counts, see regions.region_report"""
+        return region_report(self.counts)
+
+    def to_json(self):
+        """Compact form, the grid parameters and the flat 'counts'"""
+        return {'center': list(self.center), 'tolerance': self.tolerance, 'grid': list(self.grid), 'counts': self.counts.ravel().tolist()}
+
+    @classmethod
+    def from_json(cls, value):
+        return cls(value['center'], value['tolerance'], value['grid'], value['counts'])
+
+    def __eq__(self, other):
+        return isinstance(other, RegionCounts) and self.to_json() == other.to_json()
+
+class JobAggregate:
+    """
+    Partial results of a job over a set of incidents: the location totals
+    and, when requested, the chart histogram, the region counts and the map
+    (incident points, or 'cell' and grid 'cells' counts). Partials of
+    disjoint incident sets merge into the partial of their union, in any
+    grouping, so shards, days and cached results combine without the rows.
+    """
+    __slots__ = ('location', 'chart', 'regions', 'map')
+
+    def __init__(self, location=None, chart=None, regions=None, map=None):
+        self.location = location or LocationTotals()
+        self.chart = chart
+        self.regions = regions
+        self.map = map
+
+    def merge(self, other):
+        """Partial results of both incident sets"""
+        return JobAggregate(self.location.merge(other.location),
+                            _merge_optional(self.chart, other.chart),
+                            _merge_optional(self.regions, other.regions),
+                            _merge_maps(self.map, other.map))
+
+    def negate(self):
+        """
+        Partial that removes these incidents when merged.
+
+        Raises:
+            ValueError: If the partial holds map points, which cannot be
+                        taken back out of a list.
+        """
+        if self.map is not None and 'cells' not in self.map:
+            raise ValueError('Map points cannot be removed from a partial')
+        return JobAggregate(self.location.negate(),
+                            None if self.chart is None else self.chart.negate(),
+                            None if self.regions is None else self.regions.negate(),
+                            None if self.map is None else {'cell': self.map['cell'], 'cells': {key: -count for key, count in self.map['cells'].items()}})
+
+    def to_json(self):
+        """Compact form, 'location' plus the requested parts"""
+        value = {'location': self.location.to_json()}
+        if self.chart is not None:
+            value['chart'] = self.chart.to_json()
+        if self.regions is not None:
+            value['regions'] = self.regions.to_json()
+        if self.map is not None and 'cells' in self.map:
+            value['map'] = {'cell': self.map['cell'], 'cells': [[row, col, self.map['cells'][(row, col)]] for row, col in sorted(self.map['cells'])]}
+        elif self.map is not None:
+            value['map'] = self.map
+        return value
+
+    @classmethod
+    def from_json(cls, value):
+        result_map = value.get('map')
+        if result_map is not None and 'cells' in result_map:
+            result_map = {'cell': result_map['cell'], 'cells': {(row, col): count for row, col, count in result_map['cells']}}
+        return cls(LocationTotals.from_json(value['location']),
+                   TimeHistogram.from_json(value['chart']) if 'chart' in value else None,
+                   RegionCounts.from_json(value['regions']) if 'regions' in value else None,
+                   result_map)
+
+# Function definitions
+def _merge_optional(first, second):
+    """Merges two optional aggregates, a missing one counts as empty"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return first.merge(second)
+
+def _merge_maps(first, second):
+    """Adds grid map cells one by one, or joins the lists of map points"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    if 'cells' in first:
+        cells = dict(first['cells'])
+        for key, count in second['cells'].items():
+            cells[key] = cells.get(key, 0) + count
+        return {'cell': first['cell'], 'cells': {key: count for key, count in cells.items() if count}}
+    return {key: first[key] + second[key] for key in first}
+
+def merge_all(aggregates):
+    """
+    Merges any number of aggregates of one kind.
+
+    Args:
+        aggregates (iterable): JobAggregate (or other aggregate) objects.
+
+    Returns:
+        aggregate: Their merge, an empty JobAggregate if there are none.
+    """
+    merged = None
+    for aggregate in aggregates:
+        merged = aggregate if merged is None else merged.merge(aggregate)
+    return JobAggregate() if merged is None else merged
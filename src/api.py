@@ -1,19 +1,25 @@
 #!/usr/bin/env python3
 
 # Imports
-import requests
-from flask import Flask, request
-import numpy as np
+from flask import Flask, request, Response, stream_with_context, abort
 import redis
 import json
-import csv
-from jobs import add_job, get_job_by_id, get_job_ids, get_result
+import time
+from datetime import datetime
+from jobs import add_job, get_job_by_id, get_result_parts, iter_result_map, iter_jobs, get_jobs_page, scan_batches, scan_page, invalidate_cache, queue_stats, get_image, get_image_etag, SCAN_COUNT
+from incidents import is_incident_key, decode_incident, quarantine_report
+from ingest import load_feed, publish_reset
+from snapshot import publish_snapshot, schedule_snapshot, SNAPSHOT_KEY
+from regions import region_config
+from histograms import CHART_STEPS
+from render import MAP_IMAGE, CHART_IMAGE
+from maps import MAP_MODES
+from dates import job_window
+from aggregates import LocationTotals, RegionCounts, JobAggregate
+from live import LIVE_CHANNEL, LIVE_AGGREGATES_KEY, LIVE_KEEPALIVE
+from standing import add_standing_query, get_standing_query, get_standing_ids, delete_standing_query, reset_standing
 import os
 import logging
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
-import matplotlib.pyplot as plt
 
 # Global variables/constants
 app = Flask(__name__)
@@ -24,6 +30,80 @@ log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
 logging.basicConfig(level=log_var)
 
 # Function definitions
+def _page_args():
+    """
+    Reads the optional 'cursor' and 'limit' pagination query parameters,
+    answering 400 to a limit below 1.
+
+    Returns:
+        cursor (int): SCAN cursor to resume from, 0 for the first page.
+        limit (int): Page size, None when the whole collection is wanted.
+    """
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('cursor', 0, type=int)
+    if limit is not None and limit < 1:
+        abort(Response('limit must be a positive integer\n', 400))
+    return cursor, limit
+
+def _stream_values(values):
+    """
+    Streams already JSON encoded values as a chunked response, either as one
+    JSON list (default) or as NDJSON with '?format=ndjson', so the response
+    is never built in memory.
+
+    Args:
+        values (iterator): JSON encoded strings.
+
+    Returns:
+        response (Response): Streaming flask response.
+    """
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for value in values:
+                yield value + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    def generate():
+        separator = '['
+        for value in values:
+            yield separator + value
+            separator = ','
+        yield '[]\n' if separator == '[' else ']\n'
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+def _iter_incident_values():
+    """Yields the JSON of every incident, read in SCAN/MGET batches"""
+    for keys in scan_batches(rd, is_incident_key):
+        for value in rd.mget(keys):
+            if value is not None:
+                yield json.dumps(decode_incident(value))
+
+def _image_note(jobid, name, label):
+    """Tells the user where to download a rendered job image"""
+    if get_image_etag(jobid, name) is None:
+        return f'The incident {label} could not be rendered\n'
+    return f'Download the incident {label} with: curl {request.host_url}results/{jobid}/{name} -o {name}\n'
+
+def format_summary(summary):
+    """
+    Formats the summary of a job from its location totals.
+
+    Args:
+        summary (list or string): Serialized aggregates.LocationTotals, or
+                                  the statement of a failed job or of an
+                                  older version.
+
+    Returns:
+        summary (string): A summary statistics statement of the traffic
+                          incidents over the timeframe of the job.
+    """
+    if isinstance(summary, str):
+        return summary
+    totals = LocationTotals.from_json(summary)
+    if totals.located == 0:
+        return "There were 0 incidents with a valid location during this period.\n"
+    latavg, lonavg = totals.average()
+    return f"The average incident location is at ({latavg}N, {lonavg}W), and there were {totals.located} incidents during this period.\n"
+
 @app.route('/data', methods=['GET', 'POST', 'DELETE'])
 def handle_data():
     """
@@ -33,49 +113,71 @@ def handle_data():
     Returns: (only one of the two return types are ouput)
         result (string): For post and delete requests, a string is sent 
                          noting the request has been completed.
-        result_value (list): A list of all the traffic incidents within
-                             the dataset.
+        result_value (list): A streamed list (or NDJSON with 
+                             '?format=ndjson') of all the traffic incidents
+                             within the dataset. With '?limit=' a single
+                             page and the cursor of the next page are 
+                             returned instead.
     """
     if request.method == 'POST':
         logging.info('Accessing data from database')
-        # Get the genome data from the website, use the CSV file with times
-        response = requests.get("https://data.austintexas.gov/api/views/dx9v-zd7x/rows.csv?accessType=DOWNLOAD")
-        # Create CSV dictionary as JSON format
-        data = {}
-        data['traffic_data'] = [] 
-        open('data.csv', 'wb').write(response.content)
-        with open('data.csv', 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                data['traffic_data'].append(dict(row))
-        logging.debug('Success reading dataset')
-        # Iterate over the data to store in redis
-        for item in data['traffic_data']:
-            rd.set(item['Traffic Report ID'], json.dumps(item)) # Item at index one of datapoint is ID number
-        logging.debug('Success inputting data into redis')
+        # Stream the CSV from the website straight into redis in batches
+        delta = request.args.get('mode', 'full') == 'delta'
+        counts = load_feed(delta=delta)
+        logging.debug(f'Success inputting data into redis: {counts}')
+        # Changed incidents retired the snapshot, so workers read redis until the new one is published
+        if not delta:
+            publish_snapshot() # A full load rewrites every incident, so its snapshot is rebuilt too
+        elif not rd.exists(SNAPSHOT_KEY):
+            schedule_snapshot()
+        if counts['added'] or counts['updated']:
+            invalidate_cache()
         # Return response
-        os.remove("data.csv")
+        if delta:
+            return f"The POST request is completed: {counts['added']} added, {counts['updated']} updated, {counts['unchanged']} unchanged, {counts['quarantined']} quarantined\n"
         return "The POST request is completed\n"
 
     elif request.method == 'GET':
-        return_value = []
         logging.info('Reading all data from redis')
-        # Iterate over keys in redis
-        for item in rd.keys():
-            return_value.append(json.loads(rd.get(item)))
-        # Return everything as a JSON object
-        return return_value
+        # Iterate over keys in redis with SCAN, values come back in MGET batches
+        cursor, limit = _page_args()
+        if limit is not None:
+            cursor, keys = scan_page(rd, cursor, limit, is_incident_key)
+            values = rd.mget(keys) if keys else []
+            return {'cursor': cursor, 'data': [decode_incident(value) for value in values if value is not None]}
+        return _stream_values(_iter_incident_values())
 
     elif request.method == 'DELETE':
         # Delete everything in redis
         logging.info('Deleting data from redis')
-        for item in rd.keys():
-            rd.delete(item)
+        for keys in scan_batches(rd):
+            rd.unlink(*keys)
+        invalidate_cache()
+        reset_standing()
+        publish_reset()
         # Return response
         return "The DELETE request is completed\n"
     else:
         logging.warning('Invalid specified method.')
 
+@app.route('/data/quarantine', methods=['GET'])
+def get_quarantine():
+    """
+    This function reports the traffic incidents quarantined at ingest
+    because their coordinates or published date are missing, malformed or
+    outside of the Austin area. They are still stored, but never counted as
+    located by an analysis.
+
+    Returns:
+        result (dict): Number of quarantined incidents, their number per
+                       problem and the incidents with their problems and
+                       raw values, one page of them with '?limit=' and
+                       '?cursor='.
+    """
+    logging.info('Reading quarantined data from redis')
+    cursor, limit = _page_args()
+    return quarantine_report(cursor, limit)
+
 @app.route('/ids', methods=['GET'])
 def get_ids():
     logging.info('Getting all data from redis')
@@ -83,15 +185,15 @@ def get_ids():
     This function gets all the unique IDs of posted traffic incedents.
 
     Returns:
-        result (list): List of unique IDs of traffic incedents. 
+        result (list): Streamed list of unique IDs of traffic incedents, or
+                       one page of them with '?limit=' and '?cursor='.
     """
-    return_value = []
-    # Iterate over keys in redis
-    for item in rd.keys():
-    # Append the keys
-        value = return_value.append(item.decode('utf8'))
-    # Return everything as a JSON object
-    return return_value
+    # Iterate over keys in redis with SCAN
+    cursor, limit = _page_args()
+    if limit is not None:
+        cursor, keys = scan_page(rd, cursor, limit, is_incident_key)
+        return {'cursor': cursor, 'data': [item.decode('utf8') for item in keys]}
+    return _stream_values(json.dumps(item.decode('utf8')) for keys in scan_batches(rd, is_incident_key) for item in keys)
 
 @app.route('/ids/<desired_id>', methods=['GET'])
 def get_id_data(desired_id):
@@ -106,14 +208,41 @@ def get_id_data(desired_id):
         result (list): A list dictionary of the traffic incident requested. 
     """
     return_value = []
-    # Iterate over keys in redis
-    for item in rd.keys():
-        # Check if specified key
-        if desired_id == item.decode('utf8'):
-            return_value.append(json.loads(rd.get(item)))
+    # Fetch the key directly, bookkeeping keys are not incidents
+    if is_incident_key(desired_id):
+        value = rd.get(desired_id)
+        if value is not None:
+            return_value.append(decode_incident(value))
     # Return response once found
     return return_value
 
+@app.route('/ids/batch', methods=['POST'])
+def get_id_batch():
+    """
+    This function gets the data of many traffic incidents in one request,
+    the IDs are posted as a JSON list (or as {"ids": [...]}).
+
+    Returns:
+        result (dict): Each requested ID mapped to its traffic incident, or
+                       to null if the ID is unknown.
+    """
+    logging.info('Getting a batch of data from redis')
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('ids')
+    if not isinstance(data, list) or not all(isinstance(item, str) for item in data):
+        logging.warning('Invalid list of IDs posted')
+        return 'Post a JSON list of traffic incident IDs.\n', 400
+    return_value = {}
+    for index in range(0, len(data), SCAN_COUNT):
+        batch = [item for item in data[index:index + SCAN_COUNT] if is_incident_key(item)]
+        values = rd.mget(batch) if batch else []
+        for item, value in zip(batch, values):
+            return_value[item] = decode_incident(value) if value is not None else None
+    for item in data:
+        return_value.setdefault(item, None)
+    return return_value
+
 @app.route('/jobs', methods=['POST', 'GET'])
 def submit_job():
     """
@@ -123,18 +252,46 @@ def submit_job():
     Returns: (only one of the two return types are ouput)
         result (string): Statement mentioning the POST request has been 
                          completed.
-        result (list): List of all the unique job IDs in the queue. 
+        result (list): Streamed list of all the jobs, or one page of them
+                       with '?limit=' and '?cursor='. The 'X-Queue-Depth'
+                       and 'X-Estimated-Wait' (seconds) headers describe
+                       the scheduler.
 
     """
     if request.method == 'POST':
         logging.info('Posting job to seperate redis database')
         data = request.get_json()
+        try:
+            job_window(data)
+            region_config(data)
+        except ValueError as e:
+            logging.warning('Invalid job parameters')
+            return f'{e}\n', 400
+        if data.get('chart_step') not in (None,) + CHART_STEPS:
+            logging.warning('Invalid chart step')
+            return f'chart_step must be one of {", ".join(CHART_STEPS)}\n', 400
+        if data.get('map_mode') not in (None,) + MAP_MODES:
+            logging.warning('Invalid map mode')
+            return f'map_mode must be one of {", ".join(MAP_MODES)}\n', 400
+        priority = data.get('priority', 0)
+        if not isinstance(priority, int) or isinstance(priority, bool):
+            logging.warning('Invalid priority')
+            return 'priority must be an integer\n', 400
         # Set parameters to be the start and end dates
-        job_dict = add_job(data['start'], data['end'], data['incident_map'], data['incident_graph'], data['incident_report'])
+        job_dict = add_job(data['start'], data['end'], data['incident_map'], data['incident_graph'], data['incident_report'],
+                           region_center=data.get('region_center'), region_tolerance=data.get('region_tolerance'), region_grid=data.get('region_grid'), chart_step=data.get('chart_step'), priority=priority, map_mode=data.get('map_mode'))
         return 'POST request completed for desired job.\n'
     elif request.method == 'GET':
         logging.info('Getting all data from seperate redis database')
-        return get_job_ids()
+        cursor, limit = _page_args()
+        depth, wait = queue_stats()
+        headers = {'X-Queue-Depth': str(depth), 'X-Estimated-Wait': str(wait)}
+        if limit is not None:
+            cursor, jobs = get_jobs_page(cursor, limit)
+            return {'cursor': cursor, 'data': jobs}, headers
+        response = _stream_values(json.dumps(job) for job in iter_jobs())
+        response.headers.update(headers)
+        return response
     else:
         logging.warning('Invalid specified method.')
 
@@ -152,6 +309,77 @@ def get_job(jobid):
     logging.info('Getting job from seperate redis database')
     return [get_job_by_id(jobid)]
 
+def _standing_view(standing):
+    """
+    Formats the result of a standing query for its response.
+
+    Args:
+        standing (dict): Standing query, see standing.get_standing_query.
+
+    Returns:
+        standing (dict): The same, its 'result' holding the timeframe, the
+                         'summary' statement, the 'located' incidents and
+                         their 'average' location, the 'chart' and the
+                         regional 'report'.
+    """
+    result = standing['result']
+    aggregate = JobAggregate.from_json(result['aggregate'])
+    start_date = datetime.fromisoformat(result['start']).date()
+    end_date = datetime.fromisoformat(result['end']).date()
+    average = aggregate.location.average()
+    view = {'start': result['start'], 'end': result['end'],
+            'summary': format_summary(aggregate.location.to_json()),
+            'located': aggregate.location.located,
+            'average': None if average is None else list(average),
+            'chart': aggregate.chart.chart(start_date, end_date) if aggregate.chart is not None else 'Graph not requested',
+            'report': aggregate.regions.report() if aggregate.regions is not None else 'Report not requested'}
+    return dict(standing, result=view)
+
+@app.route('/standing', methods=['POST', 'GET'])
+def handle_standing():
+    """
+    This function registers and lists standing queries: job definitions
+    whose summary, chart and regional report are kept up to date from the
+    incidents each POST to '/data' changes, instead of being resubmitted.
+
+    Returns: (only one of the two return types are ouput)
+        result (dict): For post requests, the ID, definition and first
+                       result of the new standing query.
+        result (list): The IDs of every standing query.
+    """
+    if request.method == 'POST':
+        logging.info('Registering standing query')
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return 'Post the standing query as a JSON object.\n', 400
+        try:
+            return _standing_view(add_standing_query(data))
+        except ValueError as e:
+            logging.warning('Invalid standing query parameters')
+            return f'{e}\n', 400
+    return get_standing_ids()
+
+@app.route('/standing/<sid>', methods=['GET', 'DELETE'])
+def handle_standing_query(sid):
+    """
+    This function reads or removes a standing query.
+
+    Args:
+        sid (string): Unique standing query ID.
+
+    Returns:
+        result (dict): The definition, latest result and refresh time of the
+                       standing query, 404 if it is unknown.
+    """
+    if request.method == 'DELETE':
+        if not delete_standing_query(sid):
+            return 'No such standing query\n', 404
+        return 'The DELETE request is completed\n'
+    standing = get_standing_query(sid)
+    if standing is None:
+        return 'No such standing query\n', 404
+    return _standing_view(standing)
+
 @app.route('/results/<jobid>', methods=['GET'])
 def output_result(jobid):
     """
@@ -162,13 +390,10 @@ def output_result(jobid):
 
     Returns: (only one of the two return types are ouput)
         result[0] (string): A summary statement of the traffic incidents 
-                            between the specified job timeframe. 
-        result_map (string): A statement with directions on how to download
-                             the computed map image to a local working 
-                             directory.
-        result_chart (string): A statement with directions on how to 
-                               download the computed chart image to a local
-                               working directory.
+                            between the specified job timeframe, see
+                            format_summary.
+        result_map (string): A statement with the URL of the map image.
+        result_chart (string): A statement with the URL of the chart image.
         result_report(string): A report statement of the regional 
                                distribution of the traffic incidents in the
                                specified job timeframe. 
@@ -179,70 +404,121 @@ def output_result(jobid):
     status = job['status']
     logging.debug('Job status received')
     if (status == 'Complete'):
-        result = get_result(jobid)
-        result_map_test = result[1]
-        result_chart_test = result[2]
-        result_report_test = result[3]
-        #Checking if a map was requested, if so make one
-        if result_map_test != 'Map not requested':
-            logging.debug('Attempting to make map\n')
-            df = pd.DataFrame(result[1])
-            fig = go.Figure()
-
-            fig.add_trace(go.Scattermapbox(lon = df['longitudes'], lat = df['latitudes'],text = df['Address'], mode = 'markers', marker = go.scattermapbox.Marker(size = 8)))
-
-            fig.update_layout(title = 'Austin Traffic Incident Map', geo_scope='usa', mapbox_style='open-street-map', mapbox_center={'lat':30.2672, 'lon':-97.7431},mapbox_zoom=10 )
-            fig.update_geos(center=dict(lon=-97.7431, lat=30.2672), projection_scale=10, scope='usa')
-            try: 
-                logging.debug('Attempting to save map\n')
-                curr_dir = os.path.abspath(os.getcwd())
-                filename = 'Austin_Incident_Map.png'
-                map_path = os.path.join(curr_dir, filename)
-                fig.write_image(map_path, width=800, height=600, scale=2)
-                logging.debug('Image saved\n')
-                result_map = f'Find incident map by copying from container using this command: "docker cp <insert container ID for api>:{map_path} <path to desired local folder, use \'.\' if the current local working directory is the designated location>" \n'
-            except Exception as e:
-                print("Error when saving map to directory:", e)
-                logging.error('Failed to save image\n')
-        else:
-            result_map = result_map_test
-        if result_chart_test != 'Graph not requested':
-            logging.debug('Attempting to make dataframe\n')
-            df = pd.DataFrame(result[2])
-            logging.debug('Attempt melt data\n')
-            df_melted = df.melt(var_name='Date/Time', value_name = 'Total Incident Count')
-            df_clean = df_melted.dropna()
-            logging.debug('Attempting to make chart\n')
-            plt.figure()
-            ax = df_clean.plot(kind='bar', x='Date/Time', y='Total Incident Count', legend=None)
-            plt.ylabel('Total Incident Count')
-            try:
-                logging.debug('Attempting to save chart\n')
-                plt.savefig('Incident_Chart.png', bbox_inches='tight')
-                curr_dir = os.path.abspath(os.getcwd())
-                filename = 'Incident_Chart.png'
-                map_path = os.path.join(curr_dir, filename)
-                result_chart = f'Find incident chart by copying from container using this command: "docker cp <insert container ID for api>:{map_path} <path to desired local folder, use \'.\' if the current local working directory is the designated location>" \n'
-                logging.debug('Finished making and saving chart\n')
-            except Exception as e:
-                print("Error when saving chart to directory:", e)
-                logging.error('Failed to save image\n')
-        else:
-            result_chart = result_chart_test
+        # The chart and map are only pointed to, so they are never loaded
+        result = get_result_parts(jobid, ['summary', 'map', 'chart', 'report'])
+        result_report_test = result['report']
+        if isinstance(result_report_test, dict) and 'counts' in result_report_test:
+            result_report_test = RegionCounts.from_json(result_report_test).report()
+        # The worker rendered the images, only point to them
+        result_map = _image_note(jobid, MAP_IMAGE, 'map') if result['map'] != 'Map not requested' else result['map']
+        if result['map'] is True:
+            result_map += f'Stream the incident map data with: curl {request.host_url}results/{jobid}/map\n'
+        result_chart = _image_note(jobid, CHART_IMAGE, 'chart') if result['chart'] != 'Graph not requested' else result['chart']
         #Checking if a report was requested, if so make one
         if result_report_test != 'Report not requested':
             logging.debug('Making incident report\n')
-            result_report =  f'This is the accident distribution for each region of austin(in the format of \'Region\': <#incidents>):\n {result_report_test}\nNote that downtown is defined as 30.2672 N (+- 0.01 degrees), -97.7431 W (+-0.01 degrees). Also note that the other regions are relative to downtown. For example, \'North\' Austin is 30.2772 N (or greater), and -97.7431 W (+-0.01 degrees).\n'
+            center, tolerance, grid = region_config(job)
+            if 'grid' in result_report_test:
+                rows = '\n '.join(str(row) for row in result_report_test['grid'])
+                result_report = f'This is the accident distribution over a {grid[0]}x{grid[1]} grid of regions (rows from north to south, columns from west to east):\n {rows}\nNote that the center cell is {center[0]} N (+- {tolerance} degrees), {center[1]} W (+- {tolerance} degrees), every other cell is {2 * tolerance} degrees wide and the outer cells extend without bound.\n'
+            else:
+                result_report =  f'This is the accident distribution for each region of austin(in the format of \'Region\': <#incidents>):\n {result_report_test}\nNote that downtown is defined as {center[0]} N (+- {tolerance} degrees), {center[1]} W (+-{tolerance} degrees). Also note that the other regions are relative to downtown. For example, \'North\' Austin is {round(center[0] + tolerance, 6)} N (or greater), and {center[1]} W (+-{tolerance} degrees).\n'
             logging.debug('Finished making report\n')
         else:
             result_report = result_report_test
         #Compile the computed results into neat output with standardized format
         logging.debug('Compiling results \n')
-        return f'{result[0]} \n{result_chart} \n{result_map} \n{result_report} \n'
+        return f'{format_summary(result["summary"])} \n{result_chart} \n{result_map} \n{result_report} \n'
     else:
         logging.warning('The job has not finished yet')
         return 'Your data is still being analyzed and calculated\n'
 
+@app.route('/results/<jobid>/map', methods=['GET'])
+def get_result_map(jobid):
+    """
+    This function streams the map data of a job in chunks, so a map of any
+    size passes through with flat memory.
+
+    Args:
+        jobid (string): Unique job ID.
+
+    Returns:
+        result (Response): Streamed JSON of the map (parallel lists of
+                           incidents, or grid cells with counts), 404 if the
+                           job has no map.
+    """
+    parts = get_result_parts(jobid, ['map'])
+    if parts is None or not parts.get('map') or isinstance(parts['map'], str):
+        logging.warning('No such map')
+        return 'No map, check the job is complete and requested it\n', 404
+    if parts['map'] is not True:
+        return parts['map'] # Result stored by an older version
+    return Response(stream_with_context(iter_result_map(jobid)), mimetype='application/json')
+
+@app.route('/results/<jobid>/<image>', methods=['GET'])
+def get_result_image(jobid, image):
+    """
+    This function serves an image rendered by the worker for a job. The
+    response carries an ETag, so a client that sends it back in
+    'If-None-Match' gets an empty 304 response.
+
+    Args:
+        jobid (string): Unique job ID.
+        image (string): 'map.png' or 'chart.png'.
+
+    Returns:
+        result (Response): The PNG image, 304 if the client copy is current
+                           or 404 if the job has no such image.
+    """
+    if image not in (MAP_IMAGE, CHART_IMAGE):
+        return 'Images are map.png and chart.png\n', 404
+    etag = get_image_etag(jobid, image)
+    if etag is None:
+        logging.warning('No such image')
+        return 'No such image, check the job is complete and requested it\n', 404
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(get_image(jobid, image), mimetype='image/png')
+    response.set_etag(etag)
+    response.cache_control.max_age = 3600
+    return response
+
+@app.route('/stream', methods=['GET'])
+def stream_live():
+    """
+    This function streams the events of live mode as server-sent events:
+    'incidents' with the rows of newly appended traffic incidents and
+    'aggregates' with the rolling hour, day and week totals. A new client
+    first receives the current aggregates.
+
+    Returns:
+        result (Response): Never ending 'text/event-stream' response.
+    """
+    logging.info('Client subscribed to the live stream')
+    def generate():
+        pubsub = rd.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(LIVE_CHANNEL) # Before reading the aggregates, so no update falls in between
+        try:
+            aggregates = rd.get(LIVE_AGGREGATES_KEY)
+            if aggregates is not None:
+                yield f"event: aggregates\ndata: {aggregates.decode('utf8')}\n\n"
+            last_sent = time.monotonic()
+            while True:
+                message = pubsub.get_message(timeout=LIVE_KEEPALIVE)
+                if message is None:
+                    # Also returned for the subscription confirmation, only idle streams need a keepalive
+                    if time.monotonic() - last_sent >= LIVE_KEEPALIVE:
+                        yield ': keepalive\n\n'
+                        last_sent = time.monotonic()
+                    continue
+                event = json.loads(message['data'])
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+                last_sent = time.monotonic()
+        finally:
+            pubsub.close()
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/help', methods=["GET"])
 def help():
     """
@@ -257,11 +533,15 @@ def help():
                            api route and its usage. 
     """
     general_info = "Note that for all the route endpoints, they build off of the base url (either 'localhost:5000/' or 'http://127.0.0.1:5000/'). As such, for a route, say '/data', the final url to curl could be 'localhost:5000/data' plus the desired method.\n"
-    route1 = "The '/data' route has 'GET', 'POST', and 'DELETE' methods that can be used to load in the data, view the loaded data, and delete the data from the redis database server\n"
+    route1 = "The '/data' route has 'GET', 'POST', and 'DELETE' methods that can be used to load in the data, view the loaded data, and delete the data from the redis database server. Rows whose coordinates or published date are missing, malformed or outside of the Austin area are quarantined at load time, '/data/quarantine' reports them (pages with '?limit=' and '?cursor=')\n"
     route2 = "The '/ids' route has a 'GET' method that is used to list all of the unique traffic incident report IDs. If the information for a specific traffic id is desired, it can be viewed by querying the desired id to the end, like so for example <desired_id>: '/ids/<desired_id>'.\n"
-    route3 = "The '/jobs' route has 'POST' and 'GET' methods to post a job request and view the details of all exisiting job requests respetively. Note that if a specific job ID's details are desired, they can be queried with a 'GET' method. For example, with an example job id of <ex_job_id>, the specifics for this job id can be displayed with '/jobs/<ex_job_id>'.\n"
-    route4 = "The '/results/<desired_id>' route has a 'GET' method that attmepts to compute results for a desired job id, <desired_id>, then displays these results. Note that if a chart or map is requested, it will be saved to the container on which the app is run, and can later be retrieved with a docker cp request (if on linux) to download to the local working directory.\n"
-    help_str = f'{general_info}\n{route1}\n{route2}\n{route3}\n{route4}\n' 
+    route_batch = "The '/ids/batch' route has a 'POST' method that returns the information of many traffic ids at once. Post a JSON list of ids, and each id is mapped to its data (or null if it is unknown).\n"
+    route3 = "The '/jobs' route has 'POST' and 'GET' methods to post a job request and view the details of all exisiting job requests respetively. Note that if a specific job ID's details are desired, they can be queried with a 'GET' method. For example, with an example job id of <ex_job_id>, the specifics for this job id can be displayed with '/jobs/<ex_job_id>'. Cheap jobs are run before expensive ones, an optional integer 'priority' moves a job ahead, and the 'GET' response carries the queue depth and estimated wait in its 'X-Queue-Depth' and 'X-Estimated-Wait' headers.\n"
+    route_paging = "The 'GET' methods of '/data', '/ids' and '/jobs' stream their full listing by default, add '?format=ndjson' for one JSON document per line. For pages, add '?limit=<n>' and pass the returned 'cursor' back as '?cursor=<cursor>' until it is 0.\n"
+    route4 = "The '/results/<desired_id>' route has a 'GET' method that displays the results of a desired job id, <desired_id>, once the worker has computed them. If a chart or map was requested, the worker also rendered it, and it can be downloaded from '/results/<desired_id>/chart.png' or '/results/<desired_id>/map.png'. The map data itself is streamed by '/results/<desired_id>/map'. These image routes send an ETag, so clients can re-check them with 'If-None-Match' for free.\n"
+    route_standing = "The '/standing' route has 'POST' and 'GET' methods to register a standing query and list them. A standing query takes the job parameters, with '\"days\": <n>' for the last n days instead of 'start' and 'end', and its summary, chart and regional report are updated from just the incidents each load changes. '/standing/<id>' shows ('GET') or removes ('DELETE') one.\n"
+    route_stream = "The '/stream' route has a 'GET' method that streams live mode as server-sent events: 'incidents' carries newly appended traffic incidents and 'aggregates' the rolling totals of the last hour, day and week. Watch it with 'curl -N localhost:5000/stream'.\n"
+    help_str = f'{general_info}\n{route1}\n{route2}\n{route_batch}\n{route3}\n{route_paging}\n{route4}\n{route_standing}\n{route_stream}\n' 
     return help_str
 
 # Main function definition
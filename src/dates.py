@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Imports
+from datetime import date, datetime
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import re
+import os
+
+# Global variables / constants
+PUBLISHED_FORMAT = '%m/%d/%Y %I:%M:%S %p %z' # e.g. 01/22/2019 12:57:51 AM +0000
+NO_TIMESTAMP = np.iinfo(np.int64).min # Malformed published date, reads back as NaT
+JOB_DATE = re.compile(r'(\d{2})\D(\d{2})\D(\d{4})') # MM/DD/YYYY, any separator
+PARSE_CACHE_SIZE = int(os.environ.get('DATE_CACHE_SIZE', 65536)) # Parsed strings remembered per process
+
+# Function definitions
+@lru_cache(maxsize=4096)
+def parse_job_date(text):
+    """
+    Parses a job date.
+
+    Args:
+        text (string): Date such as '01/15/2022', days and months with two
+                       digits and years with four, separated by any
+                       character.
+
+    Returns:
+        day (date): The date.
+
+    Raises:
+        ValueError: If the date is malformed or does not exist.
+    """
+    match = JOB_DATE.fullmatch(text.strip())
+    if match is None:
+        raise ValueError(f'Dates must look like MM/DD/YYYY, got {text!r}')
+    month, day, year = (int(part) for part in match.groups())
+    try:
+        return date(year, month, day)
+    except ValueError:
+        raise ValueError(f'{text!r} is not a calendar date')
+
+def job_window(job):
+    """
+    Reads the timeframe of a job.
+
+    Args:
+        job (dict): Job dictionary.
+
+    Returns:
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+
+    Raises:
+        ValueError: If a date is malformed or the start is after the end.
+    """
+    start, end = job.get('start'), job.get('end')
+    if not isinstance(start, str) or not isinstance(end, str):
+        raise ValueError('start and end must be dates such as MM/DD/YYYY')
+    start_date = parse_job_date(start)
+    end_date = parse_job_date(end)
+    if start_date > end_date:
+        raise ValueError('The start date must not be after the end date')
+    return start_date, end_date
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def published_timestamp(published):
+    """
+    Converts the 'Published Date' string of an incident to a UNIX timestamp.
+    Results are cached, so a row seen again is not parsed again.
+
+    Args:
+        published (string): Date string such as '01/22/2019 12:57:51 AM +0000'.
+
+    Returns:
+        timestamp (int): Seconds since the epoch, None if malformed.
+    """
+    try:
+        return int(datetime.strptime(published, PUBLISHED_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def published_timestamps(values):
+    """
+    This function converts a column of 'Published Date' strings to UNIX
+    timestamps in one vectorized pass, parsing every distinct string once.
+
+    Args:
+        values (list): Date strings, None for missing ones.
+
+    Returns:
+        timestamps (ndarray): int64 seconds since the epoch, NO_TIMESTAMP
+                              where the string is malformed.
+    """
+    if len(values) == 0:
+        return np.array([], dtype=np.int64)
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), format=PUBLISHED_FORMAT, errors='coerce', utc=True, cache=True)
+    return parsed.dt.tz_localize(None).to_numpy().astype('datetime64[s]').astype(np.int64)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Imports
+from datetime import timedelta
+import numpy as np
+
+# Global variables / constants
+CHART_STEPS = ('time_of_day', 'hour', 'day', 'week', 'month', 'year')
+#Morning is defined as 6am-12pm, afternoon is 12pm-5pm (12-17 military time), evening is 5pm-10pm(17-22 military time), late_night is 10pm-6am (22-6military time). Notice that spread is 6hrs, 5hrs, 5hrs, then 8hrs. These are divided in unequal amounts on account of time periods of interest.
+TIME_OF_DAY = ['Morning', 'Afternoon', 'Evening', 'Late_night']
+TIME_OF_DAY_EDGES = [6 * 3600, 12 * 3600 + 1, 17 * 3600 + 1, 22 * 3600 + 1] # Seconds after midnight, the hour itself belongs to the earlier period
+_TIME_OF_DAY_BINS = [3, 0, 1, 2, 3] # np.digitize bin -> TIME_OF_DAY index
+_UNITS = {'hour': 'h', 'day': 'D', 'month': 'M', 'year': 'Y'}
+
+# Function definitions
+def chart_step(start_date, end_date):
+    """
+    Picks the chart bucket size from the job timeframe: the time of day for
+    a single day, days within one month, months within one year and years
+    otherwise.
+
+    Args:
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+
+    Returns:
+        step (string): One of CHART_STEPS.
+    """
+    if start_date.year != end_date.year:
+        return 'year'
+    if start_date.month != end_date.month:
+        return 'month'
+    if start_date.day != end_date.day:
+        return 'day'
+    return 'time_of_day'
+
+def time_of_day_index(seconds):
+    """
+    Maps seconds after midnight to their TIME_OF_DAY index.
+
+    Args:
+        seconds (array): Seconds after midnight.
+
+    Returns:
+        index (ndarray): Index into TIME_OF_DAY for every value.
+    """
+    return np.asarray(_TIME_OF_DAY_BINS)[np.digitize(seconds, TIME_OF_DAY_EDGES)]
+
+def _label(bucket, step):
+    """Formats the start of a calendar bucket for the chart axis"""
+    text = str(bucket)
+    if step == 'hour':
+        return text.replace('T', ' ') + ':00'
+    if step == 'week':
+        return f'Week of {text}'
+    return text
+
+def time_histogram(published, start_date, end_date, step, weights=None):
+    """
+    This function counts incidents per time bucket in one vectorized pass.
+    Calendar buckets are computed with datetime64 arithmetic so the edges
+    stay correct across month and year boundaries, and every bucket of the
+    timeframe is present even when empty.
+
+    Args:
+        published (array): datetime64 publish times of the incidents.
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+        step (string): One of CHART_STEPS.
+        weights (array): Optional number of incidents behind every publish
+                         time, used to re-bucket precomputed counts.
+
+    Returns:
+        chart (dict): Bucket label mapped to a one element list holding its
+                      incident count, in chronological order.
+    """
+    published = np.asarray(published, dtype='datetime64[s]')
+    weights = np.ones(len(published), dtype=np.int64) if weights is None else np.asarray(weights)
+    if step == 'time_of_day':
+        seconds = (published - published.astype('datetime64[D]')).astype(np.int64)
+        counts = np.bincount(time_of_day_index(seconds), weights=weights, minlength=len(TIME_OF_DAY))
+        return {name: [int(count)] for name, count in zip(TIME_OF_DAY, counts)}
+    if step == 'week':
+        first = np.datetime64(start_date - timedelta(days=start_date.weekday()), 'D') # Weeks start on Monday
+        last = np.datetime64(end_date, 'D')
+        index = (published.astype('datetime64[D]') - first).astype(np.int64) // 7
+        buckets = first + 7 * np.arange((last - first).astype(np.int64) // 7 + 1)
+    elif step in _UNITS:
+        unit = _UNITS[step]
+        first = np.datetime64(start_date, 'D').astype(f'datetime64[{unit}]')
+        if step == 'hour':
+            last = np.datetime64(end_date + timedelta(days=1), 'D').astype('datetime64[h]') - 1
+        else:
+            last = np.datetime64(end_date, 'D').astype(f'datetime64[{unit}]')
+        index = (published.astype(f'datetime64[{unit}]') - first).astype(np.int64)
+        buckets = np.arange(first, last + 1)
+    else:
+        raise ValueError(f'step must be one of {", ".join(CHART_STEPS)}')
+    inside = (index >= 0) & (index < len(buckets))
+    counts = np.bincount(index[inside], weights=weights[inside], minlength=len(buckets))
+    return {_label(bucket, step): [int(count)] for bucket, count in zip(buckets, counts)}
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+# Imports
+from jobs import rd # Incident database client
+from dates import published_timestamp, NO_TIMESTAMP
+import json
+import struct
+from collections import defaultdict
+import zlib
+import math
+import os
+from datetime import datetime, timedelta, timezone
+import logging
+import numpy as np
+import pandas as pd
+
+# Global variables / constants
+log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
+logging.basicConfig(level=log_var)
+
+SCAN_BATCH_SIZE = int(os.environ.get('SCAN_BATCH_SIZE', 1000))
+AUX_PREFIX = 'incidents:' # Bookkeeping keys kept next to the incident IDs
+PUBLISHED_INDEX = AUX_PREFIX + 'published' # Sorted set, ID scored by published timestamp
+LAT_RANGE = (10, 50) # Coordinates outside of these ranges are not in the Austin area
+LON_RANGE = (70, 120) # Absolute longitude, west
+SCHEMA_VERSION = 2 # First byte of every packed incident, legacy JSON incidents start with '{'
+UNCHECKED_VERSION = 1 # Packed incidents whose header coordinates were stored before validation
+COLUMNS_KEY = AUX_PREFIX + 'columns' # Hash of column set ID -> JSON list of the CSV columns
+QUARANTINE_KEY = AUX_PREFIX + 'quarantine' # Hash of traffic report ID -> JSON of the problems found at ingest
+QUARANTINE_COUNTS_KEY = AUX_PREFIX + 'quarantine:problems' # Hash of problem -> number of quarantined incidents with it
+# Packed header: schema version, column set ID, published timestamp, latitude, longitude (NaN unless valid), address length
+RECORD_HEADER = struct.Struct('<BIqddH')
+SEPARATOR = '\x1f' # Joins the remaining columns after the header
+_columns = {} # Column set ID -> column names, shared by every record of a feed
+
+# Function definitions
+def is_incident_key(key):
+    """
+    Checks whether a key of the incident database holds an incident, as
+    opposed to one of the bookkeeping structures stored next to them.
+
+    Args:
+        key (bytes or string): Redis key.
+
+    Returns:
+        result (bool): True for a traffic report ID.
+    """
+    if isinstance(key, bytes):
+        key = key.decode('utf8')
+    return not key.startswith(AUX_PREFIX)
+
+def validate_coordinates(incident):
+    """
+    Validates and normalizes the coordinates of an incident row. Longitudes
+    are stored negative (west) whichever sign the feed used.
+
+    Args:
+        incident (dict): Incident row from the dataset.
+
+    Returns:
+        lat (float): Latitude, NaN when the coordinates are not usable.
+        lon (float): Longitude, NaN when the coordinates are not usable.
+        problem (string): Why the coordinates are not usable, None if valid.
+    """
+    lat, lon = incident.get('Latitude'), incident.get('Longitude')
+    if not isinstance(lat, str) or not isinstance(lon, str) or not lat.strip() or not lon.strip():
+        return math.nan, math.nan, 'missing coordinates'
+    try:
+        lat, lon = float(lat), float(lon)
+    except ValueError:
+        return math.nan, math.nan, 'malformed coordinates'
+    lat, lon = checked_coordinates(lat, lon)
+    if math.isnan(lat):
+        return lat, lon, 'outside the Austin area'
+    return lat, lon, None
+
+def checked_coordinates(lat, lon):
+    """
+    Range checks parsed coordinates.
+
+    Args:
+        lat (float): Latitude.
+        lon (float): Longitude.
+
+    Returns:
+        coordinates (tuple): Latitude and normalized (negative) longitude,
+                             both NaN if outside of the Austin area.
+    """
+    if LAT_RANGE[0] <= lat <= LAT_RANGE[1] and LON_RANGE[0] <= abs(lon) <= LON_RANGE[1]:
+        return lat, -abs(lon)
+    return math.nan, math.nan
+
+def validate_incident(incident, timestamp):
+    """
+    This function checks an incident row once, at ingest, so analyses only
+    ever read coordinates that are known to be usable.
+
+    Args:
+        incident (dict): Incident row from the dataset.
+        timestamp (int): Published timestamp, None if malformed.
+
+    Returns:
+        lat (float): Normalized latitude, NaN when not usable.
+        lon (float): Normalized longitude, NaN when not usable.
+        problems (list): Reasons to quarantine the row, empty if valid.
+    """
+    lat, lon, problem = validate_coordinates(incident)
+    problems = [] if timestamp is not None else ['malformed published date']
+    if problem is not None:
+        problems.append(problem)
+    return lat, lon, problems
+
+def _column_set(columns):
+    """Returns the ID of a set of CSV columns, registering it on first use"""
+    column_id = zlib.crc32(SEPARATOR.join(columns).encode('utf8'))
+    if column_id not in _columns:
+        rd.hsetnx(COLUMNS_KEY, column_id, json.dumps(columns))
+        _columns[column_id] = columns
+    return column_id
+
+def _columns_of(column_id):
+    """Looks up the CSV columns of a column set ID"""
+    if column_id not in _columns:
+        columns = rd.hget(COLUMNS_KEY, column_id)
+        if columns is None:
+            raise ValueError(f'Unknown incident column set {column_id}')
+        _columns[column_id] = json.loads(columns)
+    return _columns[column_id]
+
+def forget_column_sets():
+    """Drops the known column sets, so they are registered again after the database was cleared"""
+    _columns.clear()
+
+def encode_incident(incident, timestamp=None, coordinates=None):
+    """
+    Packs an incident row for storage. A fixed-width header holds the
+    published timestamp and validated coordinates already parsed, followed
+    by the address and then the other columns as written in the feed, so
+    analyses read the header alone. Rows that do not fit the layout are
+    stored as JSON.
+
+    Args:
+        incident (dict): Incident row from the dataset.
+        timestamp (int): Published timestamp if already parsed.
+        coordinates (tuple): Latitude and longitude if already validated,
+                             see validate_incident.
+
+    Returns:
+        value (bytes): Packed incident.
+    """
+    columns = list(incident.keys())
+    values = list(incident.values())
+    if not all(isinstance(column, str) for column in columns) or not all(isinstance(value, str) and SEPARATOR not in value for value in values) or 'Address' not in incident:
+        return json.dumps(incident).encode('utf8')
+    address = incident['Address'].encode('utf8')
+    if len(address) > 0xFFFF:
+        return json.dumps(incident).encode('utf8')
+    if timestamp is None:
+        timestamp = published_timestamp(incident.get('Published Date'))
+    if coordinates is None:
+        coordinates = validate_coordinates(incident)[:2]
+    header = RECORD_HEADER.pack(SCHEMA_VERSION, _column_set(columns),
+                                NO_TIMESTAMP if timestamp is None else timestamp,
+                                coordinates[0], coordinates[1], len(address))
+    rest = SEPARATOR.join(value for column, value in zip(columns, values) if column != 'Address')
+    return header + address + rest.encode('utf8')
+
+def decode_incident(value):
+    """
+    Unpacks a stored incident back into its row.
+
+    Args:
+        value (bytes): Stored incident, packed or legacy JSON.
+
+    Returns:
+        incident (dict): Incident row, columns in feed order.
+
+    Raises:
+        ValueError: If the schema version is unknown.
+    """
+    if value[:1] == b'{':
+        return json.loads(value)
+    if value[0] not in (SCHEMA_VERSION, UNCHECKED_VERSION):
+        raise ValueError(f'Unknown incident schema version {value[0]}')
+    version, column_id, timestamp, lat, lon, address_length = RECORD_HEADER.unpack_from(value)
+    body = RECORD_HEADER.size + address_length
+    address = value[RECORD_HEADER.size:body].decode('utf8')
+    rest = iter(value[body:].decode('utf8').split(SEPARATOR))
+    return {column: address if column == 'Address' else next(rest) for column in _columns_of(column_id)}
+
+def decode_fields(value):
+    """
+    Reads the fields analyses need out of a stored incident, touching only
+    the header and address of packed incidents. Incidents stored before
+    coordinates were validated at ingest are validated here.
+
+    Args:
+        value (bytes): Stored incident, packed or legacy JSON.
+
+    Returns:
+        timestamp (int): Published timestamp, NO_TIMESTAMP if malformed.
+        lat (float): Latitude, NaN unless valid.
+        lon (float): Longitude, NaN unless valid.
+        address (string): Address.
+
+    Raises:
+        ValueError: If the schema version is unknown.
+    """
+    if value[:1] == b'{':
+        incident = json.loads(value)
+        timestamp = published_timestamp(incident.get('Published Date'))
+        lat, lon = validate_coordinates(incident)[:2]
+        return NO_TIMESTAMP if timestamp is None else timestamp, lat, lon, str(incident.get('Address', ''))
+    if value[0] not in (SCHEMA_VERSION, UNCHECKED_VERSION):
+        raise ValueError(f'Unknown incident schema version {value[0]}')
+    version, column_id, timestamp, lat, lon, address_length = RECORD_HEADER.unpack_from(value)
+    if version == UNCHECKED_VERSION:
+        lat, lon = checked_coordinates(lat, lon)
+    return timestamp, lat, lon, value[RECORD_HEADER.size:RECORD_HEADER.size + address_length].decode('utf8')
+
+def index_incident(client, incident, timestamp=None):
+    """
+    Adds an incident to the published date index. The client can be a
+    pipeline so the index update travels with the incident write.
+
+    Args:
+        client (Redis or Pipeline): Incident database client.
+        incident (dict): Incident row from the dataset.
+        timestamp (int): Published timestamp if already parsed.
+
+    Returns:
+        indexed (bool): False when the published date could not be parsed.
+    """
+    if timestamp is None:
+        timestamp = published_timestamp(incident.get('Published Date'))
+    if timestamp is None:
+        return False
+    client.zadd(PUBLISHED_INDEX, {incident['Traffic Report ID']: timestamp})
+    return True
+
+def quarantine_incident(client, incident, problems, previous=None):
+    """
+    Records the problems of an incident row found at ingest, or clears the
+    record of a row that is valid again, keeping the count of every problem
+    in step. The client can be a pipeline so the quarantine travels with the
+    incident write.
+
+    Args:
+        client (Redis or Pipeline): Incident database client.
+        incident (dict): Incident row from the dataset.
+        problems (list): Reasons found by validate_incident, empty if valid.
+        previous (bytes): Stored quarantine record of the row, None if it
+                          was not quarantined.
+    """
+    counts = defaultdict(int)
+    for problem in json.loads(previous)['problems'] if previous is not None else []:
+        counts[problem] -= 1
+    for problem in problems:
+        counts[problem] += 1
+    for problem, count in counts.items():
+        if count:
+            client.hincrby(QUARANTINE_COUNTS_KEY, problem, count)
+    if not problems:
+        if previous is not None:
+            client.hdel(QUARANTINE_KEY, incident['Traffic Report ID'])
+        return
+    client.hset(QUARANTINE_KEY, incident['Traffic Report ID'], json.dumps({
+        'problems': problems,
+        'Published Date': incident.get('Published Date'),
+        'Latitude': incident.get('Latitude'),
+        'Longitude': incident.get('Longitude'),
+    }))
+
+def recount_quarantine():
+    """
+    Counts the problems of the quarantined incidents once, when the
+    quarantine was recorded before its counts were kept.
+
+    Returns:
+        problems (dict): Problem mapped to its number of incidents.
+    """
+    if not rd.exists(QUARANTINE_KEY) or rd.exists(QUARANTINE_COUNTS_KEY):
+        return {}
+    problems = defaultdict(int)
+    for key, entry in rd.hscan_iter(QUARANTINE_KEY, count=SCAN_BATCH_SIZE):
+        for problem in json.loads(entry)['problems']:
+            problems[problem] += 1
+    if problems:
+        rd.hset(QUARANTINE_COUNTS_KEY, mapping=problems)
+    logging.info('Counted the problems of the quarantined incidents')
+    return dict(problems)
+
+def quarantine_report(cursor=0, limit=None):
+    """
+    This function reports the incidents quarantined at ingest: how many
+    there are by problem, read from the counts kept at ingest, and the
+    quarantined rows themselves.
+
+    Args:
+        cursor (int): HSCAN cursor to resume the rows from.
+        limit (int): Rows per page, None for every row.
+
+    Returns:
+        report (dict): 'count' of quarantined incidents, their number per
+                       'problems' entry, the 'incidents' (ID mapped to its
+                       problems and the raw date and coordinates) and the
+                       'cursor' of the next page (0 when done).
+    """
+    recount_quarantine()
+    count = rd.hlen(QUARANTINE_KEY)
+    problems = {key.decode('utf8'): int(value) for key, value in rd.hgetall(QUARANTINE_COUNTS_KEY).items()}
+    incidents = {}
+    if limit is None:
+        incidents = {key.decode('utf8'): json.loads(entry) for key, entry in rd.hscan_iter(QUARANTINE_KEY, count=SCAN_BATCH_SIZE)}
+        cursor = 0
+    else:
+        while len(incidents) < limit:
+            cursor, entries = rd.hscan(QUARANTINE_KEY, cursor, count=limit)
+            incidents.update((key.decode('utf8'), json.loads(entry)) for key, entry in entries.items())
+            if cursor == 0:
+                break
+    return {'count': count, 'problems': {problem: total for problem, total in problems.items() if total}, 'incidents': incidents, 'cursor': cursor}
+
+def has_published_index():
+    """Checks whether the published date index is available"""
+    return bool(rd.exists(PUBLISHED_INDEX))
+
+def _window_keys(start_date, end_date):
+    """
+    Yields the incident IDs published between the start and end dates
+    (inclusive). The published date index is used when present, so only
+    matching IDs are read; otherwise the whole keyspace is scanned. Index
+    pages continue from the last score read, so redis never walks past the
+    earlier pages, only past the IDs sharing that score.
+    """
+    if has_published_index():
+        low = datetime(start_date.year, start_date.month, start_date.day, tzinfo=timezone.utc).timestamp()
+        high = (datetime(end_date.year, end_date.month, end_date.day, tzinfo=timezone.utc) + timedelta(days=1)).timestamp()
+        skip = 0 # IDs already read with score low
+        while True:
+            page = rd.zrangebyscore(PUBLISHED_INDEX, low, f'({high}', start=skip, num=SCAN_BATCH_SIZE, withscores=True)
+            yield from (key for key, score in page)
+            if len(page) < SCAN_BATCH_SIZE:
+                return
+            last = page[-1][1]
+            ties = sum(1 for key, score in page if score == last)
+            skip = ties + skip if last == low else ties
+            low = last
+    else:
+        logging.warning('Published date index missing, scanning every incident')
+        for key in rd.scan_iter(count=SCAN_BATCH_SIZE):
+            if is_incident_key(key):
+                yield key
+
+def _read_records(start_date, end_date):
+    """
+    Reads the analysis fields of the incidents of a timeframe out of redis,
+    fetching the values in MGET batches instead of one GET per key.
+
+    Args:
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+
+    Returns:
+        records (list): (timestamp, lat, lon, address) of every incident,
+                        see decode_fields.
+    """
+    records = []
+    batch = []
+    for key in _window_keys(start_date, end_date):
+        batch.append(key)
+        if len(batch) >= SCAN_BATCH_SIZE:
+            records.extend(decode_fields(value) for value in rd.mget(batch) if value is not None)
+            batch = []
+    if batch:
+        records.extend(decode_fields(value) for value in rd.mget(batch) if value is not None)
+    return records
+
+def load_incidents(start_date, end_date):
+    """
+    This function loads all incidents published between the start and end
+    dates (inclusive) into columnar arrays so that every analysis of a job
+    can share one read of the database.
+
+    Args:
+        start_date (date): First day of the job timeframe.
+        end_date (date): Last day of the job timeframe.
+
+    Returns:
+        incidents (DataFrame): One row per incident with the columns
+                               'published' (datetime64), 'date'
+                               (datetime64, day resolution), 'time' (seconds
+                               after midnight), 'lat', 'lon' (floats, NaN
+                               unless valid), 'address' and 'valid' (True
+                               when the coordinates passed validation at
+                               ingest).
+    """
+    records = _read_records(start_date, end_date)
+    logging.debug(f'Scanned {len(records)} incidents from redis')
+    timestamps, latitudes, longitudes, addresses = zip(*records) if records else ((), (), (), ())
+    return incidents_frame(timestamps, latitudes, longitudes, list(addresses), start_date, end_date)
+
+def incidents_frame(timestamps, latitudes, longitudes, addresses, start_date, end_date):
+    """
+    Builds the columnar incidents of a timeframe, see load_incidents, from
+    parsed fields.
+
+    Args:
+        timestamps (array): Published UNIX seconds, NO_TIMESTAMP if malformed.
+        latitudes (array): Validated latitudes, NaN unless valid.
+        longitudes (array): Validated longitudes, NaN unless valid.
+        addresses (list or string): Addresses, or one value for every row.
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+
+    Returns:
+        incidents (DataFrame): Incidents published inside the timeframe.
+    """
+    frame = pd.DataFrame({
+        'published': np.asarray(timestamps, dtype=np.int64).astype('datetime64[s]'),
+        'lat': np.asarray(latitudes, dtype=float),
+        'lon': np.asarray(longitudes, dtype=float),
+        'address': addresses,
+    })
+    frame = frame[frame['published'].notna()]
+    frame['date'] = frame['published'].dt.normalize()
+    in_window = (frame['date'] >= pd.Timestamp(start_date)) & (frame['date'] <= pd.Timestamp(end_date))
+    frame = frame[in_window].reset_index(drop=True)
+    frame['time'] = (frame['published'] - frame['date']).dt.total_seconds().astype(np.int64)
+    frame['valid'] = frame['lat'].notna() & frame['lon'].notna()
+    return frame[['published', 'date', 'time', 'lat', 'lon', 'address', 'valid']]
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# Imports
+from jobs import rd, scan_batches # Incident database client
+from incidents import is_incident_key, index_incident, encode_incident, decode_fields, validate_incident, quarantine_incident, recount_quarantine, forget_column_sets, AUX_PREFIX, QUARANTINE_KEY
+from rollups import rollup_deltas, write_rollups, ROLLUPS_READY
+from standing import refresh_standing, get_standing_ids, standing_spans
+from snapshot import retire_snapshot
+from dates import published_timestamps, NO_TIMESTAMP
+from collections import defaultdict
+import requests
+import codecs
+import hashlib
+import csv
+import json
+import os
+import logging
+import time
+import numpy as np
+
+# Global variables / constants
+log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
+logging.basicConfig(level=log_var)
+
+DATA_URL = os.environ.get('DATA_URL', 'https://data.austintexas.gov/api/views/dx9v-zd7x/rows.csv?accessType=DOWNLOAD')
+CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 64 * 1024)) # Bytes per HTTP/file read
+BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 1000)) # Rows per redis pipeline
+DIGEST_KEY = AUX_PREFIX + 'digest' # Hash of traffic report ID -> content digest of the stored row
+CHANGES_CHANNEL = AUX_PREFIX + 'changes' # Pub/sub channel of the recent incidents each ingest changed, for live mode
+CHANGES_MAX_AGE = 7 * 86400 # Seconds back an incident published on CHANGES_CHANNEL may be, the longest live window
+CHANGES_RESET = 'reset' # Published on CHANGES_CHANNEL once the incidents were deleted
+INGEST_LOCK_KEY = AUX_PREFIX + 'ingest_lock' # Lock held while an ingest writes, so concurrent ingests never classify the same row twice
+INGEST_LOCK_TIMEOUT = 60 # Seconds an ingest may hold the lock between two batches
+
+# Function definitions
+def _read_chunks(source, chunk_size):
+    """
+    Yields the raw bytes of the dataset in chunks without holding the whole
+    file in memory.
+
+    Args:
+        source (string): An http(s) URL, a 'file://' URL or a local path.
+        chunk_size (int): Number of bytes per read.
+    """
+    if source.startswith(('http://', 'https://')):
+        with requests.get(source, stream=True) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size=chunk_size)
+    else:
+        path = source[len('file://'):] if source.startswith('file://') else source
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+def _iter_lines(chunks):
+    """
+    Incrementally decodes byte chunks and yields complete lines (newline
+    kept) for the CSV parser. Only '\\n' splits lines so quoted fields with
+    other line separators stay intact.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8-sig')(errors='replace')
+    tail = ''
+    for chunk in chunks:
+        pieces = (tail + decoder.decode(chunk)).split('\n')
+        tail = pieces.pop()
+        for piece in pieces:
+            yield piece + '\n'
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+def iter_rows(source=None, chunk_size=None):
+    """
+    Streams the rows of the traffic incident CSV.
+
+    Args:
+        source (string): Dataset location, defaults to DATA_URL.
+        chunk_size (int): Number of bytes per read, defaults to CHUNK_SIZE.
+
+    Returns:
+        rows (iterator): Incident dictionaries keyed by the CSV header.
+    """
+    source = source or DATA_URL
+    chunk_size = chunk_size or CHUNK_SIZE
+    logging.info(f'Streaming dataset from {source}')
+    return csv.DictReader(_iter_lines(_read_chunks(source, chunk_size)))
+
+def row_digest(row):
+    """
+    Computes a content digest of an incident row so a re-ingested row can
+    be compared against the stored one without reading it back. The values
+    of a row with more fields than the header are under the key None, so
+    the keys are made strings before sorting.
+
+    Args:
+        row (dict): Incident row from the dataset.
+
+    Returns:
+        digest (bytes): SHA-1 digest of the row.
+    """
+    return hashlib.sha1(json.dumps({str(key): value for key, value in row.items()}, sort_keys=True).encode('utf8')).digest()
+
+def _store_batch(batch, delta, counts, append=False, added=None, changes=None, lock=None):
+    """
+    Classifies a batch of rows as added, updated or unchanged against the
+    stored digests and writes them, with their rollup changes, through one
+    pipeline. Every written row is validated once here: its coordinates are
+    stored normalized (NaN unless valid) and rows with problems are
+    quarantined. In delta mode the unchanged rows are not written again, in
+    append mode no stored incident is. The (row, timestamp, lat, lon) of
+    every added row is appended to added when given, and the incidents that
+    left or entered the data to changes, see standing.refresh_standing.
+    The ingest lock is extended before the batch is read and again before
+    it is written.
+    """
+    if lock is not None:
+        lock.reacquire()
+    batch = list({row['Traffic Report ID']: row for row in batch}.values()) # Last copy of a repeated ID wins
+    ids = [row['Traffic Report ID'] for row in batch]
+    pipe = rd.pipeline(transaction=False)
+    pipe.hmget(DIGEST_KEY, ids)
+    pipe.hmget(QUARANTINE_KEY, ids)
+    stored_digests, quarantined = pipe.execute()
+    timestamps = published_timestamps([row.get('Published Date') for row in batch]) # Parsed once for the record, index and rollups
+    pipe = rd.pipeline(transaction=False)
+    updated = []
+    changed = ([], [], []) # Timestamps, latitudes and longitudes of added or updated rows
+    for row, stored_digest, previous, timestamp in zip(batch, stored_digests, quarantined, timestamps):
+        timestamp = None if timestamp == NO_TIMESTAMP else int(timestamp)
+        digest = row_digest(row)
+        if stored_digest is None:
+            counts['added'] += 1
+        elif append:
+            counts['unchanged'] += 1
+            continue
+        elif stored_digest != digest:
+            counts['updated'] += 1
+            updated.append(row['Traffic Report ID'])
+        else:
+            counts['unchanged'] += 1
+            if delta:
+                continue
+        lat, lon, problems = validate_incident(row, timestamp)
+        if problems:
+            counts['quarantined'] += 1
+        if stored_digest is None and added is not None:
+            added.append((row, timestamp, lat, lon))
+        if stored_digest != digest:
+            if not changed[0]:
+                retire_snapshot(pipe) # Queued ahead of the first changed write
+            changed[0].append(NO_TIMESTAMP if timestamp is None else timestamp)
+            changed[1].append(lat)
+            changed[2].append(lon)
+        pipe.set(row['Traffic Report ID'], encode_incident(row, timestamp, (lat, lon)))
+        pipe.hset(DIGEST_KEY, row['Traffic Report ID'], digest)
+        quarantine_incident(pipe, row, problems, previous)
+        index_incident(pipe, row, timestamp)
+    # Updated incidents leave their old contribution before adding the new one
+    deltas = defaultdict(int)
+    if updated:
+        previous = [decode_fields(value) for value in rd.mget(updated) if value is not None]
+        if previous:
+            timestamps, latitudes, longitudes, _ = zip(*previous)
+            rollup_deltas(timestamps, latitudes, longitudes, -1, deltas)
+            if changes is not None:
+                changes.append((np.array(timestamps, dtype=np.int64), np.array(latitudes, dtype=float), np.array(longitudes, dtype=float), -1))
+    rollup_deltas(*changed, 1, deltas)
+    if changes is not None and changed[0]:
+        changes.append((np.array(changed[0], dtype=np.int64), np.array(changed[1], dtype=float), np.array(changed[2], dtype=float), 1))
+    write_rollups(pipe, deltas)
+    if lock is not None:
+        lock.reacquire()
+    pipe.execute()
+
+def load_feed(source=None, batch_size=None, chunk_size=None, delta=False):
+    """
+    This function streams the dataset into redis. Rows are written, together
+    with their published date index entry, content digest and rollup
+    counters, through pipelines flushed every batch_size rows, so memory
+    stays bounded by the batch and not the feed. In delta mode only new or
+    changed incidents are written.
+
+    Args:
+        source (string): Dataset location, defaults to DATA_URL.
+        batch_size (int): Rows per pipeline, defaults to BATCH_SIZE.
+        chunk_size (int): Number of bytes per read, defaults to CHUNK_SIZE.
+        delta (bool): Skip rows whose content matches the stored incident.
+
+    Returns:
+        counts (dict): Number of rows added, updated, unchanged and skipped
+                       (rows without a traffic report ID), and of written
+                       rows quarantined for invalid coordinates or dates.
+    """
+    return store_rows(iter_rows(source, chunk_size), batch_size, delta)
+
+def _changes_within(changes, spans):
+    """Keeps the incidents of changes published within any of the (first, last) UNIX times of spans, last excluded"""
+    kept = []
+    for timestamps, latitudes, longitudes, sign in changes:
+        keep = np.zeros(len(timestamps), dtype=bool)
+        for first, last in spans:
+            keep |= (timestamps != NO_TIMESTAMP) & (timestamps >= first) & (timestamps < last)
+        if keep.any():
+            kept.append((timestamps[keep], latitudes[keep], longitudes[keep], sign))
+    return kept
+
+def _trim_batch(added, changes, stored, spans, since):
+    """
+    Drops the rows added by the last batch published before the UNIX time
+    since, only live mode needs them, and the changes of the batch outside
+    the spans of the standing queries and of live mode. stored holds the
+    lengths of added and changes before the batch.
+    """
+    if added is not None:
+        added[stored[0]:] = [entry for entry in added[stored[0]:] if entry[1] is not None and entry[1] >= since]
+    changes[stored[1]:] = _changes_within(changes[stored[1]:], spans)
+
+def publish_changes(changes):
+    """
+    Publishes the incidents an ingest changed on CHANGES_CHANNEL, as JSON
+    lists of [timestamps, latitudes, longitudes, sign], see
+    standing.refresh_standing.
+
+    Args:
+        changes (list): (timestamps, latitudes, longitudes, sign) tuples.
+    """
+    if changes:
+        rd.publish(CHANGES_CHANNEL, json.dumps([[timestamps.tolist(), latitudes.tolist(), longitudes.tolist(), sign] for timestamps, latitudes, longitudes, sign in changes]))
+
+def publish_reset():
+    """Tells live mode on CHANGES_CHANNEL that every incident was deleted"""
+    rd.publish(CHANGES_CHANNEL, json.dumps(CHANGES_RESET))
+
+def store_rows(rows, batch_size=None, delta=False, append=False, added=None):
+    """
+    Writes incident rows into redis in pipelined batches, see load_feed.
+    Ingests run one at a time under a lock, since a batch is classified
+    from the stored digests before it is written. The standing queries
+    registered when it starts are then refreshed from the incidents that
+    changed inside their timeframes, and the changes published in the last
+    CHANGES_MAX_AGE seconds are published for live mode.
+
+    Args:
+        rows (iterable): Incident dictionaries keyed by the CSV header.
+        batch_size (int): Rows per pipeline, defaults to BATCH_SIZE.
+        delta (bool): Skip rows whose content matches the stored incident.
+        append (bool): Only write rows whose traffic report ID is new.
+        added (list): Receives (row, timestamp, lat, lon) of every added
+                      row published in the last CHANGES_MAX_AGE seconds,
+                      see incidents.validate_incident.
+
+    Returns:
+        counts (dict): Number of rows added, updated, unchanged, skipped
+                       and quarantined, see load_feed.
+    """
+    batch_size = batch_size or BATCH_SIZE
+    counts = {'added': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'quarantined': 0}
+    standing = get_standing_ids()
+    since = time.time() - CHANGES_MAX_AGE
+    spans = standing_spans(standing) + [(since, np.inf)] # Only the changes standing queries or live mode apply are kept
+    changes = []
+    batch = []
+    lock = rd.lock(INGEST_LOCK_KEY, timeout=INGEST_LOCK_TIMEOUT)
+    with lock:
+        # Rollups are only complete if they were kept since the database was empty
+        rollups_complete = rd.exists(ROLLUPS_READY) or next(scan_batches(rd, is_incident_key), None) is None
+        forget_column_sets()
+        recount_quarantine()
+        for row in rows:
+            if not row.get('Traffic Report ID'):
+                counts['skipped'] += 1
+                continue
+            batch.append(row)
+            if len(batch) >= batch_size:
+                stored = (len(added or ()), len(changes))
+                _store_batch(batch, delta, counts, append, added, changes, lock)
+                batch = []
+                _trim_batch(added, changes, stored, spans, since)
+        if batch:
+            stored = (len(added or ()), len(changes))
+            _store_batch(batch, delta, counts, append, added, changes, lock)
+            _trim_batch(added, changes, stored, spans, since)
+        if rollups_complete:
+            rd.set(ROLLUPS_READY, 1)
+        else:
+            logging.warning('Rollups predate this data, clear it with DELETE /data and reload to enable them')
+    if standing:
+        refresh_standing(changes, standing)
+    publish_changes(_changes_within(changes, [(since, np.inf)]))
+    logging.debug(f'Ingest finished: {counts}')
+    return counts
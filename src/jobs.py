@@ -2,20 +2,92 @@
 
 import json
 import uuid
+import hashlib
+import zlib
+import time
 import redis
-from hotqueue import HotQueue
+from regions import region_config, DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID
+from histograms import chart_step
+from maps import map_level
+from dates import job_window
 import logging
 import os
 
 env_var = os.environ.get('REDIS_IP')
 rd = redis.Redis(host=env_var, port=6379, db=0)
-q = HotQueue("queue", host=env_var, port=6379, db=1)
+sched = redis.Redis(host=env_var, port=6379, db=1)
 jdb = redis.Redis(host=env_var, port=6379, db=2)
 results = redis.Redis(host=env_var, port=6379, db=3)
 
 log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
 logging.basicConfig(level=log_var)
 
+SCAN_COUNT = int(os.environ.get('SCAN_COUNT', 1000)) # Keys per SCAN/MGET round trip
+CACHE_PREFIX = 'cache:' # Result cache entries live in the results database next to the job results
+CACHE_VERSION_KEY = CACHE_PREFIX + 'version' # Dataset version, bumped whenever the incidents change
+CACHE_LRU_KEY = CACHE_PREFIX + 'lru' # Sorted set of entry keys scored by last use
+CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256)) # Most entries kept
+CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 24 * 3600)) # Seconds an entry lives
+RESULT_PREFIX = 'result:' # Hash of result component -> JSON per job, the map stored apart under 'result:<jobid>:map'
+RESULT_COMPONENTS = ['summary', 'map', 'chart', 'report'] # Order of the components in a result list
+RESULT_CHUNK_SIZE = int(os.environ.get('RESULT_CHUNK_SIZE', 64 * 1024)) # Bytes per GETRANGE when streaming a map
+IMAGE_PREFIX = 'images:' # Hash of image name -> PNG bytes (plus '<name>.etag') per job in the results database
+EXPRESS_QUEUE = 'schedule:express' # Sorted sets of queued job IDs, scored by scheduling time
+BATCH_QUEUE = 'schedule:batch'
+QUEUED_COST_KEY = 'schedule:cost' # Hash of queued job ID -> estimated cost
+RATE_KEY = 'schedule:rate' # Observed seconds per unit of cost
+EXPRESS_COST = float(os.environ.get('EXPRESS_COST', 10)) # Jobs up to this cost go to the express queue
+COST_DELAY = float(os.environ.get('SCHEDULE_COST_DELAY', 2)) # Seconds a job is pushed back per unit of cost
+MAX_DELAY = float(os.environ.get('SCHEDULE_MAX_DELAY', 600)) # Most a job can be overtaken by later jobs
+PRIORITY_STEP = float(os.environ.get('SCHEDULE_PRIORITY_STEP', 60)) # Seconds a job moves ahead per priority level
+ROLLUP_DAY_COST = 0.01 # Cost of one day answered from the rollups
+RAW_DAY_COST = 1.0 # Cost of one day of incidents read, and again of one day of map points
+DEFAULT_RATE = 0.05 # Seconds per unit of cost before any job was timed
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', 4)) # Jobs run at once by one worker process
+
+def scan_batches(client, key_filter=None):
+    """
+    Walks the keyspace of a database with SCAN, yielding the keys in
+    batches so redis is never blocked by a full KEYS walk.
+
+    Args:
+        client (Redis): Database client.
+        key_filter (function): Optional predicate, keys failing it are dropped.
+    """
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor=cursor, count=SCAN_COUNT)
+        if key_filter is not None:
+            keys = [key for key in keys if key_filter(key)]
+        if keys:
+            yield keys
+        if cursor == 0:
+            return
+
+def scan_page(client, cursor=0, limit=100, key_filter=None):
+    """
+    Reads one page of keys starting at a SCAN cursor. SCAN works in whole
+    steps, so a page can hold slightly more than limit keys.
+
+    Args:
+        client (Redis): Database client.
+        cursor (int): Cursor returned by the previous page, 0 to start.
+        limit (int): Number of keys wanted.
+        key_filter (function): Optional predicate, keys failing it are dropped.
+
+    Returns:
+        cursor (int): Cursor of the next page, 0 once the walk is complete.
+        keys (list): Keys of this page.
+    """
+    page = []
+    while True:
+        cursor, keys = client.scan(cursor=cursor, count=min(limit, SCAN_COUNT))
+        if key_filter is not None:
+            keys = [key for key in keys if key_filter(key)]
+        page.extend(keys)
+        if cursor == 0 or len(page) >= limit:
+            return cursor, page
+
 def _generate_jid():
     """
     Generate a pseudo-random identifier for a job.
@@ -23,10 +95,13 @@ def _generate_jid():
     logging.info('Generating new job ID')
     return str(uuid.uuid4())
 
-def _instantiate_job(jid, status, start, end, austin_map, graph, report):
+def _instantiate_job(jid, status, start, end, austin_map, graph, report, region_center=None, region_tolerance=None, region_grid=None, chart_step=None, priority=0, map_mode=None):
     """
     Create the job object description as a python dictionary. Requires the job id,
-    status, start and end parameters, and yes or no for other data requests
+    status, start and end parameters, and yes or no for other data requests.
+    The region parameters are optional and default to downtown Austin, the
+    chart step and map mode are optional and picked from the timeframe by the
+    worker. A higher priority runs the job sooner.
     """
     logging.info('Formatting new job')
     return {'id': jid,
@@ -35,59 +110,408 @@ def _instantiate_job(jid, status, start, end, austin_map, graph, report):
             'end': end,
             'incident_map': austin_map,
             'incident_graph': graph,
-            'incident_report': report }
+            'incident_report': report,
+            'region_center': region_center,
+            'region_tolerance': region_tolerance,
+            'region_grid': region_grid,
+            'chart_step': chart_step,
+            'priority': priority,
+            'map_mode': map_mode,
+            'started': None,
+            'finished': None }
 
 def _save_job(jid, job_dict):
-    """Save a job object in the Redis database."""
-    jdb.set(jid, json.dumps(job_dict))
+    """Save a job object in the Redis database, as a hash of JSON encoded fields."""
+    pipe = jdb.pipeline()
+    pipe.delete(jid) # Jobs stored as one JSON string by older versions
+    pipe.hset(jid, mapping={field: json.dumps(value) for field, value in job_dict.items()})
+    pipe.execute()
     return
 
-def _queue_job(jid):
-    """Add a job to the redis queue."""
-    q.put(jid)
+def _decode_job(fields):
+    """Turns the fields of a job hash back into the job dictionary"""
+    return {field.decode('utf8'): json.loads(value) for field, value in fields.items()}
+
+def _read_jobs(keys):
+    """Reads many jobs in one round trip, skipping keys that vanished"""
+    pipe = jdb.pipeline(transaction=False)
+    for key in keys:
+        pipe.hgetall(key)
+    jobs = []
+    for key, fields in zip(keys, pipe.execute(raise_on_error=False)):
+        if isinstance(fields, redis.ResponseError):
+            value = jdb.get(key) # Job stored as one JSON string by older versions
+            if value is not None:
+                jobs.append(json.loads(value))
+        elif fields:
+            jobs.append(_decode_job(fields))
+    return jobs
+
+def estimate_cost(job_dict):
+    """
+    Estimates the work of a job from its timeframe and requested outputs.
+    Summaries, charts and default region reports are answered from the
+    daily rollups, while maps and custom region grids read every incident
+    of the timeframe, and maps of single incidents also carry them all.
+
+    Args:
+        job_dict (dict): Job dictionary.
+
+    Returns:
+        cost (float): Estimated cost, about one unit per day of incidents read.
+    """
+    try:
+        start_date, end_date = job_window(job_dict)
+        days = (end_date - start_date).days + 1
+        regions = region_config(job_dict)
+        map_mode, map_cell = map_level(job_dict, start_date, end_date)
+    except (TypeError, ValueError):
+        return 1.0 # Malformed jobs fail at once
+    days = max(days, 1)
+    map_request = job_dict['incident_map'] == 'yes'
+    raw = map_request or (job_dict['incident_report'] == 'yes' and regions != (DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID))
+    cost = 1.0 + days * ROLLUP_DAY_COST
+    if raw:
+        cost += days * RAW_DAY_COST
+    if map_request and map_mode == 'points':
+        cost += days * RAW_DAY_COST
+    return cost
+
+def _queue_job(job_dict):
+    """
+    Add a job to the scheduler. Jobs are scored by submission time pushed
+    back by their cost, capped at MAX_DELAY, and pulled forward by their
+    priority, so cheap jobs overtake expensive ones but an expensive job
+    is never overtaken by jobs submitted more than MAX_DELAY after it.
+    Cheap jobs go to the express queue, which has worker slots of its own.
+    """
+    cost = estimate_cost(job_dict)
+    score = time.time() + min(cost * COST_DELAY, MAX_DELAY) - job_dict.get('priority', 0) * PRIORITY_STEP
+    queue = EXPRESS_QUEUE if cost <= EXPRESS_COST else BATCH_QUEUE
+    pipe = sched.pipeline()
+    pipe.hset(QUEUED_COST_KEY, job_dict['id'], cost)
+    pipe.zadd(queue, {job_dict['id']: score})
+    pipe.execute()
     return
 
-def add_job(start, end, austin_map, graph, report, status="submitted"):
-    """Add a job to the redis queue."""
+def pop_job(express_only=False, timeout=1):
+    """
+    Takes the next job off the scheduler, waiting up to timeout seconds
+    for one. The job with the lowest score of both queues wins, unless
+    only the express queue is read.
+
+    Args:
+        express_only (bool): Only take cheap jobs.
+        timeout (int): Seconds to wait on empty queues.
+
+    Returns:
+        jid (string): Job ID, None if no job arrived in time.
+        cost (float): Estimated cost of the job.
+    """
+    queues = [EXPRESS_QUEUE] if express_only else [EXPRESS_QUEUE, BATCH_QUEUE]
+    while True:
+        pipe = sched.pipeline(transaction=False)
+        for queue in queues:
+            pipe.zrange(queue, 0, 0, withscores=True)
+        heads = [(head[0][1], queue, head[0][0]) for queue, head in zip(queues, pipe.execute()) if head]
+        if not heads:
+            popped = sched.bzpopmin(queues, timeout)
+            if popped is None:
+                return None, 0.0
+            jid = popped[1]
+            break
+        score, queue, jid = min(heads)
+        if sched.zrem(queue, jid): # Another worker may have taken it first
+            break
+    pipe = sched.pipeline()
+    pipe.hget(QUEUED_COST_KEY, jid)
+    pipe.hdel(QUEUED_COST_KEY, jid)
+    cost = pipe.execute()[0]
+    return jid.decode('utf8'), float(cost or 1.0)
+
+def record_job_time(cost, seconds):
+    """Folds the run time of a job into the observed seconds per unit of cost"""
+    rate = seconds / max(cost, 1.0)
+    previous = sched.get(RATE_KEY)
+    if previous is not None:
+        rate = 0.8 * float(previous) + 0.2 * rate
+    sched.set(RATE_KEY, rate)
+
+def queue_stats():
+    """
+    Reports the state of the scheduler.
+
+    Returns:
+        depth (int): Number of queued jobs.
+        wait (float): Estimated seconds until the queued work is done by
+                      one worker running WORKER_CONCURRENCY jobs at once.
+    """
+    pipe = sched.pipeline(transaction=False)
+    pipe.zcard(EXPRESS_QUEUE)
+    pipe.zcard(BATCH_QUEUE)
+    pipe.hvals(QUEUED_COST_KEY)
+    pipe.get(RATE_KEY)
+    express, batch, costs, rate = pipe.execute()
+    rate = float(rate) if rate is not None else DEFAULT_RATE
+    wait = sum(float(cost) for cost in costs) * rate / max(1, WORKER_CONCURRENCY)
+    return express + batch, round(wait, 2)
+
+def add_job(start, end, austin_map, graph, report, status="submitted", region_center=None, region_tolerance=None, region_grid=None, chart_step=None, priority=0, map_mode=None):
+    """Add a job to the scheduler, or complete it at once from the result cache."""
     logging.info('Adding new job to queue')
     jid = _generate_jid()
-    job_dict = _instantiate_job(jid, status, start, end, austin_map, graph, report)
+    job_dict = _instantiate_job(jid, status, start, end, austin_map, graph, report, region_center, region_tolerance, region_grid, chart_step, priority, map_mode)
+    cache_key = job_cache_key(job_dict)
+    version = dataset_version()
+    cached = get_cached_result(cache_key, version)
+    if cached is not None:
+        logging.info('Job answered from the result cache')
+        job_dict['status'] = 'Complete'
+        post_images(jid, get_cached_images(cache_key, version))
+        post_result(jid, cached)
+        _save_job(jid, job_dict)
+        return job_dict
     _save_job(jid, job_dict)
-    _queue_job(jid)
+    _queue_job(job_dict)
     return job_dict
 
 def get_job_by_id(jid):
     """Return job dictionary given jid"""
     logging.info('Getting job ID from database')
-    return json.loads(jdb.get(jid))
+    jobs = _read_jobs([jid])
+    if not jobs:
+        raise KeyError(f'No job {jid}')
+    return jobs[0]
+
+def iter_jobs():
+    """Yields every job dictionary, reading them in SCAN/pipelined batches"""
+    for keys in scan_batches(jdb):
+        yield from _read_jobs(keys)
+
+def get_jobs_page(cursor=0, limit=100):
+    """Returns the next SCAN cursor and one page of job dictionaries"""
+    cursor, keys = scan_page(jdb, cursor, limit)
+    return cursor, _read_jobs(keys) if keys else []
 
 def get_job_ids():
     """Returns all job ids"""
     logging.info('Getting all job IDs from database')
-    return_value = []
-    for item in jdb.keys():
-        return_value.append(json.loads(jdb.get(item)))
+    return_value = list(iter_jobs())
     logging.debug('Successfully parsed through job database')
     return return_value
 
+def _status_fields(status):
+    """The job fields changed by a status, with the time the job started or finished"""
+    fields = {'status': status}
+    if status == 'In Progress':
+        fields['started'] = time.time()
+    elif status == 'Complete':
+        fields['finished'] = time.time()
+    return {field: json.dumps(value) for field, value in fields.items()}
+
 def update_job_status(jid, status):
-    """Update the status of job with job id `jid` to status `status`."""
+    """Update the status of job with job id `jid` to status `status`, in one atomic HSET."""
     logging.info('Updating job status')
-    job_dict = get_job_by_id(jid)
-    if job_dict:
-        job_dict['status'] = status
+    try:
+        jdb.hset(jid, mapping=_status_fields(status))
+    except redis.ResponseError:
+        job_dict = get_job_by_id(jid) # Job stored as one JSON string by older versions
+        job_dict.update({field: json.loads(value) for field, value in _status_fields(status).items()})
         _save_job(jid, job_dict)
-    else:
-        logging.warning('Problem reading the job status')
-        raise Exception()
+
+def start_job(jid):
+    """
+    Marks a job as in progress and reads it, in one round trip.
+
+    Args:
+        jid (string): Job ID.
+
+    Returns:
+        job_dict (dict): The job, as the worker runs it.
+    """
+    pipe = jdb.pipeline()
+    pipe.exists(jid)
+    pipe.hset(jid, mapping=_status_fields('In Progress'))
+    pipe.hgetall(jid)
+    try:
+        exists, changed, fields = pipe.execute()
+    except redis.ResponseError:
+        update_job_status(jid, 'In Progress')
+        return get_job_by_id(jid)
+    if not exists:
+        jdb.delete(jid)
+        raise KeyError(f'No job {jid}')
+    return _decode_job(fields)
 
 def post_result(jid, result):
-    """Sends result to results database"""
+    """
+    Sends result to results database, one hash field per component. A
+    requested map is compressed and stored apart, so reading the other
+    components never loads it and it can be streamed in chunks.
+
+    Args:
+        jid (string): Job ID.
+        result (list): [summary, map, chart, report].
+    """
     logging.info('Posting job result to redis database')
-    results.set(jid, json.dumps(result))
+    key = RESULT_PREFIX + jid
+    fields = dict(zip(RESULT_COMPONENTS, result))
+    pipe = results.pipeline()
+    pipe.delete(key, key + ':map')
+    if isinstance(fields['map'], dict):
+        pipe.set(key + ':map', zlib.compress(json.dumps(fields['map']).encode('utf8')))
+        fields['map'] = True # Marks the map as stored apart
+    pipe.hset(key, mapping={name: json.dumps(value) for name, value in fields.items()})
+    pipe.execute()
     return 
 
+def get_result_parts(jid, names):
+    """
+    Receives some components of a result from results database.
+
+    Args:
+        jid (string): Job ID.
+        names (list): Components wanted, out of RESULT_COMPONENTS.
+
+    Returns:
+        parts (dict): Component name mapped to its value, the map being
+                      True when it is stored apart (see iter_result_map),
+                      None if the job has no result.
+    """
+    values = results.hmget(RESULT_PREFIX + jid, names)
+    if all(value is None for value in values):
+        legacy = results.get(jid) # Results stored as one JSON list by older versions
+        if legacy is None:
+            return None
+        return {name: value for name, value in zip(RESULT_COMPONENTS, json.loads(legacy)) if name in names}
+    return {name: json.loads(value) for name, value in zip(names, values) if value is not None}
+
+def iter_result_map(jid, chunk_size=None):
+    """
+    Streams the JSON of a stored map as bytes, reading the compressed value
+    in GETRANGE chunks so memory stays flat however big the map is.
+
+    Args:
+        jid (string): Job ID.
+        chunk_size (int): Compressed bytes per read, defaults to RESULT_CHUNK_SIZE.
+    """
+    key = RESULT_PREFIX + jid + ':map'
+    chunk_size = chunk_size or RESULT_CHUNK_SIZE
+    decompressor = zlib.decompressobj()
+    size = results.strlen(key)
+    for offset in range(0, size, chunk_size):
+        text = decompressor.decompress(results.getrange(key, offset, offset + chunk_size - 1))
+        if text:
+            yield text
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
 def get_result(jid):
-    """Receives result from results database"""
+    """Receives the whole result, [summary, map, chart, report], from results database"""
     logging.info('Getting job result from redis database')
-    return json.loads(results.get(jid))
+    parts = get_result_parts(jid, RESULT_COMPONENTS)
+    if parts is None:
+        return None
+    if parts['map'] is True:
+        parts['map'] = json.loads(b''.join(iter_result_map(jid)))
+    return [parts[name] for name in RESULT_COMPONENTS]
+
+def post_images(jid, images):
+    """
+    Stores the rendered images of a job with their ETags.
+
+    Args:
+        jid (string): Job ID.
+        images (dict): Image name mapped to its PNG bytes.
+    """
+    if not images:
+        return
+    mapping = {}
+    for name, image in images.items():
+        if name.endswith('.etag'):
+            continue
+        mapping[name] = image
+        mapping[name + '.etag'] = hashlib.sha1(image).hexdigest()
+    results.hset(IMAGE_PREFIX + jid, mapping=mapping)
+
+def get_image_etag(jid, name):
+    """Returns the ETag of a stored job image, None if there is no such image"""
+    etag = results.hget(IMAGE_PREFIX + jid, name + '.etag')
+    return etag.decode('utf8') if etag is not None else None
+
+def get_image(jid, name):
+    """Returns the PNG bytes of a stored job image, None if there is no such image"""
+    return results.hget(IMAGE_PREFIX + jid, name)
+
+def job_cache_key(job_dict):
+    """
+    Derives the canonical key of a job's parameters. Dates are reduced to
+    the fields the worker reads and parameters of outputs that were not
+    requested are ignored, so equivalent jobs share one key.
+    """
+    params = {'map': job_dict['incident_map'] == 'yes',
+              'graph': job_dict['incident_graph'] == 'yes',
+              'report': job_dict['incident_report'] == 'yes'}
+    try:
+        start_date, end_date = job_window(job_dict)
+        params['start'], params['end'] = start_date.isoformat(), end_date.isoformat()
+        if params['map']:
+            params['map_level'] = map_level(job_dict, start_date, end_date)
+        if params['graph']:
+            params['chart_step'] = job_dict.get('chart_step') or chart_step(start_date, end_date)
+        if params['report']:
+            params['regions'] = region_config(job_dict)
+    except (TypeError, ValueError):
+        return None # Malformed jobs are never cached
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf8')).hexdigest()
+
+def dataset_version():
+    """Returns the current version of the incident data"""
+    return int(results.get(CACHE_VERSION_KEY) or 0)
+
+def get_cached_result(key, version):
+    """Returns the cached result of a job key for a dataset version, None on a miss"""
+    if key is None:
+        return None
+    entry = f'{CACHE_PREFIX}{version}:{key}'
+    value = results.get(entry)
+    if value is None:
+        return None
+    results.zadd(CACHE_LRU_KEY, {entry: time.time()})
+    return json.loads(value)
+
+def get_cached_images(key, version):
+    """Returns the cached images of a job key for a dataset version, empty on a miss"""
+    if key is None:
+        return {}
+    return {name.decode('utf8'): image for name, image in results.hgetall(f'{CACHE_PREFIX}{version}:{key}:images').items()}
+
+def cache_result(key, version, result, images=None):
+    """
+    Stores a job result, and its rendered images, in the cache, evicting the
+    least recently used entries beyond CACHE_SIZE. Entries also expire after
+    CACHE_TTL seconds.
+    """
+    if key is None:
+        return
+    entry = f'{CACHE_PREFIX}{version}:{key}'
+    pipe = results.pipeline()
+    pipe.set(entry, json.dumps(result), ex=CACHE_TTL)
+    if images:
+        pipe.hset(entry + ':images', mapping=images)
+        pipe.expire(entry + ':images', CACHE_TTL)
+    pipe.zadd(CACHE_LRU_KEY, {entry: time.time()})
+    pipe.zremrangebyscore(CACHE_LRU_KEY, '-inf', time.time() - CACHE_TTL) # Expired entries
+    pipe.execute()
+    excess = results.zcard(CACHE_LRU_KEY) - CACHE_SIZE
+    if excess > 0:
+        evicted = [member for member, score in results.zpopmin(CACHE_LRU_KEY, excess)]
+        results.delete(*evicted, *[member + b':images' for member in evicted])
+
+def invalidate_cache():
+    """Bumps the dataset version and drops every cached result"""
+    logging.info('Invalidating the result cache')
+    results.incr(CACHE_VERSION_KEY)
+    for keys in scan_batches(results, lambda key: key.startswith(CACHE_PREFIX.encode('utf8')) and key != CACHE_VERSION_KEY.encode('utf8')):
+        results.unlink(*keys)
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# Imports
+from jobs import rd, invalidate_cache # Incident database client and result cache
+from ingest import store_rows, iter_rows, CHANGES_CHANNEL, CHANGES_RESET
+from incidents import load_incidents, AUX_PREFIX
+from snapshot import schedule_snapshot, SNAPSHOT_KEY
+from regions import region_index, region_report
+from aggregates import COORD_SCALE
+from datetime import datetime, timezone
+from collections import Counter
+import numpy as np
+import heapq
+import json
+import time
+import os
+import logging
+
+# Global variables / constants
+log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
+logging.basicConfig(level=log_var)
+
+LIVE_SOURCE = os.environ.get('LIVE_SOURCE') # Feed location polled in live mode, defaults to DATA_URL
+LIVE_INTERVAL = float(os.environ.get('LIVE_INTERVAL', 300)) # Seconds between polls, the feed updates every five minutes
+LIVE_CHANNEL = AUX_PREFIX + 'live' # Pub/sub channel of the live events
+LIVE_AGGREGATES_KEY = AUX_PREFIX + 'live:aggregates' # Latest rolling aggregates, for new subscribers
+LIVE_KEEPALIVE = 15 # Seconds between keepalive comments on an idle event stream
+LIVE_DRAIN_TIMEOUT = 0.1 # Seconds to wait for the changes of an ingest to arrive
+LIVE_EVENT_SIZE = int(os.environ.get('LIVE_EVENT_SIZE', 500)) # Most incidents per 'incidents' event, keeping messages under the pub/sub buffer limits
+WINDOWS = {'hour': 3600, 'day': 86400, 'week': 7 * 86400} # Rolling windows and their length in seconds, at most ingest.CHANGES_MAX_AGE
+_windows = {} # Window name -> heap of (timestamp, lat, lon, region), counts of the entries 'present' and 'removed' before aging out, and running totals, sums in micro-degrees
+_changes = None # Subscription to the incidents every ingest changed
+_published = None # Aggregates last published
+
+# Function definitions
+def reset_windows():
+    """Empties the rolling windows"""
+    global _published
+    _published = None
+    for name in WINDOWS:
+        _windows[name] = {'heap': [], 'present': Counter(), 'removed': Counter(), 'count': 0, 'located': 0, 'lat_sum': 0, 'lon_sum': 0, 'regions': np.zeros(9, dtype=np.int64)}
+
+def _apply(window, entry, sign):
+    """Adds (sign 1) or removes (sign -1) one incident from the totals of a window"""
+    timestamp, lat, lon, region = entry
+    window['count'] += sign
+    if region >= 0:
+        window['located'] += sign
+        window['lat_sum'] += sign * round(lat * COORD_SCALE)
+        window['lon_sum'] += sign * round(lon * COORD_SCALE)
+        window['regions'][region] += sign
+
+def add_incidents(timestamps, latitudes, longitudes, now, sign=1):
+    """
+    This function adds incidents to every rolling window they fall in, or
+    with sign -1 takes them back out, as when an update replaces the stored
+    copy of an incident. A removed incident stays in the heap until it ages
+    out, but no longer counts. Coordinates are the ones validated at ingest.
+
+    Args:
+        timestamps (list): Published timestamps, None if malformed.
+        latitudes (list): Latitudes, NaN unless valid.
+        longitudes (list): Longitudes, NaN unless valid.
+        now (float): Current UNIX time, the windows must be advanced to it.
+        sign (int): 1 to add the incidents, -1 to remove them.
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    located = ~np.isnan(latitudes) & ~np.isnan(longitudes)
+    regions = np.full(len(latitudes), -1, dtype=np.int64)
+    if located.any():
+        regions[located] = region_index(latitudes[located], longitudes[located])
+    for timestamp, lat, lon, region in zip(timestamps, latitudes, longitudes, regions):
+        if timestamp is None:
+            continue
+        entry = (int(timestamp), float(lat), float(lon), int(region))
+        for name, span in WINDOWS.items():
+            window = _windows[name]
+            if timestamp < now - span:
+                continue
+            if sign > 0:
+                heapq.heappush(window['heap'], entry)
+                window['present'][entry] += 1
+            elif window['present'][entry] > window['removed'][entry]:
+                window['removed'][entry] += 1
+            else:
+                continue # Never entered this window
+            _apply(window, entry, sign)
+
+def advance_windows(now):
+    """
+    Drops the incidents that aged out of each rolling window.
+
+    Args:
+        now (float): Current UNIX time.
+    """
+    for name, span in WINDOWS.items():
+        window = _windows[name]
+        while window['heap'] and window['heap'][0][0] < now - span:
+            entry = heapq.heappop(window['heap'])
+            window['present'][entry] -= 1
+            if window['removed'][entry]:
+                window['removed'][entry] -= 1 # Its totals left when it was removed
+            else:
+                _apply(window, entry, -1)
+            if not window['present'][entry]:
+                del window['present'][entry]
+                window['removed'].pop(entry, None)
+
+def apply_changes(now):
+    """
+    Applies the incidents changed by every ingest since the last call, from
+    this process or any other, such as a scheduled delta POST /data, see
+    ingest.publish_changes. A DELETE of the data empties the windows.
+
+    Args:
+        now (float): Current UNIX time, the windows must be advanced to it.
+    """
+    while True:
+        message = _changes.get_message(timeout=LIVE_DRAIN_TIMEOUT)
+        if message is None:
+            return
+        changes = json.loads(message['data'])
+        if changes == CHANGES_RESET:
+            reset_windows()
+            continue
+        for timestamps, latitudes, longitudes, sign in changes:
+            add_incidents(timestamps, latitudes, longitudes, now, sign)
+
+def _subscribe():
+    """Subscribes to the ingest changes once, before any incident is read"""
+    global _changes
+    if _changes is None:
+        _changes = rd.pubsub(ignore_subscribe_messages=True)
+        _changes.subscribe(CHANGES_CHANNEL)
+
+def window_aggregates():
+    """
+    Formats the totals of the rolling windows.
+
+    Returns:
+        aggregates (dict): Window name mapped to its incident 'count', the
+                           'located' count, their 'average' [lat, lon]
+                           (None without located incidents) and the
+                           'regions' report.
+    """
+    aggregates = {}
+    for name, window in _windows.items():
+        located = window['located']
+        aggregates[name] = {'count': window['count'],
+                            'located': located,
+                            'average': [round(window['lat_sum'] / located / COORD_SCALE, 6), round(window['lon_sum'] / located / COORD_SCALE, 6)] if located else None,
+                            'regions': region_report(window['regions'].reshape(3, 3))}
+    return aggregates
+
+def seed_windows(now=None):
+    """
+    Fills the rolling windows with the stored incidents of the last week,
+    so live mode starts from the current state instead of empty windows.
+
+    Args:
+        now (float): Current UNIX time, defaults to the clock.
+    """
+    now = time.time() if now is None else now
+    _subscribe()
+    while _changes.get_message(timeout=LIVE_DRAIN_TIMEOUT) is not None:
+        pass # The stored incidents read below already hold these changes
+    reset_windows()
+    start = datetime.fromtimestamp(now - max(WINDOWS.values()), tz=timezone.utc).date()
+    end = datetime.fromtimestamp(now, tz=timezone.utc).date()
+    incidents = load_incidents(start, end)
+    add_incidents(incidents['published'].to_numpy().astype('datetime64[s]').astype(np.int64).tolist(), incidents['lat'], incidents['lon'], now)
+    advance_windows(now)
+    logging.info(f'Seeded live windows with {_windows["week"]["count"]} incidents')
+
+def publish_event(event, data):
+    """
+    Publishes a live event to the subscribers of LIVE_CHANNEL.
+
+    Args:
+        event (string): 'incidents' or 'aggregates'.
+        data (list or dict): JSON serializable event data.
+    """
+    rd.publish(LIVE_CHANNEL, json.dumps({'event': event, 'data': data}))
+
+def poll_feed(source=None, now=None):
+    """
+    This function polls the feed once. Only incidents whose traffic report
+    ID is new are written, the ones of the last week are published in
+    'incidents' events of at most LIVE_EVENT_SIZE rows, and
+    the rolling windows are moved to the current time and take in every
+    incident changed since the last poll, by this poll or any other ingest.
+    When the aggregates changed they are stored and published as an
+    'aggregates' event.
+
+    Args:
+        source (string or callable): Feed location read with
+                                     ingest.iter_rows, or a function
+                                     returning incident rows, defaults to
+                                     LIVE_SOURCE.
+        now (float): Current UNIX time, defaults to the clock.
+
+    Returns:
+        counts (dict): Ingest counts of the poll, see ingest.load_feed.
+    """
+    global _published
+    source = source or LIVE_SOURCE
+    rows = source() if callable(source) else iter_rows(source)
+    _subscribe()
+    added = []
+    counts = store_rows(rows, append=True, added=added)
+    now = time.time() if now is None else now
+    if not rd.exists(SNAPSHOT_KEY):
+        schedule_snapshot()
+    if counts['added']:
+        invalidate_cache()
+    for start in range(0, len(added), LIVE_EVENT_SIZE):
+        publish_event('incidents', [row for row, timestamp, lat, lon in added[start:start + LIVE_EVENT_SIZE]])
+    advance_windows(now)
+    apply_changes(now)
+    aggregates = window_aggregates()
+    if aggregates != _published:
+        rd.set(LIVE_AGGREGATES_KEY, json.dumps(aggregates))
+        publish_event('aggregates', aggregates)
+        _published = aggregates
+    logging.debug(f'Live poll finished: {counts}')
+    return counts
+
+def run_live(source=None, interval=None):
+    """
+    Runs live mode: polls the feed every interval seconds, a failed poll is
+    logged and retried on the next one.
+
+    Args:
+        source (string or callable): Feed to poll, see poll_feed.
+        interval (float): Seconds between polls, defaults to LIVE_INTERVAL.
+    """
+    interval = interval or LIVE_INTERVAL
+    logging.info(f'Live mode polling every {interval} seconds')
+    seed_windows()
+    while True:
+        started = time.monotonic()
+        try:
+            poll_feed(source)
+        except Exception:
+            logging.exception('Live poll failed')
+        time.sleep(max(0, interval - (time.monotonic() - started)))
+
+reset_windows()
+
+if __name__ == '__main__':
+    run_live()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Imports
+import os
+import numpy as np
+
+# Global variables / constants
+MAP_MODES = ('auto', 'points', 'grid')
+MAP_POINT_DAYS = int(os.environ.get('MAP_POINT_DAYS', 7)) # Longest timeframe 'auto' maps as single incidents
+# Grid cell size in degrees by timeframe length in days, finer for shorter timeframes
+MAP_LEVELS = [(31, 0.002), (366, 0.005), (None, 0.01)]
+
+# Function definitions
+def map_level(job, start_date, end_date):
+    """
+    Picks how the map of a job is drawn from its optional 'map_mode' and its
+    timeframe: 'auto' maps short timeframes as single incidents and longer
+    ones as a grid of counts whose cells grow with the timeframe.
+
+    Args:
+        job (dict): Job dictionary.
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+
+    Returns:
+        mode (string): 'points' or 'grid'.
+        cell (float): Grid cell size in degrees, None for points.
+
+    Raises:
+        ValueError: If the map mode is unknown.
+    """
+    mode = job.get('map_mode') or 'auto'
+    if mode not in MAP_MODES:
+        raise ValueError(f'map_mode must be one of {", ".join(MAP_MODES)}')
+    days = (end_date - start_date).days + 1
+    if mode == 'points' or (mode == 'auto' and days <= MAP_POINT_DAYS):
+        return 'points', None
+    for most_days, cell in MAP_LEVELS:
+        if most_days is None or days <= most_days:
+            return 'grid', cell
+
+def grid_cells(latitudes, longitudes, cell):
+    """
+    This function counts incidents per cell of a fixed lat/lon grid. Cells
+    are aligned on multiples of the cell size, so the counts of disjoint
+    incident sets add up cell by cell.
+
+    Args:
+        latitudes (array): Incident latitudes.
+        longitudes (array): Incident longitudes (negative, west).
+        cell (float): Cell size in degrees.
+
+    Returns:
+        cells (dict): (row, column) grid index mapped to its incident count.
+    """
+    rows = np.floor(np.asarray(latitudes, dtype=float) / cell).astype(np.int64)
+    cols = np.floor(np.asarray(longitudes, dtype=float) / cell).astype(np.int64)
+    if len(rows) == 0:
+        return {}
+    pairs, counts = np.unique(np.stack([rows, cols], axis=1), axis=0, return_counts=True)
+    return {(int(row), int(col)): int(count) for (row, col), count in zip(pairs, counts)}
+
+def grid_map(cells, cell):
+    """
+    Formats grid counts for the job result.
+
+    Args:
+        cells (dict): Output of grid_cells.
+        cell (float): Cell size in degrees.
+
+    Returns:
+        result_map (dict): 'mode' ('grid'), 'cell', and parallel lists of
+                           cell center 'latitudes', 'longitudes' and incident
+                           'counts'.
+    """
+    index = sorted(cells)
+    return {'mode': 'grid',
+            'cell': cell,
+            'latitudes': [round((row + 0.5) * cell, 6) for row, col in index],
+            'longitudes': [round((col + 0.5) * cell, 6) for row, col in index],
+            'counts': [cells[key] for key in index]}
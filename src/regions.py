@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Imports
+import os
+import numpy as np
+
+# Global variables / constants
+DOWNTOWN_AUSTIN = (float(os.environ.get('REGION_CENTER_LAT', 30.2672)), float(os.environ.get('REGION_CENTER_LON', -97.7431))) # N, W; lat, long
+REGION_TOLERANCE = float(os.environ.get('REGION_TOLERANCE', 0.01)) # Degrees in either direction of the center
+REGION_GRID = (3, 3)
+# Names of the default 3x3 grid, rows from north to south and columns from west to east
+REGION_NAMES = [['NW', 'North', 'NE'],
+                ['West', 'Downtown', 'East'],
+                ['SW', 'South', 'SE']]
+REPORT_ORDER = ['Downtown', 'North', 'NE', 'NW', 'East', 'West', 'South', 'SW', 'SE']
+
+# Function definitions
+def region_config(job):
+    """
+    Reads the optional region parameters of a job, falling back to the
+    downtown Austin defaults.
+
+    Args:
+        job (dict): Job dictionary.
+
+    Returns:
+        center (tuple): Reference latitude and longitude.
+        tolerance (float): Half width of a cell, in degrees.
+        grid (tuple): Number of rows (north to south) and columns (west to
+                      east), both odd so the center cell sits on the
+                      reference point.
+
+    Raises:
+        ValueError: If a parameter is malformed.
+    """
+    center = DOWNTOWN_AUSTIN if job.get('region_center') is None else job['region_center']
+    tolerance = REGION_TOLERANCE if job.get('region_tolerance') is None else job['region_tolerance']
+    grid = REGION_GRID if job.get('region_grid') is None else job['region_grid']
+    try:
+        center = (float(center[0]), float(center[1]))
+        tolerance = float(tolerance)
+        grid = (int(grid[0]), int(grid[1]))
+    except (TypeError, ValueError, IndexError):
+        raise ValueError('region_center must be [lat, lon], region_tolerance a number and region_grid [rows, columns]')
+    if not tolerance > 0: # Also refuses NaN
+        raise ValueError('region_tolerance must be positive')
+    if grid[0] < 1 or grid[1] < 1 or grid[0] % 2 == 0 or grid[1] % 2 == 0:
+        raise ValueError('region_grid must hold two positive odd numbers')
+    return center, tolerance, grid
+
+def _cell_offsets(delta, tolerance):
+    """
+    Converts signed distances from the reference into whole cell offsets.
+    The center cell spans [-tolerance, +tolerance] and every other cell is
+    2*tolerance wide, boundaries belonging to the cell nearer the center.
+    """
+    width = 2 * tolerance
+    return np.where(delta > 0, np.ceil((delta - tolerance) / width), np.floor((delta + tolerance) / width)).astype(np.int64)
+
+def region_index(latitudes, longitudes, center=DOWNTOWN_AUSTIN, tolerance=REGION_TOLERANCE, grid=REGION_GRID):
+    """
+    This function assigns every incident to a cell of a grid centered on
+    the reference point. The outer rows and columns extend without bound,
+    so the default 3x3 grid gives the nine regions of Austin.
+
+    Args:
+        latitudes (array): Incident latitudes.
+        longitudes (array): Incident longitudes (negative, west).
+        center (tuple): Reference latitude and longitude.
+        tolerance (float): Half width of a cell, in degrees.
+        grid (tuple): Odd number of rows and columns.
+
+    Returns:
+        index (ndarray): Flat cell index (row * columns + column) of every
+                         incident, rows from north to south and columns
+                         from west to east.
+    """
+    rows, cols = grid
+    lat_offsets = _cell_offsets(np.asarray(latitudes, dtype=float) - center[0], tolerance)
+    lon_offsets = _cell_offsets(np.asarray(longitudes, dtype=float) - center[1], tolerance)
+    row_index = np.clip(rows // 2 - lat_offsets, 0, rows - 1)
+    col_index = np.clip(cols // 2 + lon_offsets, 0, cols - 1)
+    return row_index * cols + col_index
+
+def region_counts(latitudes, longitudes, center=DOWNTOWN_AUSTIN, tolerance=REGION_TOLERANCE, grid=REGION_GRID):
+    """
+    This function counts incidents per cell of the region grid.
+
+    Args:
+        latitudes (array): Incident latitudes.
+        longitudes (array): Incident longitudes (negative, west).
+        center (tuple): Reference latitude and longitude.
+        tolerance (float): Half width of a cell, in degrees.
+        grid (tuple): Odd number of rows and columns.
+
+    Returns:
+        counts (ndarray): Incident counts of shape grid, rows from north to
+                          south and columns from west to east.
+    """
+    rows, cols = grid
+    index = region_index(latitudes, longitudes, center, tolerance, grid)
+    return np.bincount(index, minlength=rows * cols).reshape(rows, cols)
+
+def region_report(counts):
+    """
+    Formats region counts for the job result.
+
+    Args:
+        counts (ndarray): Output of region_counts.
+
+    Returns:
+        report (dict): Counts by region name for the default 3x3 grid,
+                       otherwise the grid of counts under 'grid'.
+    """
+    if counts.shape == (3, 3):
+        named = {REGION_NAMES[i][j]: int(counts[i, j]) for i in range(3) for j in range(3)}
+        return {name: named[name] for name in REPORT_ORDER}
+    return {'grid': counts.tolist()}
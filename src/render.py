@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+# Imports
+import matplotlib
+matplotlib.use('Agg') # Workers have no display, and Agg is safe to use from several threads
+from matplotlib.figure import Figure
+import plotly.graph_objects as go
+import pandas as pd
+import kaleido
+import asyncio
+import threading
+import atexit
+import io
+import os
+import logging
+
+# Global variables / constants
+log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
+logging.basicConfig(level=log_var)
+
+MAP_IMAGE = 'map.png'
+CHART_IMAGE = 'chart.png'
+MAP_SIZE = (800, 600) # Pixels, rendered at scale 2
+MAP_CENTER = {'lat': 30.2672, 'lon': -97.7431}
+MAP_OPTS = {'format': 'png', 'width': MAP_SIZE[0], 'height': MAP_SIZE[1], 'scale': 2}
+RENDER_TABS = int(os.environ.get('RENDER_TABS', 2)) # Chrome tabs rendering maps at once
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 90)) # Seconds allowed per map
+_renderer = None # (event loop, Kaleido) of the long-lived headless Chrome
+_renderer_lock = threading.Lock()
+
+# Function definitions
+def map_figure(result_map):
+    """
+    Builds the plotly figure of the incident map.
+
+    Args:
+        result_map (dict): Map result of a job, see worker.create_map.
+
+    Returns:
+        fig (Figure): Scatter map of the incidents over Austin, or a density
+                      map of the incident counts for grid maps.
+    """
+    fig = go.Figure()
+    if result_map.get('mode') == 'grid':
+        fig.add_trace(go.Densitymap(lon = result_map['longitudes'], lat = result_map['latitudes'], z = result_map['counts'], radius = 10, colorbar = dict(title = 'Incidents')))
+    else:
+        df = pd.DataFrame(result_map)
+        fig.add_trace(go.Scattermap(lon = df['longitudes'], lat = df['latitudes'], text = df['Address'], mode = 'markers', marker = go.scattermap.Marker(size = 8)))
+    fig.update_layout(title = 'Austin Traffic Incident Map', geo_scope='usa', map_style='open-street-map', map_center=MAP_CENTER, map_zoom=10)
+    fig.update_geos(center=dict(lon=MAP_CENTER['lon'], lat=MAP_CENTER['lat']), projection_scale=10, scope='usa')
+    return fig
+
+def _get_renderer():
+    """
+    Starts the headless Chrome renderer on first use. It lives on an event
+    loop thread of its own, so jobs on any thread can hand it figures.
+    """
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            logging.info(f'Starting map renderer with {RENDER_TABS} tabs')
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='renderer', daemon=True).start()
+            async def open_renderer():
+                return await kaleido.Kaleido(n=RENDER_TABS, timeout=RENDER_TIMEOUT).__aenter__()
+            try:
+                _renderer = (loop, asyncio.run_coroutine_threadsafe(open_renderer(), loop).result())
+            except Exception:
+                loop.call_soon_threadsafe(loop.stop)
+                raise
+    return _renderer
+
+def stop_renderer():
+    """Closes the headless Chrome renderer, the next render starts a new one"""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            return
+        loop, renderer = _renderer
+        _renderer = None
+    try:
+        asyncio.run_coroutine_threadsafe(renderer.close(), loop).result(timeout=RENDER_TIMEOUT)
+    except Exception:
+        logging.exception('Failed to close map renderer')
+    loop.call_soon_threadsafe(loop.stop)
+
+atexit.register(stop_renderer)
+
+def render_maps(result_maps):
+    """
+    This function renders many incident maps in one go. Every map is handed
+    to the long-lived renderer at once, so its tabs draw them in parallel
+    and no map pays for starting Chrome.
+
+    Args:
+        result_maps (list): Map results of jobs.
+
+    Returns:
+        images (list): PNG bytes of every map, None where rendering failed.
+    """
+    loop, renderer = _get_renderer()
+    futures = [asyncio.run_coroutine_threadsafe(renderer.calc_fig(map_figure(result_map).to_dict(), opts=MAP_OPTS), loop) for result_map in result_maps]
+    images = []
+    for future in futures:
+        try:
+            images.append(future.result())
+        except Exception:
+            logging.exception('Failed to render map')
+            images.append(None)
+    return images
+
+def render_map(result_map):
+    """
+    Renders the incident map of a job to PNG.
+
+    Args:
+        result_map (dict): Map result of a job.
+
+    Returns:
+        image (bytes): PNG image, None if rendering failed.
+    """
+    return render_maps([result_map])[0]
+
+def warm_renderer():
+    """
+    Starts the renderer and draws an empty map, so the first job does not
+    wait for Chrome, plotly.js and the map tiles to load.
+    """
+    try:
+        render_map({'latitudes': [], 'longitudes': [], 'Address': []})
+        logging.info('Map renderer ready')
+    except Exception:
+        logging.exception('Map renderer failed to start, maps will be retried per job')
+
+def render_chart(result_chart):
+    """
+    Renders the incident bar chart of a job to PNG. The figure is not
+    registered with pyplot, so jobs rendering at once do not share state.
+
+    Args:
+        result_chart (dict): Bucket label mapped to a one element list
+                             holding its incident count.
+
+    Returns:
+        image (bytes): PNG image.
+    """
+    df = pd.DataFrame(result_chart).melt(var_name='Date/Time', value_name='Total Incident Count').dropna()
+    fig = Figure()
+    ax = fig.subplots()
+    df.plot(kind='bar', x='Date/Time', y='Total Incident Count', legend=None, ax=ax)
+    ax.set_ylabel('Total Incident Count')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    return buffer.getvalue()
+
+def render_images(result_map, result_chart):
+    """
+    This function renders the images of a finished job. An image that fails
+    to render is left out and logged, the rest of the result is unaffected.
+
+    Args:
+        result_map (dict): Map result of the job, None if not requested.
+        result_chart (dict): Chart of the job, bucket label mapped to a one
+                             element list holding its incident count, None
+                             if not requested.
+
+    Returns:
+        images (dict): Image name (MAP_IMAGE, CHART_IMAGE) mapped to its PNG
+                       bytes, for the requested outputs.
+    """
+    images = {}
+    if result_map is not None:
+        try:
+            image = render_map(result_map)
+            if image is not None:
+                images[MAP_IMAGE] = image
+        except Exception:
+            logging.exception('Failed to render map')
+    if result_chart is not None:
+        try:
+            images[CHART_IMAGE] = render_chart(result_chart)
+        except Exception:
+            logging.exception('Failed to render chart')
+    return images
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Imports
+from jobs import rd # Incident database client
+from incidents import AUX_PREFIX
+from dates import NO_TIMESTAMP
+from histograms import TIME_OF_DAY, time_of_day_index
+from regions import region_index, REGION_NAMES
+from aggregates import COORD_SCALE # Coordinate sums are kept as integer micro-degrees so they never drift
+from collections import defaultdict
+from datetime import timedelta
+import numpy as np
+
+# Global variables / constants
+ROLLUP_PREFIX = AUX_PREFIX + 'rollup:' # One hash of counters per day, e.g. incidents:rollup:2022-01-15
+ROLLUPS_READY = AUX_PREFIX + 'rollups_ready' # Set once the rollups cover every stored incident
+_REGION_FIELDS = ['region:' + name for row in REGION_NAMES for name in row]
+_TIME_OF_DAY_FIELDS = ['tod:' + name for name in TIME_OF_DAY]
+
+# Function definitions
+def rollup_deltas(timestamps, latitudes, longitudes, sign, deltas):
+    """
+    Adds the contribution of a batch of incidents to a set of pending
+    rollup changes. Every day holds the counters 'count' (all incidents),
+    'located' (valid coordinates), 'lat_sum' and 'lon_sum' (micro-degrees),
+    'region:<name>' for the default regions, 'hour:<hh>' and 'tod:<period>'.
+
+    Args:
+        timestamps (array): Published timestamps, NO_TIMESTAMP if malformed.
+        latitudes (array): Latitudes validated at ingest, NaN unless valid.
+        longitudes (array): Longitudes validated at ingest, NaN unless valid.
+        sign (int): 1 to add the incidents, -1 to remove them.
+        deltas (defaultdict): Pending changes keyed by (day, field).
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    dated = timestamps != NO_TIMESTAMP
+    if not dated.any():
+        return
+    timestamps = timestamps[dated]
+    latitudes = latitudes[dated]
+    longitudes = longitudes[dated]
+    days = np.datetime_as_string(timestamps.astype('datetime64[s]').astype('datetime64[D]'))
+    seconds = timestamps % 86400
+    periods = time_of_day_index(seconds)
+    for day, hour, period in zip(days, seconds // 3600, periods):
+        day = str(day)
+        deltas[(day, 'count')] += sign
+        deltas[(day, f'hour:{hour:02d}')] += sign
+        deltas[(day, _TIME_OF_DAY_FIELDS[period])] += sign
+    located = ~np.isnan(latitudes) & ~np.isnan(longitudes)
+    if located.any():
+        latitudes = latitudes[located]
+        longitudes = longitudes[located]
+        cells = region_index(latitudes, longitudes)
+        for day, lat, lon, cell in zip(days[located], latitudes, longitudes, cells):
+            day = str(day)
+            deltas[(day, 'located')] += sign
+            deltas[(day, 'lat_sum')] += sign * round(float(lat) * COORD_SCALE)
+            deltas[(day, 'lon_sum')] += sign * round(float(lon) * COORD_SCALE)
+            deltas[(day, _REGION_FIELDS[cell])] += sign
+
+def write_rollups(client, deltas):
+    """
+    Applies pending rollup changes with HINCRBY. The client can be a
+    pipeline so the counters travel with the incident writes.
+
+    Args:
+        client (Redis or Pipeline): Incident database client.
+        deltas (dict): Pending changes keyed by (day, field).
+    """
+    for (day, field), value in deltas.items():
+        if value:
+            client.hincrby(ROLLUP_PREFIX + day, field, value)
+
+def rollups_ready():
+    """Checks whether the rollups cover every stored incident"""
+    return bool(rd.exists(ROLLUPS_READY))
+
+def load_rollups(start_date, end_date):
+    """
+    This function sums the daily rollups of a timeframe, one HGETALL per day
+    sent through a single pipeline.
+
+    Args:
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+
+    Returns:
+        cube (dict): 'count', 'located', 'lat_sum' and 'lon_sum' totals
+                     (sums in integer micro-degrees), 'regions' (3x3 counts), 'time_of_day'
+                     (counts in TIME_OF_DAY order), 'days' (datetime64
+                     days) with 'day_counts', and 'hours' (datetime64 hours)
+                     with 'hour_counts'.
+    """
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    pipe = rd.pipeline(transaction=False)
+    for day in days:
+        pipe.hgetall(ROLLUP_PREFIX + day.isoformat())
+    cells = pipe.execute()
+    totals = defaultdict(int)
+    day_counts = np.zeros(len(days), dtype=np.int64)
+    hour_counts = np.zeros((len(days), 24), dtype=np.int64)
+    for index, cell in enumerate(cells):
+        for field, value in cell.items():
+            field = field.decode('utf8')
+            value = int(value)
+            if field.startswith('hour:'):
+                hour_counts[index, int(field[5:])] = value
+            else:
+                totals[field] += value
+        day_counts[index] = int(cell.get(b'count', 0))
+    first = np.datetime64(start_date, 'D')
+    return {'count': totals['count'],
+            'located': totals['located'],
+            'lat_sum': totals['lat_sum'],
+            'lon_sum': totals['lon_sum'],
+            'regions': np.array([totals[field] for field in _REGION_FIELDS]).reshape(3, 3),
+            'time_of_day': np.array([totals[field] for field in _TIME_OF_DAY_FIELDS]),
+            'days': first + np.arange(len(days)),
+            'day_counts': day_counts,
+            'hours': first.astype('datetime64[h]') + np.arange(len(days) * 24),
+            'hour_counts': hour_counts.ravel()}
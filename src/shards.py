@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+# Imports
+from incidents import load_incidents, has_published_index
+from snapshot import snapshot_incidents
+from aggregates import JobAggregate, LocationTotals, TimeHistogram, RegionCounts, merge_all
+from maps import grid_cells
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+import multiprocessing
+import threading
+import os
+import logging
+
+# Global variables / constants
+log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
+logging.basicConfig(level=log_var)
+
+SHARD_DAYS = int(os.environ.get('SHARD_DAYS', 90)) # Days of incidents per shard
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', os.cpu_count() or 1)) # Shard processes per worker
+_pool = None
+_pool_lock = threading.Lock() # Jobs running on several threads share one pool
+
+# Function definitions
+def shard_ranges(start_date, end_date, shard_days=None):
+    """
+    Splits a timeframe into consecutive date ranges of at most shard_days.
+
+    Args:
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+        shard_days (int): Days per shard, defaults to SHARD_DAYS.
+
+    Returns:
+        ranges (list): (first day, last day) tuples covering the timeframe.
+    """
+    shard_days = max(1, shard_days or SHARD_DAYS)
+    ranges = []
+    first = start_date
+    while first <= end_date:
+        last = min(first + timedelta(days=shard_days - 1), end_date)
+        ranges.append((first, last))
+        first = last + timedelta(days=1)
+    return ranges
+
+def analyze_incidents(incidents, start_date, end_date, options):
+    """
+    This function computes the partial results of a job over a set of
+    incidents. Partials of disjoint sets of incidents combine with
+    merge_partials.
+
+    Args:
+        incidents (DataFrame): Columnar incidents, as returned by
+                               load_incidents.
+        start_date (date): First day of the job timeframe (chart buckets).
+        end_date (date): Last day of the job timeframe (chart buckets).
+        options (dict): 'map' ('points', 'grid' or None to skip the map),
+                        'map_cell' (grid cell size in degrees), 'chart_step'
+                        (string or None to skip the chart) and 'regions'
+                        ((center, tolerance, grid) or None to skip the
+                        report).
+
+    Returns:
+        partial (JobAggregate): Location totals of the incidents with a
+                                valid location, plus the map (parallel
+                                lists, or 'cell' and grid 'cells' counts),
+                                chart histogram and region counts when
+                                requested.
+    """
+    located = incidents[incidents['valid']]
+    latitudes = located['lat'].to_numpy()
+    longitudes = located['lon'].to_numpy()
+    partial = JobAggregate(LocationTotals.from_coordinates(latitudes, longitudes))
+    if options.get('map') == 'grid':
+        partial.map = {'cell': options['map_cell'], 'cells': grid_cells(latitudes, longitudes, options['map_cell'])}
+    elif options.get('map'):
+        partial.map = {'latitudes': located['lat'].tolist(), 'longitudes': located['lon'].tolist(), 'Address': located['address'].tolist()}
+    if options.get('chart_step'):
+        partial.chart = TimeHistogram.from_published(incidents['published'].to_numpy(), start_date, end_date, options['chart_step'])
+    if options.get('regions'):
+        center, tolerance, grid = options['regions']
+        partial.regions = RegionCounts.from_coordinates(latitudes, longitudes, center, tolerance, grid)
+    return partial
+
+def analyze_shard(shard_start, shard_end, start_date, end_date, options):
+    """
+    Loads the incidents of one shard, from the snapshot when there is one
+    and from redis otherwise, and computes their partial results. Runs
+    inside the process pool.
+    """
+    incidents = snapshot_incidents(shard_start, shard_end, addresses=options.get('map') == 'points')
+    if incidents is None:
+        incidents = load_incidents(shard_start, shard_end)
+    logging.debug(f'Analyzed shard {shard_start} to {shard_end}')
+    return analyze_incidents(incidents, start_date, end_date, options)
+
+def merge_partials(partials):
+    """
+    Combines partial results of disjoint incident sets, see
+    aggregates.JobAggregate.merge.
+
+    Args:
+        partials (list): Partials from analyze_incidents.
+
+    Returns:
+        partial (JobAggregate): The combined partial.
+    """
+    return merge_all(partials)
+
+def _get_pool():
+    """
+    Starts the shard process pool on first use. The pool starts on a job
+    thread while other threads may hold locks, so its processes come from a
+    single threaded fork server instead of a fork of the worker.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            logging.info(f'Starting shard pool with {WORKER_PROCESSES} processes')
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['shards'])
+            _pool = ProcessPoolExecutor(max_workers=WORKER_PROCESSES, mp_context=context)
+    return _pool
+
+def analyze_window(start_date, end_date, options):
+    """
+    This function computes the results of a job by splitting its timeframe
+    into shards, analyzing them in the process pool and merging the
+    partials. Small timeframes, or a pool of one process, run inline.
+
+    Args:
+        start_date (date): First day of the job timeframe.
+        end_date (date): Last day of the job timeframe.
+        options (dict): Requested outputs, see analyze_incidents.
+
+    Returns:
+        partial (JobAggregate): Merged partial results of the whole timeframe.
+    """
+    # Without the index every shard would scan the whole keyspace
+    ranges = shard_ranges(start_date, end_date) if has_published_index() else [(start_date, end_date)]
+    if len(ranges) == 1 or WORKER_PROCESSES <= 1:
+        return merge_partials([analyze_shard(first, last, start_date, end_date, options) for first, last in ranges])
+    logging.debug(f'Splitting job into {len(ranges)} shards')
+    pool = _get_pool()
+    futures = [pool.submit(analyze_shard, first, last, start_date, end_date, options) for first, last in ranges]
+    return merge_partials([future.result() for future in futures])
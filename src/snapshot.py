@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+# Imports
+from jobs import rd # Incident database client
+from incidents import decode_fields, incidents_frame, PUBLISHED_INDEX, AUX_PREFIX, SCAN_BATCH_SIZE, NO_TIMESTAMP
+from datetime import datetime, timedelta, timezone
+from redis.exceptions import WatchError
+import numpy as np
+import threading
+import shutil
+import time
+import os
+import logging
+
+# Global variables / constants
+log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
+logging.basicConfig(level=log_var)
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') # Shared volume holding the snapshots, unset to read redis only
+SNAPSHOT_KEY = AUX_PREFIX + 'snapshot' # Version of the snapshot matching the stored incidents
+SNAPSHOT_GENERATION_KEY = AUX_PREFIX + 'snapshot:generation' # Bumped by every ingest batch that changes incidents
+SNAPSHOT_INTERVAL = float(os.environ.get('SNAPSHOT_INTERVAL', 600)) # Least seconds between background rebuilds
+SNAPSHOT_KEEP = 2 # Versions kept on disk, older ones may still be open in workers
+CURRENT_FILE = 'CURRENT' # Names the newest version, for humans and tools
+COLUMNS = ('published', 'lat', 'lon', 'address_offsets', 'address') # One .npy file each
+COPY_SIZE = 1 << 20 # Bytes per copy of the address column into its .npy file
+PADDING = np.iinfo(np.int64).max # Published time of the unused tail of a snapshot, after every timeframe
+_loaded = None # (version, columns) of the snapshot open in this process
+_loaded_lock = threading.Lock()
+_pending = False # A background rebuild was requested
+_publisher = None # Thread running the background rebuilds
+_last_publish = 0.0 # Monotonic time of the last background rebuild
+_publisher_lock = threading.Lock()
+
+# Function definitions
+def retire_snapshot(client):
+    """
+    Marks the snapshot as out of date before incidents change, so workers
+    read redis until a new one is published and a snapshot being built
+    meanwhile is not published. The client can be a pipeline so this
+    travels ahead of the incident writes.
+
+    Args:
+        client (Redis or Pipeline): Incident database client.
+    """
+    client.delete(SNAPSHOT_KEY)
+    client.incr(SNAPSHOT_GENERATION_KEY)
+
+def publish_snapshot():
+    """
+    This function writes every indexed incident, in published order, into
+    a new immutable snapshot of one .npy file per column: 'published' (UNIX
+    seconds), 'lat' and 'lon' (NaN when missing), and the UTF-8 'address'
+    bytes with their 'address_offsets'. The incidents are streamed into
+    memory-mapped files SCAN_BATCH_SIZE at a time, so memory stays bounded
+    by the batch. Index entries without a readable incident leave an unused
+    tail, published at PADDING so no timeframe reaches it. The version only
+    becomes current once all of its files are in place, and only if no
+    incident changed while it was written.
+
+    Returns:
+        version (string): Name of the new snapshot, None without SNAPSHOT_DIR
+                          or when incidents changed meanwhile.
+    """
+    if not SNAPSHOT_DIR:
+        return None
+    generation = rd.get(SNAPSHOT_GENERATION_KEY)
+    capacity = rd.zcard(PUBLISHED_INDEX)
+    version = str(time.time_ns())
+    staging = os.path.join(SNAPSHOT_DIR, version + '.tmp')
+    os.makedirs(staging)
+    columns = {name: np.lib.format.open_memmap(os.path.join(staging, name + '.npy'), mode='w+', dtype=dtype, shape=(length,))
+               for name, dtype, length in (('published', np.int64, capacity), ('lat', float, capacity), ('lon', float, capacity), ('address_offsets', np.int64, capacity + 1))}
+    columns['address_offsets'][0] = 0
+    count = 0
+    size = 0
+    address_path = os.path.join(staging, 'address.bin')
+    with open(address_path, 'wb') as address_file:
+        for offset in range(0, capacity, SCAN_BATCH_SIZE):
+            keys = rd.zrange(PUBLISHED_INDEX, offset, min(offset + SCAN_BATCH_SIZE, capacity) - 1)
+            records = [record for record in (decode_fields(value) for value in rd.mget(keys) if value is not None) if record[0] != NO_TIMESTAMP]
+            if not records:
+                continue
+            timestamps, latitudes, longitudes, addresses = zip(*records)
+            addresses = [address.encode('utf8') for address in addresses]
+            end = count + len(records)
+            columns['published'][count:end] = timestamps
+            columns['lat'][count:end] = latitudes
+            columns['lon'][count:end] = longitudes
+            columns['address_offsets'][count + 1:end + 1] = size + np.cumsum([len(address) for address in addresses])
+            address_file.write(b''.join(addresses))
+            size = int(columns['address_offsets'][end])
+            count = end
+    columns['published'][count:] = PADDING
+    columns['lat'][count:] = np.nan
+    columns['lon'][count:] = np.nan
+    columns['address_offsets'][count + 1:] = size
+    address = np.lib.format.open_memmap(os.path.join(staging, 'address.npy'), mode='w+', dtype=np.uint8, shape=(size,))
+    with open(address_path, 'rb') as address_file:
+        for start in range(0, size, COPY_SIZE):
+            chunk = address_file.read(COPY_SIZE)
+            address[start:start + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+    for column in list(columns.values()) + [address]:
+        column.flush()
+    del columns, address
+    os.remove(address_path)
+    os.rename(staging, os.path.join(SNAPSHOT_DIR, version))
+    with rd.pipeline() as pipe:
+        try:
+            pipe.watch(SNAPSHOT_GENERATION_KEY)
+            if pipe.get(SNAPSHOT_GENERATION_KEY) != generation:
+                raise WatchError
+            pipe.multi()
+            pipe.set(SNAPSHOT_KEY, version)
+            pipe.execute()
+        except WatchError:
+            logging.info(f'Incidents changed while snapshot {version} was written, dropping it')
+            shutil.rmtree(os.path.join(SNAPSHOT_DIR, version), ignore_errors=True)
+            return None
+    current = os.path.join(SNAPSHOT_DIR, CURRENT_FILE)
+    with open(current + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(current + '.tmp', current)
+    logging.info(f'Published snapshot {version} of {count} incidents')
+    for old in sorted(name for name in os.listdir(SNAPSHOT_DIR) if name.isdigit())[:-SNAPSHOT_KEEP]:
+        shutil.rmtree(os.path.join(SNAPSHOT_DIR, old), ignore_errors=True) # Open memory maps survive the unlink
+    return version
+
+def _run_publisher():
+    """Runs the requested background rebuilds, at most one every SNAPSHOT_INTERVAL seconds"""
+    global _pending, _publisher, _last_publish
+    while True:
+        with _publisher_lock:
+            if not _pending:
+                _publisher = None
+                return
+            _pending = False
+        time.sleep(max(0, _last_publish + SNAPSHOT_INTERVAL - time.monotonic()))
+        _last_publish = time.monotonic()
+        try:
+            if publish_snapshot() is None and not rd.exists(SNAPSHOT_KEY):
+                schedule_snapshot() # Incidents changed meanwhile, try again
+        except Exception:
+            logging.exception('Background snapshot failed')
+
+def schedule_snapshot():
+    """
+    Requests a rebuild of the snapshot in a background thread, off the
+    request path. Requests made while one is pending are folded into it,
+    and rebuilds run at most once every SNAPSHOT_INTERVAL seconds; workers
+    read redis meanwhile.
+    """
+    global _pending, _publisher
+    if not SNAPSHOT_DIR:
+        return
+    with _publisher_lock:
+        _pending = True
+        if _publisher is None:
+            _publisher = threading.Thread(target=_run_publisher, daemon=True)
+            _publisher.start()
+
+def current_snapshot():
+    """
+    Returns the memory-mapped columns of the snapshot matching the stored
+    incidents, opening a new version when ingest published one. Every
+    process maps the same files, so they share one copy in the page cache.
+
+    Returns:
+        columns (dict): Column name mapped to its read-only array, None when
+                        no snapshot is available.
+    """
+    global _loaded
+    if not SNAPSHOT_DIR:
+        return None
+    version = rd.get(SNAPSHOT_KEY)
+    if version is None:
+        return None
+    version = version.decode('utf8')
+    with _loaded_lock:
+        if _loaded is not None and _loaded[0] == version:
+            return _loaded[1]
+        path = os.path.join(SNAPSHOT_DIR, version)
+        try:
+            columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in COLUMNS}
+        except (OSError, ValueError):
+            logging.warning(f'Snapshot {version} is not readable from {SNAPSHOT_DIR}, reading redis')
+            return None
+        logging.info(f'Opened snapshot {version}')
+        _loaded = (version, columns)
+        return columns
+
+def snapshot_incidents(start_date, end_date, addresses=True):
+    """
+    This function loads the incidents of a timeframe from the snapshot. The
+    columns are sorted by publish time, so the timeframe is one slice of
+    every memory map found by binary search.
+
+    Args:
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+        addresses (bool): Decode the addresses, only maps of single
+                          incidents need them.
+
+    Returns:
+        incidents (DataFrame): Same columns as incidents.load_incidents,
+                               None when no snapshot is available.
+    """
+    columns = current_snapshot()
+    if columns is None:
+        return None
+    low = datetime(start_date.year, start_date.month, start_date.day, tzinfo=timezone.utc)
+    high = datetime(end_date.year, end_date.month, end_date.day, tzinfo=timezone.utc) + timedelta(days=1)
+    first, last = np.searchsorted(columns['published'], [int(low.timestamp()), int(high.timestamp())], side='left')
+    address = ''
+    if addresses:
+        offsets = columns['address_offsets'][first:last + 1]
+        blob = columns['address'][offsets[0]:offsets[-1]].tobytes() if last > first else b''
+        address = [blob[begin:end].decode('utf8') for begin, end in zip(offsets[:-1] - offsets[0], offsets[1:] - offsets[0])]
+    logging.debug(f'Sliced {last - first} incidents from the snapshot')
+    return incidents_frame(columns['published'][first:last], columns['lat'][first:last], columns['lon'][first:last], address, start_date, end_date)
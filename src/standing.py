@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# Imports
+from jobs import results, scan_batches # Results database client
+from incidents import incidents_frame, load_incidents
+from shards import analyze_incidents
+from histograms import chart_step, CHART_STEPS
+from regions import region_config
+from aggregates import JobAggregate, TimeHistogram, RegionCounts
+from dates import job_window
+from datetime import date, datetime, timedelta, timezone
+from redis.exceptions import LockError
+import numpy as np
+import uuid
+import json
+import time
+import os
+import logging
+
+# Global variables / constants
+log_var = os.environ.get('LOG_LEVEL', 'DEBUG')
+logging.basicConfig(level=log_var)
+
+STANDING_PREFIX = 'standing:' # Hash per standing query in the results database: 'query' and 'result' JSON, 'updated' time, 'stale' once a refresh failed
+STANDING_MAX_DAYS = int(os.environ.get('STANDING_MAX_DAYS', 366)) # Longest sliding window of a standing query
+STANDING_LOCK_PREFIX = 'standing_lock:' # Lock per standing query, so refreshes never interleave
+STANDING_LOCK_TIMEOUT = 60 # Seconds a refresh may hold the lock of a query
+
+# Function definitions
+def make_standing_query(data):
+    """
+    Validates the definition of a standing query. It covers either the
+    sliding window of the last 'days' days (today included, UTC) or a fixed
+    'start' and 'end', and keeps a summary plus, as requested, a chart and a
+    regional report. Maps are not kept, a job is cheap enough for those.
+
+    Args:
+        data (dict): Posted definition, with the job parameters 'days' or
+                     'start'/'end', 'incident_graph', 'incident_report',
+                     'chart_step' and the region parameters, and an
+                     optional 'name'.
+
+    Returns:
+        query (dict): The normalized definition.
+
+    Raises:
+        ValueError: If a parameter is malformed.
+    """
+    query = {'name': str(data.get('name') or ''),
+             'incident_graph': data.get('incident_graph', 'yes'),
+             'incident_report': data.get('incident_report', 'yes')}
+    if 'days' in data:
+        days = data['days']
+        if isinstance(days, bool) or not isinstance(days, int) or not 1 <= days <= STANDING_MAX_DAYS:
+            raise ValueError(f'days must be a whole number from 1 to {STANDING_MAX_DAYS}')
+        query['days'] = days
+    else:
+        job_window(data)
+        query['start'], query['end'] = data['start'], data['end']
+    if query['incident_graph'] not in ('yes', 'no') or query['incident_report'] not in ('yes', 'no'):
+        raise ValueError("incident_graph and incident_report must be 'yes' or 'no'")
+    center, tolerance, grid = region_config(data)
+    query.update(region_center=list(center), region_tolerance=tolerance, region_grid=list(grid))
+    start_date, end_date = standing_window(query)
+    step = data.get('chart_step') or chart_step(start_date, end_date) # Kept fixed while the window slides
+    if step not in CHART_STEPS:
+        raise ValueError(f'chart_step must be one of {", ".join(CHART_STEPS)}')
+    query['chart_step'] = step
+    return query
+
+def standing_window(query, now=None):
+    """
+    Computes the current timeframe of a standing query.
+
+    Args:
+        query (dict): Standing query definition.
+        now (float): UNIX time, defaults to the clock.
+
+    Returns:
+        start_date (date): First day of the timeframe.
+        end_date (date): Last day of the timeframe.
+    """
+    if 'days' not in query:
+        return job_window(query)
+    today = datetime.fromtimestamp(time.time() if now is None else now, tz=timezone.utc).date()
+    return today - timedelta(days=query['days'] - 1), today
+
+def _options(query):
+    """Requested outputs of a standing query, see shards.analyze_incidents"""
+    center, tolerance, grid = region_config(query)
+    return {'map': None, 'map_cell': None,
+            'chart_step': query['chart_step'] if query['incident_graph'] == 'yes' else None,
+            'regions': (center, tolerance, grid) if query['incident_report'] == 'yes' else None}
+
+def _empty_state(query, start_date, end_date):
+    """State of a standing query over no incidents"""
+    return {'start': start_date.isoformat(), 'end': end_date.isoformat(),
+            'aggregate': JobAggregate(chart=TimeHistogram(query['chart_step']) if query['incident_graph'] == 'yes' else None,
+                                      regions=RegionCounts(*region_config(query)) if query['incident_report'] == 'yes' else None)}
+
+def _apply(state, partial, sign):
+    """
+    Adds (sign 1) or removes (sign -1) the partial results of a set of
+    incidents from the state of a standing query.
+    """
+    state['aggregate'] = state['aggregate'].merge(partial if sign > 0 else partial.negate())
+
+def _encode_state(state):
+    """Serializes the state of a standing query, its published result"""
+    return json.dumps({'start': state['start'], 'end': state['end'], 'aggregate': state['aggregate'].to_json()})
+
+def _decode_state(value):
+    """Reads a state written by _encode_state"""
+    state = json.loads(value)
+    state['aggregate'] = JobAggregate.from_json(state['aggregate'])
+    return state
+
+def _days_partial(query, first, last, start_date, end_date):
+    """Partial results of the stored incidents of the days first to last, bucketed for the timeframe"""
+    return analyze_incidents(load_incidents(first, last), start_date, end_date, _options(query))
+
+def _slide(query, state, start_date, end_date, lock=None):
+    """
+    Moves the state of a standing query to a new timeframe: the days that
+    left it are removed and the days that entered are added, each read from
+    the stored incidents, so the cost follows the days moved. A state with
+    no day in common with the new timeframe is rebuilt. The lock of the
+    query, if given, is extended before every read.
+    """
+    def days_partial(*args):
+        if lock is not None:
+            lock.reacquire()
+        return _days_partial(query, *args)
+
+    old_start = datetime.fromisoformat(state['start']).date()
+    old_end = datetime.fromisoformat(state['end']).date()
+    if old_start > end_date or old_end < start_date:
+        state = _empty_state(query, start_date, end_date)
+        _apply(state, days_partial(start_date, end_date, start_date, end_date), 1)
+        return state
+    if old_start < start_date:
+        _apply(state, days_partial(old_start, start_date - timedelta(days=1), old_start, start_date - timedelta(days=1)), -1)
+    elif old_start > start_date:
+        _apply(state, days_partial(start_date, old_start - timedelta(days=1), start_date, end_date), 1)
+    if old_end > end_date:
+        _apply(state, days_partial(end_date + timedelta(days=1), old_end, end_date + timedelta(days=1), old_end), -1)
+    elif old_end < end_date:
+        _apply(state, days_partial(old_end + timedelta(days=1), end_date, start_date, end_date), 1)
+    state['start'], state['end'] = start_date.isoformat(), end_date.isoformat()
+    return state
+
+def add_standing_query(data):
+    """
+    This function registers a standing query, computes its result once over
+    the whole timeframe and publishes it to the results database.
+
+    Args:
+        data (dict): Posted definition, see make_standing_query.
+
+    Returns:
+        standing (dict): 'id', 'query', 'result' and 'updated' of the
+                         standing query, see get_standing_query.
+
+    Raises:
+        ValueError: If the definition is malformed.
+    """
+    query = make_standing_query(data)
+    sid = str(uuid.uuid4())
+    start_date, end_date = standing_window(query)
+    state = _empty_state(query, start_date, end_date)
+    _apply(state, _days_partial(query, start_date, end_date, start_date, end_date), 1)
+    result = _encode_state(state)
+    updated = time.time()
+    results.hset(STANDING_PREFIX + sid, mapping={'query': json.dumps(query), 'result': result, 'updated': updated})
+    logging.info(f'Registered standing query {sid}')
+    return {'id': sid, 'query': query, 'result': json.loads(result), 'updated': updated}
+
+def get_standing_query(sid):
+    """
+    Reads a standing query, first moving its timeframe if the day changed
+    since its last refresh, or rebuilding it if that refresh failed.
+
+    Args:
+        sid (string): Standing query ID.
+
+    Returns:
+        standing (dict): 'id', 'query', 'result' ('start' and 'end' of the
+                         timeframe and the serialized aggregates.JobAggregate
+                         of its incidents) and 'updated' (UNIX time of the
+                         last refresh), None if unknown.
+    """
+    query, result, stale = results.hmget(STANDING_PREFIX + sid, ['query', 'result', 'stale'])
+    if query is None:
+        return None
+    start_date, end_date = standing_window(json.loads(query))
+    if stale is not None or json.loads(result)['end'] != end_date.isoformat():
+        refresh_standing([], [sid])
+    fields = results.hgetall(STANDING_PREFIX + sid)
+    if not fields:
+        return None
+    return {'id': sid, 'query': json.loads(fields[b'query']), 'result': json.loads(fields[b'result']), 'updated': float(fields[b'updated'])}
+
+def get_standing_ids():
+    """Returns the IDs of every standing query"""
+    return [key.decode('utf8')[len(STANDING_PREFIX):] for keys in scan_batches(results, lambda key: key.startswith(STANDING_PREFIX.encode('utf8'))) for key in keys]
+
+def delete_standing_query(sid):
+    """Removes a standing query, returns False if it is unknown"""
+    return bool(results.delete(STANDING_PREFIX + sid))
+
+def standing_spans(sids):
+    """
+    Returns the timeframes of the current results of standing queries, the
+    only incidents refresh_standing applies, so an ingest keeps just the
+    changes inside them.
+
+    Args:
+        sids (list): Standing query IDs.
+
+    Returns:
+        spans (list): (first, last) UNIX times, last excluded.
+    """
+    pipe = results.pipeline(transaction=False)
+    for sid in sids:
+        pipe.hget(STANDING_PREFIX + sid, 'result')
+    spans = []
+    for value in pipe.execute():
+        if value is not None:
+            state = json.loads(value)
+            first = datetime.fromisoformat(state['start']).replace(tzinfo=timezone.utc)
+            last = datetime.fromisoformat(state['end']).replace(tzinfo=timezone.utc) + timedelta(days=1)
+            spans.append((int(first.timestamp()), int(last.timestamp())))
+    return spans
+
+def refresh_standing(changes, sids=None, now=None):
+    """
+    This function brings standing queries up to date after an ingest from
+    just its delta. Each change is a set of incidents leaving (sign -1, the
+    stored copy of an updated or deleted incident) or entering (sign 1, a
+    new or updated one) the data; its part inside the timeframe of a query
+    is applied to the query state. Sliding timeframes are then moved to the
+    current day and the refreshed results are published. Each query is
+    refreshed under its lock, extended while the refresh reads incidents. A
+    query whose lock was lost anyway keeps its result and is marked stale,
+    the incidents are already stored, so its next refresh rebuilds it from
+    them.
+
+    Args:
+        changes (list): (timestamps, latitudes, longitudes, sign) tuples,
+                        coordinates as validated at ingest.
+        sids (list): Standing query IDs, defaults to every one.
+        now (float): UNIX time, defaults to the clock.
+    """
+    sids = get_standing_ids() if sids is None else sids
+    # One frame per direction, however many batches the ingest wrote
+    changes = [tuple(np.concatenate([change[i] for change in changes if change[3] == sign]) for i in range(3)) + (sign,)
+               for sign in (-1, 1) if any(change[3] == sign for change in changes)]
+    for sid in sids:
+        key = STANDING_PREFIX + sid
+        lock = results.lock(STANDING_LOCK_PREFIX + sid, timeout=STANDING_LOCK_TIMEOUT)
+        try:
+            with lock:
+                query, state, stale = results.hmget(key, ['query', 'result', 'stale'])
+                if query is None:
+                    continue
+                query = json.loads(query)
+                if stale is None:
+                    state = _decode_state(state)
+                    start_date = datetime.fromisoformat(state['start']).date()
+                    end_date = datetime.fromisoformat(state['end']).date()
+                    options = _options(query)
+                    for timestamps, latitudes, longitudes, sign in changes:
+                        frame = incidents_frame(timestamps, latitudes, longitudes, '', start_date, end_date)
+                        if len(frame):
+                            _apply(state, analyze_incidents(frame, start_date, end_date, options), sign)
+                else:
+                    state = _empty_state(query, date.min, date.min) # Shares no day with the timeframe, so _slide rebuilds it
+                start_date, end_date = standing_window(query, now)
+                state = _slide(query, state, start_date, end_date, lock)
+                lock.reacquire()
+                pipe = results.pipeline()
+                pipe.hset(key, mapping={'result': _encode_state(state), 'updated': time.time()})
+                if stale is not None:
+                    pipe.hdel(key, 'stale')
+                pipe.execute()
+        except LockError as e:
+            results.hset(key, 'stale', 1)
+            logging.warning(f'Standing query {sid} lost its lock during a refresh, it is rebuilt on the next one: {e}')
+    logging.debug(f'Refreshed {len(sids)} standing queries')
+
+def reset_standing():
+    """Empties the state of every standing query, after the incidents were deleted"""
+    for sid in get_standing_ids():
+        key = STANDING_PREFIX + sid
+        with results.lock(STANDING_LOCK_PREFIX + sid, timeout=STANDING_LOCK_TIMEOUT):
+            query = results.hget(key, 'query')
+            if query is None:
+                continue
+            query = json.loads(query)
+            state = _empty_state(query, *standing_window(query))
+            results.hset(key, mapping={'result': _encode_state(state), 'updated': time.time()})
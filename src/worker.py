@@ -1,387 +1,242 @@
 #!/usr/bin/env python3
 
 # Imports
-from jobs import get_job_by_id, update_job_status, post_result, q, rd # Methods and clients
-from hotqueue import HotQueue
-import redis
+from jobs import start_job, update_job_status, post_result, job_cache_key, dataset_version, get_cached_result, get_cached_images, cache_result, post_images, pop_job, record_job_time, WORKER_CONCURRENCY # Methods and clients
+from histograms import chart_step, TIME_OF_DAY
+from aggregates import JobAggregate, LocationTotals, TimeHistogram, RegionCounts
+from rollups import rollups_ready, load_rollups
+from regions import region_config, DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID
+from shards import analyze_window
+from maps import map_level, grid_map
+from dates import job_window
+from render import render_images, warm_renderer
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
-from datetime import date, timedelta
-import json
 import os
 import logging
-import plotly.express as px
-import pandas as pd
 
 # Global variables / constants
 log_var = os.environ.get('LOG_LEVEL', 'DEBUG') 
 logging.basicConfig(level=log_var)
 
+EXPRESS_SLOTS = int(os.environ.get('EXPRESS_SLOTS', 1)) # Extra job slots that only take cheap jobs
+FAILED_RESULT = ["Failed to process data, check if data and job parameters were posted correctly\n", 'Map not requested', 'Graph not requested', 'Report not requested']
+
 # Function definitions
-def create_summary(jobid):
+def create_summary(partial):
     """
-    This function receives a job request and finds the average location of traffic
-    incidents in the given timeframe.
+    This function receives the analysis of a job and returns the totals
+    behind its summary, the number and average location of the traffic
+    incidents in the given timeframe. The API formats them.
 
     Args:
-        jobid (string): Unique job ID
+        partial (JobAggregate): Merged partial results of the job timeframe,
+                                see shards.analyze_incidents.
 
     Returns:
-        summary (string): A summary statistics statement of the traffic 
-                          incidents over the timeframe specified by the job.
+        summary (list): Serialized location totals, see
+                        aggregates.LocationTotals.
     """
+    if partial.location.located == 0:
+        logging.warning('No incidents with a valid location in the job timeframe')
+    return partial.location.to_json()
 
-    # Initiate analysis
-    #job_id = jobid
-    job = get_job_by_id(jobid)
-    start = job['start']
-    end = job['end']
-    incident_latitudes = []
-    incident_longitudes = []
-    logging.debug('Worker read job data')
-    start_date = date(int(start[6:10]), int(start[0:2]), int(start[3:5])) # Year(4)/Month(2)/Day(2) add space at end.
-    end_date = date(int(end[6:10]), int(end[0:2]), int(end[3:5]))
-    try:
-        # Gather the average location of all incidents within timeframe
-        for item in rd.keys():
-            incident = json.loads(rd.get(item)) # Gets incident dictionary
-            # Create check between timeframe
-            data_date = incident['Published Date']
-            incident_date = date(int(data_date[6:10]), int(data_date[0:2]), int(data_date[3:5]))
-            #start_date = date(int(start[6:10]), int(start[0:2]), int(start[3:5])) # Year(4)/Month(2)/Day(2) add space at end.
-            invalid_pt_count = 0
-            if (start_date <= incident_date and incident_date <= end_date):
-                # Append the locations to the lists
-                if incident['Latitude'] == '' or incident['Latitude'] == '':
-                    continue
-                elif float(incident['Latitude'])>50 or float(incident['Latitude'])<10:
-                    continue
-                elif abs(float(incident['Longitude']))>120 or abs(float(incident['Longitude']))<70:
-                    continue
-                else:
-                    try:
-                        incident_latitudes.append(float(incident['Latitude']))
-                        incident_longitudes.append(float(incident['Longitude']))
-                    except ValueError:
-                        invalid_pt_count+=1
-                        logging.error(f'Skipped {invalid_pt_count} points due to missing longitude or latitude data\n')
-                        print('Found an invalid data point with either invalid latitude or longitude\n')
-                        continue
-        logging.debug('Worker finished analysis')
-        lonavg = sum(incident_longitudes)/len(incident_longitudes)
-        latavg = sum(incident_latitudes)/len(incident_latitudes)
-        freq = len(incident_latitudes)
-        summary = f"The average incident location is at ({latavg}N, {lonavg}W), and there were {freq} incidents during this period.\n"
-        return summary
-    except TypeError:
-        logging.warning('Worker could not initialize dates correctly')
-        post_result(jobid, 'Data processing was unsuccessful')
-        update_job_status(jobid, 'Complete')
-        return "Failed to process data, check if data and job parameters were posted correctly\n"
-
-def create_chart(jobid):
+def create_chart(partial):
     """
-    This function, based on the summary results, creates a bar chart of the
-    charecteristics of observed incidents over the noted time period.
+    This function, based on the summary results, returns the incident counts
+    of the chart of the noted time period.
 
     Args:
-        jobid (string): Unique job ID
+        partial (JobAggregate): Merged partial results of the job timeframe.
 
     Returns:
-        result (list): Array of information to create the chart.
+        result (dict): Serialized chart histogram, see
+                       aggregates.TimeHistogram.
     """
-    job = get_job_by_id(jobid)
-    start = job['start']
-    end = job['end']
-    incident_times = []
-    incident_dates = []
-    logging.debug('Worker read job data')
-    start_date = date(int(start[6:10]), int(start[0:2]), int(start[3:5])) # Year(4)/Month(2)/Day(2) add space at end.
-    end_date = date(int(end[6:10]), int(end[0:2]), int(end[3:5]))
-    timeStep = 'year'
-    duration = end_date.year-start_date.year
-    if start_date.year==end_date.year:
-        if start_date.month==end_date.month:
-            if start_date.day==end_date.day:
-                timeStep = 'hour'
-            else:
-                timeStep = 'day'
-                duration = end_date.day-start_date.day
-        else:
-            timeStep = 'month'
-            duration = end_date.month-start_date.month
-    
-    #making list of valid days and/or times depending on timestep
-    for item in rd.keys():
-        incident = json.loads(rd.get(item))
-        #Check if data is valid (inside job timeframe)
-        data_date = incident['Published Date']
-        incident_date = date(int(data_date[6:10]), int(data_date[0:2]), int(data_date[3:5]))
-        if (start_date <= incident_date and incident_date <= end_date):
-            #Append data to list
-            if timeStep == 'hour':
-                incident_time = str(data_date[11:19]) #storing hh:mm:ss
-                if str(data_date[20:23])=='PM':
-                    incident_time[0:2] = str(int(incident_time[0:2])+12)
-                incident_times.append(incident_time)
-            else:
-                incident_dates.append(incident_date)
-    if timeStep=='hour':
-        #Morning is defined as 6am-12pm, afternoon is 12pm-5pm (12-17 military time), evening is 5pm-10pm(17-22 military time), late_night is 10pm-6am (22-6military time). Notice that spread is 6hrs, 5hrs, 5hrs, then 8hrs. These are divided in unequal amounts on account of time periods of interest. 
-        result = {'Morning':0, 'Afternoon':0, 'Evening':0, 'Late_night':0}
-        #duration = max(incident_times)-min(incident_times)
-        for item in incident_times:
-            hr = int(item[0:2])
-            mins = int(item[3:5])
-            sec = int(item[6:8])
-            if hr>=6 and hr<=12:
-                if hr==12:
-                    if (mins>0) or (sec>0):
-                        result['Afternoon']+=1
-                        continue
-                result['Morning']+=1
-                continue
-            elif hr>12 and hr<=17:
-                if hr==17:
-                    if (mins>0) or (sec>0):
-                        result['Evening']+=1
-                        continue
-                result['Afternoon']+=1
-                continue
-            #hr>17 or <6
-            else: 
-                result['Late_night']+=1
-                continue
-        """
-        result_chart = []
-        for i in range(len(result)):
-            for n, item in enumerate(result):
-                if n==i:
-                    result_chart.append({item:result[item]})
-                    break
-        """
-        result_chart = {}
-        for key, val in result.items():
-            result_chart[key] = [val]
-        return result_chart    
-    else:
-        result = []
-        #result_chart = []
-        result_chart = {}
-        if timeStep == 'year':
-            for i in range(duration+1):
-                result.append({start_date.year+i:0})
-            for item in incident_dates:
-                for i in range(duration+1):
-                    if (item.year-start_date.year)==i:
-                        result[i][item.year]+=1
-                        continue
-        elif timeStep == 'month':
-            for i in range(duration+1):
-                result.append({start_date.month+i:0})
-            for item in incident_dates:
-                for i in range(duration+1):
-                    if (item.month-start_date.month)==i:
-                        result[i][item.month]+=1
-                        continue
-        else:
-            for i in range(duration+1):
-                result.append({start_date.day+i:0})
-            for item in incident_dates:
-                for i in range(duration+1):
-                    if (item.day-start_date.day)==i:
-                        result[i][item.day]+=1
-                        continue
-        for dict_elem in result:
-            for key, val in dict_elem.items():
-                result_chart.setdefault(key, []).append(val)
-        #result_chart = result
-        return result_chart
+    return partial.chart.to_json()
 
-def create_map(jobid):
+def create_map(partial):
     """
     This function, based on the summary results, creates a map
     of the observed incidents over the noted time period
 
     Args:
-        jobid (string): Unique job ID
+        partial (JobAggregate): Merged partial results of the job timeframe.
 
     Returns:
         result_map (dictionary): Dictionary of lists with information to create
-                             the incident map.
+                             the incident map, single incidents or counts
+                             per grid cell (see maps.grid_map).
     """
-    job = get_job_by_id(jobid)
-    start = job['start']
-    end = job['end']
-    incident_latitudes = []
-    incident_longitudes = []
-    incident_addresses = []
-    logging.debug('Worker read job data')
-    start_date = date(int(start[6:10]), int(start[0:2]), int(start[3:5])) # Year(4)/Month(2)/Day(2) add space at end.
-    end_date = date(int(end[6:10]), int(end[0:2]), int(end[3:5]))
-    try:
-        for item in rd.keys():
-            incident = json.loads(rd.get(item))
-            #Check if data is valid (inside job timeframe)
-            data_date = incident['Published Date']
-            incident_date = date(int(data_date[6:10]), int(data_date[0:2]), int(data_date[3:5]))
-            invalid_pt_count =0
-            if (start_date <= incident_date and incident_date <= end_date):
-                #Append data to list
-                if incident['Latitude'] == '' or incident['Latitude'] == '':
-                    continue
-                elif float(incident['Latitude'])>50 or float(incident['Latitude'])<10:
-                    continue
-                elif abs(float(incident['Longitude']))>120 or abs(float(incident['Longitude']))<70:
-                    continue
-                else:
-                    try: 
-                        incident_latitudes.append(float(incident['Latitude']))
-                        incident_longitudes.append(float(incident['Longitude']))
-                        incident_addresses.append(str(incident['Address']))
-                    except ValueError:
-                        invalid_pt_count+=1
-                        logging.error(f'Skipped {invalid_pt_count} points due to missing longitude, latitude, or address data\n')
-                        print('Found an invalid data point with either invalid latitude, longitude, or address\n')
-                        continue
-        logging.debug('Worker finished analysis')
-        result_map = {'latitudes':incident_latitudes, 'longitudes': incident_longitudes, 'Address': incident_addresses}
-        return result_map 
-    except TypeError:
-        logging.warning('Worker could not initialize dates correctly')
-        post_result(jobid, 'Data processing was unsuccessful')
-        update_job_status(jobid, 'Complete')
-        return 
+    if 'cells' in partial.map:
+        return grid_map(partial.map['cells'], partial.map['cell'])
+    return partial.map
 
-def create_regional_report(jobid):
+def create_regional_report(partial):
     """
-    This function, based on the time range provided, creates a summary report on the 
-    incident data based on the region they occured in Austin.
+    This function, based on the time range provided, returns the incident
+    counts behind the report on the region they occured in Austin.
 
     Args:
-        jobid (string): Unique job ID
+        partial (JobAggregate): Merged partial results of the job timeframe.
 
     Returns:
-        report (dict): Summary report of the regional distribution of the 
-                       incidents that occured during the timeframe specified
-                       by the job.
+        report (dict): Serialized region counts, see aggregates.RegionCounts.
     """
-    job = get_job_by_id(jobid)
-    start = job['start']
-    end = job['end']
-    incident_latitudes = []
-    incident_longitudes = []
-    Downtown_Austin = [30.2672, -97.7431] # N, W; lat, long
-    cDowntown = 0 #count of incidients in downtown, +- 0.01 degrees in either direction
-    cEast = 0 
-    cWest = 0
-    cNorth = 0
-    cSouth = 0
-    cNE = 0
-    cNW = 0
-    cSW = 0
-    cSE = 0
-    logging.debug('Worker read job data')
-    start_date = date(int(start[6:10]), int(start[0:2]), int(start[3:5])) # Year(4)/Month(2)/Day(2) add space at end.
-    end_date = date(int(end[6:10]), int(end[0:2]), int(end[3:5]))
-    try:
-        for item in rd.keys():
-            incident = json.loads(rd.get(item))
-            #Check if data is valid (inside job timeframe)
-            data_date = incident['Published Date']
-            incident_date = date(int(data_date[6:10]), int(data_date[0:2]), int(data_date[3:5]))
-            invalid_pt_count = 0
-            if (start_date <= incident_date and incident_date <= end_date):
-                #Append data to list
-                if incident['Latitude'] == '' or incident['Latitude'] == '':
-                    continue
-                elif float(incident['Latitude'])>50 or float(incident['Latitude'])<10:
-                    continue
-                elif abs(float(incident['Longitude']))>120 or abs(float(incident['Longitude']))<70:
-                    continue
-                else:
-                    try:
-                        incident_latitudes.append(float(incident['Latitude']))
-                        incident_longitudes.append(float(incident['Longitude']))
-                    except ValueError:
-                        invalid_pt_count+=1
-                        logging.error(f'Skipped {invalid_pt_count} points due to missing longitude or latitude data\n')
-                        print('Found an invalid data point with either invalid latitude or longitude\n')
-                        continue
-        rel_lat = ['Same']*len(incident_latitudes)
-        for index,lat in enumerate(incident_latitudes):
-            if lat-Downtown_Austin[0] > 0.01:
-                rel_lat[index] = 'North'
-            elif lat-Downtown_Austin[0] < -0.01:
-                rel_lat[index] = 'South'
-        rel_lon = ['Same']*len(incident_longitudes)
-        for index,lon in enumerate(incident_longitudes):
-            if abs(lon)-abs(Downtown_Austin[1]) < -0.01:
-                rel_lon[index] = 'East'
-            elif abs(lon)-abs(Downtown_Austin[1]) > 0.01:
-                rel_lon[index] = 'West'
-        for index, lat in enumerate(rel_lat):
-            lon = rel_lon[index]
-            if (lat=='Same') and (lon=='Same'):
-                cDowntown+=1
-            elif lat=='North':
-                if lon=='Same':
-                    cNorth+=1
-                elif lon=='East':
-                    cNE+=1
-                else:
-                    cNW+=1
-            elif lat=='South':
-                if lon=='Same':
-                    cSouth+=1
-                elif lon=='East':
-                    cSE+=1
-                else:
-                    cSW+=1
-            else:
-                if lon=='East':
-                    cEast+=1
-                else:
-                    cWest+=1
-        logging.debug('Worker finished analysis')
-        report = {'Downtown':cDowntown, 'North': cNorth, 'NE':cNE, 'NW':cNW, 'East': cEast, 'West': cWest, 'South':cSouth, 'SW':cSW, 'SE':cSE}
-        return report
-    except TypeError:
-        logging.warning('Worker could not initialize dates correctly')
-        post_result(jobid, 'Data processing was unsuccessful')
-        update_job_status(jobid, 'Complete')
-        return
+    return partial.regions.to_json()
+
+def rollup_partial(cube, start_date, end_date, options):
+    """
+    This function builds the partial results of a job from the precomputed
+    daily rollups of its timeframe instead of the raw incidents. Maps and
+    custom region grids cannot be answered this way.
+
+    Args:
+        cube (dict): Summed rollups, as returned by load_rollups.
+        start_date (date): First day of the job timeframe.
+        end_date (date): Last day of the job timeframe.
+        options (dict): Requested outputs, see shards.analyze_incidents.
+
+    Returns:
+        partial (JobAggregate): Partial results of the job timeframe.
+    """
+    partial = JobAggregate(LocationTotals(cube['located'], cube['lat_sum'], cube['lon_sum']))
+    step = options.get('chart_step')
+    if step == 'time_of_day':
+        partial.chart = TimeHistogram(step, dict(zip(TIME_OF_DAY, cube['time_of_day'])))
+    elif step == 'hour':
+        partial.chart = TimeHistogram.from_published(cube['hours'], start_date, end_date, step, cube['hour_counts'])
+    elif step:
+        partial.chart = TimeHistogram.from_published(cube['days'], start_date, end_date, step, cube['day_counts'])
+    if options.get('regions'):
+        partial.regions = RegionCounts(*options['regions'], cube['regions'])
+    return partial
 
-@q.worker
 def do_work(jobid):
     # Main function definition
-    update_job_status(jobid, 'In Progress')
+    # Mark the job in progress and read it once, everything below uses this copy
+    job = start_job(jobid)
     logging.info('Worker starting work')
     
     # Initiate analysis
-    job = get_job_by_id(jobid)
     map_request = job['incident_map']
     graph_request = job['incident_graph']
     report_request = job['incident_report']
+    logging.debug('Worker read job data')
+    try:
+        start_date, end_date = job_window(job)
+        regions = region_config(job)
+        map_mode, map_cell = map_level(job, start_date, end_date)
+    except ValueError as e:
+        logging.warning(f'Worker could not initialize the job: {e}')
+        post_result(jobid, FAILED_RESULT)
+        update_job_status(jobid, 'Complete')
+        return
+
+    # Identical jobs on the same data reuse the cached result
+    cache_key = job_cache_key(job)
+    version = dataset_version()
+    cached = get_cached_result(cache_key, version)
+    if cached is not None:
+        logging.info('Job answered from the result cache')
+        post_images(jobid, get_cached_images(cache_key, version))
+        post_result(jobid, cached)
+        update_job_status(jobid, 'Complete')
+        return
+
+    options = {'map': map_mode if map_request == 'yes' else None,
+               'map_cell': map_cell,
+               'chart_step': (job.get('chart_step') or chart_step(start_date, end_date)) if graph_request == 'yes' else None,
+               'regions': regions if report_request == 'yes' else None}
+
+    # Without a map every analysis can be answered from the daily rollups,
+    # otherwise the incidents are read once, in shards, and shared
+    default_regions = regions == (DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID)
+    if not options['map'] and (not options['regions'] or default_regions) and rollups_ready():
+        logging.debug('Answering job from rollups')
+        partial = rollup_partial(load_rollups(start_date, end_date), start_date, end_date, options)
+    else:
+        partial = analyze_window(start_date, end_date, options)
 
     # Run the summary regardless
-    summary = create_summary(jobid)
+    summary = create_summary(partial)
     
     # Run checks for the other data
     incident_map = 'Map not requested'
     if (map_request == 'yes'):
-        incident_map = create_map(jobid)
+        incident_map = create_map(partial)
 
     incident_graph = 'Graph not requested'
     if (graph_request == 'yes'):
-        incident_graph = create_chart(jobid)
+        incident_graph = create_chart(partial)
 
     incident_report = 'Report not requested'
     if (report_request == 'yes'):
-        incident_report = create_regional_report(jobid)
-    
-
-    # Finish the Job
+        incident_report = create_regional_report(partial)
+    logging.debug('Worker finished analysis')
+
+    # Finish the Job, rendering the images once so fetching them is free
+    result = [summary, incident_map, incident_graph, incident_report]
+    images = render_images(incident_map if map_request == 'yes' else None,
+                           partial.chart.chart(start_date, end_date) if graph_request == 'yes' else None)
+    post_images(jobid, images)
+    post_result(jobid, result)
+    cache_result(cache_key, version, result, images)
     update_job_status(jobid, 'Complete')
-    post_result(jobid, [summary, incident_map, incident_graph, incident_report])
 
-do_work()
+def _run_job(jobid, cost):
+    """
+    Runs one job on a pool thread and records its run time for the wait
+    estimates. An unexpected error completes the job with a failure message
+    instead of leaving it in progress forever.
+    """
+    started = time.monotonic()
+    try:
+        do_work(jobid)
+    except Exception:
+        logging.exception(f'Job {jobid} failed')
+        post_result(jobid, FAILED_RESULT)
+        update_job_status(jobid, 'Complete')
+    record_job_time(cost, time.monotonic() - started)
+
+def _express_loop():
+    """Runs cheap jobs one at a time, whatever the pool is busy with"""
+    while True:
+        jobid, cost = pop_job(express_only=True)
+        if jobid is not None:
+            _run_job(jobid, cost)
+
+def run_worker(concurrency=None, express_slots=None):
+    """
+    This function pulls job IDs off the scheduler and runs up to concurrency
+    jobs at once on a thread pool, so the time one job spends waiting on
+    redis is used by the others. A job is only taken off the scheduler once
+    a thread is free, leaving the rest for other worker replicas. The
+    express slots only take cheap jobs, so they never wait behind a pool
+    full of long ones.
+
+    Args:
+        concurrency (int): Jobs run at once, defaults to WORKER_CONCURRENCY.
+        express_slots (int): Extra slots for cheap jobs, defaults to
+                             EXPRESS_SLOTS.
+    """
+    concurrency = max(1, concurrency or WORKER_CONCURRENCY)
+    express_slots = EXPRESS_SLOTS if express_slots is None else express_slots
+    logging.info(f'Worker running up to {concurrency} jobs at once, plus {express_slots} express slots')
+    warm_renderer()
+    for _ in range(express_slots):
+        threading.Thread(target=_express_loop, daemon=True).start()
+    slots = threading.BoundedSemaphore(concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            slots.acquire()
+            jobid, cost = pop_job()
+            if jobid is None:
+                slots.release()
+                continue
+            future = executor.submit(_run_job, jobid, cost)
+            future.add_done_callback(lambda _: slots.release())
+
+if __name__ == '__main__':
+    run_worker()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+# Imports
+import fakeredis
+import pytest
+import jobs
+import incidents
+import ingest
+import rollups
+import snapshot
+import standing
+import shards
+import worker
+import live
+import api
+
+# Global variables / constants
+DATABASES = {'rd': 0, 'sched': 1, 'jdb': 2, 'results': 3} # Clients of jobs and their database
+
+# Function definitions
+@pytest.fixture
+def redis_server(monkeypatch):
+    """Points every module at an in-memory redis, one database per client as in jobs"""
+    server = fakeredis.FakeServer()
+    for module in (jobs, incidents, ingest, rollups, snapshot, standing, worker, live, api):
+        for name, db in DATABASES.items():
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, fakeredis.FakeRedis(server=server, db=db))
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', None)
+    monkeypatch.setattr(shards, 'WORKER_PROCESSES', 1)
+    monkeypatch.setattr(live, '_changes', None) # Subscribed again on the new server
+    return server
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Imports
+from aggregates import LocationTotals, TimeHistogram, RegionCounts, JobAggregate, merge_all
+from regions import DOWNTOWN_AUSTIN, REGION_TOLERANCE
+from maps import grid_cells
+from datetime import date
+import numpy as np
+import pickle
+import json
+import pytest
+
+# Global variables / constants
+START = date(2021, 12, 20)
+END = date(2022, 2, 10)
+CELL = 0.01
+
+# Function definitions
+def _incidents(seed, size):
+    """Random publish times and coordinates around downtown, inside START to END"""
+    rng = np.random.default_rng(seed)
+    first = np.datetime64(START, 's').astype(np.int64)
+    last = np.datetime64(END, 's').astype(np.int64) + 86399
+    published = rng.integers(first, last, size).astype('datetime64[s]')
+    latitudes = DOWNTOWN_AUSTIN[0] + rng.uniform(-0.05, 0.05, size)
+    longitudes = DOWNTOWN_AUSTIN[1] + rng.uniform(-0.05, 0.05, size)
+    return published, latitudes, longitudes
+
+def _partial(seed, size, step='week', grid=(5, 5), map_cell=CELL):
+    """JobAggregate of random incidents, with a grid map unless map_cell is None"""
+    published, latitudes, longitudes = _incidents(seed, size)
+    return JobAggregate(LocationTotals.from_coordinates(latitudes, longitudes),
+                        TimeHistogram.from_published(published, START, END, step),
+                        RegionCounts.from_coordinates(latitudes, longitudes, DOWNTOWN_AUSTIN, REGION_TOLERANCE, grid),
+                        None if map_cell is None else {'cell': map_cell, 'cells': grid_cells(latitudes, longitudes, map_cell)})
+
+def _parts(partial):
+    """The single aggregates of a JobAggregate"""
+    return [partial.location, partial.chart, partial.regions]
+
+def test_merge_associative():
+    """
+    Testing truths to validate that every aggregate merges to the same result
+    however the merges are grouped.
+    """
+    a, b, c = _partial(1, 300), _partial(2, 50), _partial(3, 0)
+    for first, second, third in zip(_parts(a), _parts(b), _parts(c)):
+        assert first.merge(second).merge(third) == first.merge(second.merge(third))
+    assert a.merge(b).merge(c).to_json() == a.merge(b.merge(c)).to_json()
+    assert merge_all([a, b, c]).to_json() == merge_all([c, a, b]).to_json()
+
+def test_merge_matches_union():
+    """
+    Testing truths to validate that merging the partials of disjoint
+    incident sets equals the partial of their union.
+    """
+    published, latitudes, longitudes = _incidents(4, 500)
+    whole = JobAggregate(LocationTotals.from_coordinates(latitudes, longitudes),
+                         TimeHistogram.from_published(published, START, END, 'month'),
+                         RegionCounts.from_coordinates(latitudes, longitudes, DOWNTOWN_AUSTIN, REGION_TOLERANCE, (3, 3)),
+                         {'cell': CELL, 'cells': grid_cells(latitudes, longitudes, CELL)})
+    halves = [JobAggregate(LocationTotals.from_coordinates(latitudes[part], longitudes[part]),
+                           TimeHistogram.from_published(published[part], START, END, 'month'),
+                           RegionCounts.from_coordinates(latitudes[part], longitudes[part], DOWNTOWN_AUSTIN, REGION_TOLERANCE, (3, 3)),
+                           {'cell': CELL, 'cells': grid_cells(latitudes[part], longitudes[part], CELL)})
+              for part in (slice(0, 123), slice(123, None))]
+    assert merge_all(halves).to_json() == whole.to_json()
+
+def test_negate_round_trip():
+    """
+    Testing truths to validate that merging the negation of an aggregate
+    takes it back out exactly.
+    """
+    a, b = _partial(5, 200), _partial(6, 80)
+    for first, second in zip(_parts(a), _parts(b)):
+        assert first.merge(second).merge(second.negate()) == first
+    assert a.merge(b).merge(b.negate()).to_json() == a.to_json()
+    empty = a.merge(a.negate())
+    assert empty.location.located == 0 and empty.location.average() is None
+    assert empty.chart.counts == {} and not empty.regions.counts.any() and empty.map['cells'] == {}
+
+def test_negate_point_map():
+    """
+    Testing truths to validate that a partial holding map points cannot be
+    negated.
+    """
+    partial = _partial(7, 10, map_cell=None)
+    partial.map = {'latitudes': [30.1], 'longitudes': [-97.7], 'Address': ['1 Main St']}
+    with pytest.raises(ValueError):
+        partial.negate()
+
+def test_merge_mismatch():
+    """
+    Testing truths to validate that histograms of different steps and region
+    counts of different grids refuse to merge.
+    """
+    with pytest.raises(ValueError):
+        _partial(8, 10, step='week').chart.merge(_partial(8, 10, step='month').chart)
+    with pytest.raises(ValueError):
+        _partial(8, 10, grid=(3, 3)).regions.merge(_partial(8, 10, grid=(5, 5)).regions)
+
+def test_serialization():
+    """
+    Testing truths to validate that aggregates survive the JSON stored in
+    redis and the pickling of the shard process pool.
+    """
+    partial = _partial(9, 250)
+    restored = JobAggregate.from_json(json.loads(json.dumps(partial.to_json())))
+    assert restored.to_json() == partial.to_json()
+    for part, restored_part in zip(_parts(partial), _parts(restored)):
+        assert restored_part == part
+    assert pickle.loads(pickle.dumps(partial)).to_json() == partial.to_json()
+
+def test_average():
+    """
+    Testing truths to validate the average location of the location totals.
+    """
+    totals = LocationTotals.from_coordinates([30.1, 30.3], [-97.6, -97.8])
+    assert totals.located == 2
+    assert totals.average() == pytest.approx((30.2, -97.7))
+    assert LocationTotals().average() is None
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Imports
+from histograms import time_histogram, chart_step, time_of_day_index, TIME_OF_DAY, CHART_STEPS
+from collections import Counter
+from datetime import date, datetime, timedelta
+import numpy as np
+import pytest
+
+# Function definitions
+def _published(*times):
+    """datetime64 publish times from ISO strings"""
+    return np.array(times, dtype='datetime64[s]')
+
+def _reference_label(when, step):
+    """Bucket label of one publish time, computed record by record"""
+    if step == 'time_of_day':
+        seconds = when.hour * 3600 + when.minute * 60 + when.second
+        return 'Morning' if 6 * 3600 <= seconds <= 12 * 3600 else 'Afternoon' if 12 * 3600 < seconds <= 17 * 3600 else 'Evening' if 17 * 3600 < seconds <= 22 * 3600 else 'Late_night'
+    return {'hour': when.strftime('%Y-%m-%d %H:00'), 'day': when.strftime('%Y-%m-%d'), 'month': when.strftime('%Y-%m'), 'year': when.strftime('%Y'),
+            'week': f'Week of {(when.date() - timedelta(days=when.weekday())).isoformat()}'}[step]
+
+def test_matches_reference():
+    """
+    Testing truths to validate every step against bucketing each publish
+    time on its own, for the incidents of a timeframe as the analyses load.
+    """
+    rng = np.random.default_rng(3)
+    published = rng.integers(np.datetime64('2021-11-29T00:00:00').astype(np.int64), np.datetime64('2023-01-03T00:00:00').astype(np.int64), 5000).astype('datetime64[s]')
+    start_date, end_date = date(2021, 11, 29), date(2023, 1, 2)
+    for step in CHART_STEPS:
+        last = start_date + timedelta(days=2) if step in ('time_of_day', 'hour') else end_date
+        inside = published[published < np.datetime64(last + timedelta(days=1))]
+        chart = time_histogram(inside, start_date, last, step)
+        expected = Counter(_reference_label(when, step) for when in inside.astype(datetime))
+        assert {label: count for label, (count,) in chart.items() if count} == dict(expected)
+        assert sum(count for count, in chart.values()) == len(inside)
+
+def test_time_of_day_index():
+    """
+    Testing truths to validate the period of the seconds around each edge.
+    """
+    seconds = [0, 6 * 3600 - 1, 6 * 3600, 12 * 3600, 12 * 3600 + 1, 17 * 3600, 17 * 3600 + 1, 22 * 3600, 22 * 3600 + 1, 86399]
+    assert [TIME_OF_DAY[index] for index in time_of_day_index(seconds)] == ['Late_night', 'Late_night', 'Morning', 'Morning', 'Afternoon', 'Afternoon', 'Evening', 'Evening', 'Late_night', 'Late_night']
+
+def test_chart_step():
+    """
+    Testing truths to validate the chart step picked from the timeframe.
+    """
+    assert chart_step(date(2022, 1, 15), date(2022, 1, 15)) == 'time_of_day'
+    assert chart_step(date(2022, 1, 1), date(2022, 1, 31)) == 'day'
+    assert chart_step(date(2022, 1, 31), date(2022, 2, 1)) == 'month'
+    assert chart_step(date(2021, 12, 31), date(2022, 1, 1)) == 'year'
+
+def test_day_across_month_and_year():
+    """
+    Testing truths to validate that daily buckets continue across the end of
+    a month and of a year, with the last second of a day in that day.
+    """
+    chart = time_histogram(_published('2021-12-31T23:59:59', '2022-01-01T00:00:00', '2022-01-31T12:00:00', '2022-02-01T00:00:00'),
+                           date(2021, 12, 30), date(2022, 2, 1), 'day')
+    assert list(chart)[:3] == ['2021-12-30', '2021-12-31', '2022-01-01']
+    assert list(chart)[-1] == '2022-02-01' and len(chart) == 34
+    assert chart['2021-12-31'] == [1] and chart['2022-01-01'] == [1]
+    assert chart['2022-01-31'] == [1] and chart['2022-02-01'] == [1]
+    assert sum(count for count, in chart.values()) == 4
+
+def test_month_across_year():
+    """
+    Testing truths to validate that monthly buckets follow the calendar
+    across a year, whatever the month lengths.
+    """
+    chart = time_histogram(_published('2021-11-30T23:59:59', '2021-12-01T00:00:00', '2022-01-31T23:59:59', '2022-02-28T10:00:00', '2022-03-01T00:00:00'),
+                           date(2021, 11, 15), date(2022, 2, 28), 'month')
+    assert chart == {'2021-11': [1], '2021-12': [1], '2022-01': [1], '2022-02': [1]} # The last time is after the timeframe
+
+def test_year():
+    """
+    Testing truths to validate yearly buckets and the first second of a year.
+    """
+    chart = time_histogram(_published('2020-12-31T23:59:59', '2021-01-01T00:00:00', '2022-01-01T00:00:00'), date(2020, 6, 1), date(2022, 1, 1), 'year')
+    assert chart == {'2020': [1], '2021': [1], '2022': [1]}
+
+def test_week_across_year():
+    """
+    Testing truths to validate that weeks start on Monday and run across the
+    end of a year.
+    """
+    chart = time_histogram(_published('2021-12-26T23:59:59', '2021-12-27T00:00:00', '2022-01-02T23:59:59', '2022-01-03T00:00:00'),
+                           date(2021, 12, 22), date(2022, 1, 3), 'week')
+    assert chart == {'Week of 2021-12-20': [1], 'Week of 2021-12-27': [2], 'Week of 2022-01-03': [1]}
+
+def test_hour_across_day():
+    """
+    Testing truths to validate hourly buckets over midnight.
+    """
+    chart = time_histogram(_published('2021-12-31T23:59:59', '2022-01-01T00:00:00'), date(2021, 12, 31), date(2022, 1, 1), 'hour')
+    assert len(chart) == 48
+    assert chart['2021-12-31 23:00'] == [1] and chart['2022-01-01 00:00'] == [1]
+
+def test_time_of_day_edges():
+    """
+    Testing truths to validate that an exact hour belongs to the earlier
+    period of the day.
+    """
+    chart = time_histogram(_published('2022-01-15T06:00:00', '2022-01-15T12:00:00', '2022-01-15T12:00:01', '2022-01-15T22:00:00', '2022-01-15T05:59:59'),
+                           date(2022, 1, 15), date(2022, 1, 15), 'time_of_day')
+    assert list(chart) == TIME_OF_DAY
+    assert chart == {'Morning': [2], 'Afternoon': [1], 'Evening': [1], 'Late_night': [1]}
+
+def test_weights():
+    """
+    Testing truths to validate that weighted publish times, as read from the
+    rollups, count their weight.
+    """
+    chart = time_histogram(_published('2021-12-31T00:00:00', '2022-01-01T00:00:00'), date(2021, 12, 1), date(2022, 1, 31), 'month', weights=[3, 4])
+    assert chart == {'2021-12': [3], '2022-01': [4]}
+
+def test_unknown_step():
+    """
+    Testing truths to validate that an unknown step is refused.
+    """
+    with pytest.raises(ValueError):
+        time_histogram(_published(), date(2022, 1, 1), date(2022, 1, 2), 'fortnight')
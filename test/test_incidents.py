@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+# Imports
+from datetime import date, datetime, timezone
+import json
+import math
+import pytest
+import incidents
+
+# Global variables / constants
+DAY_START = int(datetime(2022, 1, 15, tzinfo=timezone.utc).timestamp())
+
+# Function definitions
+def test_window_keys_ties(redis_server, monkeypatch):
+    """
+    Testing truths to validate that paging the published date index by
+    score yields every ID of the timeframe once, with runs of equal scores
+    longer than a page, at its first second and across page boundaries.
+    """
+    monkeypatch.setattr(incidents, 'SCAN_BATCH_SIZE', 7)
+    scores = {}
+    for second, ties in ((-1, 3), (0, 20), (1, 1), (2, 7), (3, 6), (600, 15), (86399, 9), (86400, 4)):
+        scores.update({f'ID_{second}_{i}': DAY_START + second for i in range(ties)})
+    incidents.rd.zadd(incidents.PUBLISHED_INDEX, scores)
+    keys = [key.decode('utf8') for key in incidents._window_keys(date(2022, 1, 15), date(2022, 1, 15))]
+    assert len(keys) == len(set(keys))
+    assert set(keys) == {key for key, score in scores.items() if DAY_START <= score < DAY_START + 86400}
+
+def test_window_keys_without_index(redis_server):
+    """
+    Testing truths to validate that without the published date index every
+    incident key is scanned, and none of the bookkeeping keys.
+    """
+    incidents.rd.mset({'ID_1': 'x', 'ID_2': 'x', incidents.COLUMNS_KEY: 'x'})
+    assert sorted(incidents._window_keys(date(2022, 1, 15), date(2022, 1, 15))) == [b'ID_1', b'ID_2']
+
+def _row(**fields):
+    """An incident row of the feed"""
+    row = {'Traffic Report ID': 'ID_1', 'Published Date': '01/15/2022 08:30:00 AM +0000', 'Issue Reported': 'Crash',
+           'Location': 'POINT (-97.7431 30.2672)', 'Latitude': '30.2672', 'Longitude': '97.7431',
+           'Address': 'Cesar Chávez St & I-35', 'Status': '', 'Agency': 'AUSTIN PD'}
+    row.update(fields)
+    return row
+
+def test_codec_round_trip(redis_server):
+    """
+    Testing truths to validate that packed incidents decode back to their
+    row, columns in feed order, and that their header holds the parsed and
+    validated fields, also once the column sets must be read from redis.
+    """
+    row = _row()
+    value = incidents.encode_incident(row)
+    assert value[0] == incidents.SCHEMA_VERSION
+    incidents.forget_column_sets()
+    assert list(incidents.decode_incident(value).items()) == list(row.items())
+    assert incidents.decode_fields(value) == (DAY_START + 30600, 30.2672, -97.7431, 'Cesar Chávez St & I-35')
+    timestamp, lat, lon, address = incidents.decode_fields(incidents.encode_incident(_row(Latitude='95', **{'Published Date': 'soon'})))
+    assert timestamp == incidents.NO_TIMESTAMP and math.isnan(lat) and math.isnan(lon)
+    assert incidents.decode_fields(incidents.encode_incident(row, 12345, (30.0, -97.0)))[:3] == (12345, 30.0, -97.0)
+
+def test_codec_json_fallback(redis_server):
+    """
+    Testing truths to validate that rows outside of the packed layout and
+    legacy JSON incidents are stored and read as JSON.
+    """
+    for row in (_row(Status='a' + incidents.SEPARATOR + 'b'), {'Traffic Report ID': 'ID_2', 'Latitude': '30.2672'},
+                {**_row(), None: ['extra']}):
+        value = incidents.encode_incident(row)
+        assert value[:1] == b'{'
+        assert incidents.decode_incident(value) == json.loads(json.dumps(row))
+    legacy = json.dumps(_row(Latitude='abc')).encode('utf8')
+    assert incidents.decode_incident(legacy) == _row(Latitude='abc')
+    timestamp, lat, lon, address = incidents.decode_fields(legacy)
+    assert timestamp == DAY_START + 30600 and math.isnan(lat) and math.isnan(lon) and address == 'Cesar Chávez St & I-35'
+
+def test_codec_versions(redis_server):
+    """
+    Testing truths to validate that incidents packed before validation are
+    validated when read, and that an unknown schema version is refused.
+    """
+    value = bytearray(incidents.encode_incident(_row(), coordinates=(5.0, -97.7431)))
+    value[0] = incidents.UNCHECKED_VERSION
+    timestamp, lat, lon, address = incidents.decode_fields(bytes(value))
+    assert math.isnan(lat) and math.isnan(lon) # Out of range
+    value[0] = incidents.SCHEMA_VERSION
+    assert incidents.decode_fields(bytes(value))[1:3] == (5.0, -97.7431) # Trusted as validated
+    value[0] = 9
+    for decode in (incidents.decode_incident, incidents.decode_fields):
+        with pytest.raises(ValueError):
+            decode(bytes(value))
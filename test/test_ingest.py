@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Imports
+from incidents import decode_incident
+from rollups import load_rollups
+from datetime import date
+import threading
+import ingest
+
+# Function definitions
+def _row(i, **fields):
+    """An incident row of the feed"""
+    row = {'Traffic Report ID': f'ID_{i}', 'Published Date': '01/15/2022 08:30:00 AM +0000', 'Issue Reported': 'Crash',
+           'Location': 'POINT (-97.7431 30.2672)', 'Latitude': '30.2672', 'Longitude': '-97.7431',
+           'Address': f'{i} Main St', 'Status': 'ARCHIVED', 'Agency': 'AUSTIN PD'}
+    row.update(fields)
+    return row
+
+def test_row_digest():
+    """
+    Testing truths to validate that the digest follows the content of a row
+    and not the order of its columns.
+    """
+    row = _row(1)
+    assert ingest.row_digest(row) == ingest.row_digest(dict(reversed(list(row.items()))))
+    assert ingest.row_digest(row) != ingest.row_digest(_row(1, Status='ACTIVE'))
+    assert ingest.row_digest({**row, None: ['extra']}) != ingest.row_digest(row)
+
+def test_delta_counts(redis_server):
+    """
+    Testing truths to validate the added, updated, unchanged and skipped
+    counts of a full load followed by delta and append loads.
+    """
+    rows = [_row(i) for i in range(25)] + [_row(0, **{'Traffic Report ID': ''})]
+    assert ingest.store_rows(rows, batch_size=10) == {'added': 25, 'updated': 0, 'unchanged': 0, 'skipped': 1, 'quarantined': 0}
+    rows[3] = _row(3, Status='ACTIVE')
+    rows[12] = _row(12, Latitude='abc')
+    rows.append(_row(30))
+    counts = ingest.store_rows(rows, batch_size=10, delta=True)
+    assert counts == {'added': 1, 'updated': 2, 'unchanged': 23, 'skipped': 1, 'quarantined': 1}
+    assert decode_incident(ingest.rd.get('ID_3'))['Status'] == 'ACTIVE'
+    counts = ingest.store_rows(rows + [_row(31), _row(4, Status='ACTIVE')], batch_size=10, append=True)
+    assert counts['added'] == 1 and counts['updated'] == 0 and counts['unchanged'] == 27
+    assert decode_incident(ingest.rd.get('ID_4'))['Status'] == 'ARCHIVED'
+
+def test_ragged_row(redis_server, tmp_path):
+    """
+    Testing truths to validate that a CSV row with more fields than the
+    header is stored like the others.
+    """
+    header = list(_row(0))
+    lines = [','.join(header)] + [','.join(_row(i).values()).replace('POINT (-97.7431 30.2672)', '') for i in range(3)]
+    lines[2] += ',extra'
+    feed = tmp_path / 'feed.csv'
+    feed.write_text('\n'.join(lines) + '\n')
+    counts = ingest.load_feed(str(feed))
+    assert counts['added'] == 3
+    assert decode_incident(ingest.rd.get('ID_1'))['null'] == ['extra'] # Stored as JSON
+    assert ingest.load_feed(str(feed), delta=True)['unchanged'] == 3
+
+def test_concurrent_ingests(redis_server):
+    """
+    Testing truths to validate that ingests running at once, like a live poll
+    during a POST /data, count every new incident once in the rollups.
+    """
+    rows = [_row(i) for i in range(300)]
+    threads = [threading.Thread(target=ingest.store_rows, args=(rows, 20, True)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert load_rollups(date(2022, 1, 15), date(2022, 1, 15))['count'] == 300
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+# Imports
+import jobs
+
+# Function definitions
+def _add(start='01/15/2022', end='01/15/2022', austin_map='no', priority=0, **params):
+    """Submits a job and returns its ID"""
+    return jobs.add_job(start, end, austin_map, 'yes', 'yes', priority=priority, **params)['id']
+
+def test_estimate_cost():
+    """
+    Testing truths to validate that rollup answerable jobs are cheap and
+    express, and that maps and custom region grids cost per day read.
+    """
+    job = jobs._instantiate_job('a', 'submitted', '01/01/2022', '01/31/2022', 'no', 'yes', 'yes')
+    assert jobs.estimate_cost(job) <= jobs.EXPRESS_COST
+    assert jobs.estimate_cost(dict(job, incident_map='yes')) > jobs.EXPRESS_COST
+    assert jobs.estimate_cost(dict(job, region_grid=[5, 5])) > jobs.EXPRESS_COST
+    assert jobs.estimate_cost(dict(job, end='12/31/2022')) > jobs.estimate_cost(job)
+    assert jobs.estimate_cost(dict(job, start='bad')) == 1.0
+
+def test_pop_order(redis_server):
+    """
+    Testing truths to validate that cheap jobs overtake expensive ones,
+    priority moves a job ahead and an express only worker never takes a
+    batch job.
+    """
+    expensive = _add('01/01/2021', '12/31/2021', 'yes')
+    cheap = _add()
+    urgent = _add('01/01/2021', '03/31/2021', 'yes', priority=100)
+    assert jobs.queue_stats()[0] == 3
+    assert jobs.pop_job(express_only=True)[0] == cheap
+    assert jobs.pop_job(express_only=True, timeout=1) == (None, 0.0)
+    jid, cost = jobs.pop_job()
+    assert jid == urgent and cost > jobs.EXPRESS_COST
+    assert jobs.pop_job()[0] == expensive
+    assert jobs.queue_stats() == (0, 0.0)
+    assert not jobs.sched.exists(jobs.QUEUED_COST_KEY)
+
+def test_max_delay(redis_server, monkeypatch):
+    """
+    Testing truths to validate that an expensive job is not overtaken by
+    cheap jobs submitted more than MAX_DELAY seconds after it.
+    """
+    clock = [1000000.0]
+    monkeypatch.setattr(jobs.time, 'time', lambda: clock[0])
+    expensive = _add('01/01/2015', '12/31/2021', 'yes')
+    clock[0] += jobs.MAX_DELAY - 10
+    cheap = _add()
+    clock[0] += 11
+    late = _add()
+    assert [jobs.pop_job()[0] for _ in range(3)] == [cheap, expensive, late]
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# Imports
+from datetime import datetime, timezone
+import json
+import time
+import ingest
+import live
+import api
+
+# Global variables / constants
+NOW = time.time() # Ingests keep the changes of the last week by the clock
+
+# Function definitions
+def _row(i, seconds_ago):
+    """An incident row of the feed, published seconds_ago before NOW"""
+    published = datetime.fromtimestamp(NOW - seconds_ago, tz=timezone.utc).strftime('%m/%d/%Y %I:%M:%S %p +0000')
+    return {'Traffic Report ID': f'ID_{i}', 'Published Date': published, 'Issue Reported': 'Crash',
+            'Location': 'POINT (-97.7431 30.2672)', 'Latitude': '30.2672', 'Longitude': '-97.7431',
+            'Address': f'{i} Main St', 'Status': 'ARCHIVED', 'Agency': 'AUSTIN PD'}
+
+def _events(pubsub):
+    """The live events published since the last call"""
+    events = []
+    while (message := pubsub.get_message(timeout=0.1)) is not None:
+        events.append(json.loads(message['data']))
+    return events
+
+def test_poll_events(redis_server, monkeypatch):
+    """
+    Testing truths to validate that a poll of a whole feed publishes only
+    the incidents of the last week, in bounded events, and counts them in
+    the rolling windows.
+    """
+    monkeypatch.setattr(live, 'LIVE_EVENT_SIZE', 4)
+    live.seed_windows(NOW)
+    pubsub = live.rd.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(live.LIVE_CHANNEL)
+    pubsub.get_message(timeout=0.1) # The ignored subscription confirmation
+    rows = [_row(i, 30 * 86400 + i) for i in range(50)] + [_row(50 + i, 500 * (i + 1)) for i in range(10)]
+    counts = live.poll_feed(lambda: rows, NOW)
+    assert counts['added'] == 60
+    events = _events(pubsub)
+    incidents = [event['data'] for event in events if event['event'] == 'incidents']
+    assert [len(data) for data in incidents] == [4, 4, 2]
+    assert sorted(row['Traffic Report ID'] for data in incidents for row in data) == sorted(f'ID_{50 + i}' for i in range(10))
+    aggregates = live.window_aggregates()
+    assert aggregates['hour']['count'] == 7 and aggregates['week']['count'] == 10
+
+def test_delete_resets_windows(redis_server):
+    """
+    Testing truths to validate that a DELETE of the data empties the live
+    windows on the next poll, and that reloaded incidents count once.
+    """
+    live.seed_windows(NOW)
+    rows = [_row(i, 60 * (i + 1)) for i in range(5)]
+    live.poll_feed(lambda: rows, NOW)
+    assert live.window_aggregates()['day']['count'] == 5
+    assert api.app.test_client().delete('/data').status_code == 200
+    live.poll_feed(lambda: [], NOW)
+    assert live.window_aggregates()['day']['count'] == 0
+    ingest.store_rows(rows)
+    live.poll_feed(lambda: rows, NOW)
+    assert live.window_aggregates()['day']['count'] == 5
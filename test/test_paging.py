@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Imports
+from jobs import scan_page, scan_batches
+from incidents import is_incident_key
+import ingest
+import api
+import jobs
+
+# Function definitions
+def _walk(client, limit, key_filter=None):
+    """The pages of a full scan_page walk"""
+    cursor, pages = 0, []
+    while True:
+        cursor, keys = scan_page(client, cursor, limit, key_filter)
+        pages.append(keys)
+        if cursor == 0:
+            return pages
+
+def test_scan_page(redis_server, monkeypatch):
+    """
+    Testing truths to validate that following the cursors of scan_page
+    visits every key once, filtered, and that scan_batches agrees.
+    """
+    monkeypatch.setattr(jobs, 'SCAN_COUNT', 7)
+    jobs.rd.mset({f'ID_{i}': 'x' for i in range(250)})
+    jobs.rd.mset({f'incidents:aux_{i}': 'x' for i in range(40)})
+    pages = _walk(jobs.rd, 25, is_incident_key)
+    keys = [key for page in pages for key in page]
+    assert sorted(keys) == sorted(f'ID_{i}'.encode() for i in range(250))
+    assert len(pages) > 1 and all(len(page) >= 25 for page in pages[:-1])
+    assert sorted(key for batch in scan_batches(jobs.rd, is_incident_key) for key in batch) == sorted(keys)
+    assert sum(len(page) for page in _walk(jobs.rd, 1000)) == 290
+
+def test_page_routes(redis_server):
+    """
+    Testing truths to validate the paged /ids and /data routes and that a
+    limit below 1 is refused.
+    """
+    ingest.store_rows([{'Traffic Report ID': f'ID_{i}', 'Published Date': '01/15/2022 08:30:00 AM +0000', 'Address': f'{i} Main St',
+                        'Latitude': '30.2672', 'Longitude': '-97.7431'} for i in range(30)])
+    client = api.app.test_client()
+    cursor, ids = 0, []
+    while True:
+        page = client.get(f'/ids?limit=10&cursor={cursor}').get_json()
+        ids += page['data']
+        cursor = page['cursor']
+        if cursor == 0:
+            break
+    assert sorted(ids) == sorted(f'ID_{i}' for i in range(30))
+    assert client.get('/data?limit=5').get_json()['data'][0]['Address'].endswith('Main St')
+    for route in ('/data', '/ids', '/jobs', '/data/quarantine'):
+        for limit in (0, -3):
+            response = client.get(f'{route}?limit={limit}')
+            assert response.status_code == 400 and response.text == 'limit must be a positive integer\n'
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+# Imports
+from regions import region_config, region_index, region_counts, region_report, DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID
+import pytest
+
+# Function definitions
+def test_region_config():
+    """
+    Testing truths to validate the defaults of the region parameters and
+    that explicit but invalid values are refused, not replaced.
+    """
+    assert region_config({}) == (DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID)
+    assert region_config({'region_center': [30.3, -97.7], 'region_tolerance': '0.02', 'region_grid': [5, 1]}) == ((30.3, -97.7), 0.02, (5, 1))
+    for job in ({'region_tolerance': 0}, {'region_tolerance': -0.01}, {'region_tolerance': 'nan'}, {'region_center': []},
+                {'region_grid': []}, {'region_grid': [0, 3]}, {'region_grid': [4, 3]}, {'region_center': 'downtown'}):
+        with pytest.raises(ValueError):
+            region_config(job)
+
+def test_region_index():
+    """
+    Testing truths to validate the cells of the grid, boundaries belonging
+    to the cell nearer the center and outer cells extending without bound.
+    """
+    center = (0.0, 0.0) # Exact boundaries with a tolerance of 0.25
+    latitudes = [0, 0.25, 0.26, -5, 0, 0]
+    longitudes = [0, 0, 0, -5, 0.26, -0.25]
+    assert region_index(latitudes, longitudes, center, 0.25).tolist() == [4, 4, 1, 6, 5, 4]
+    assert region_index([0.75, 0.76, -0.5], [0, 0, 0.75], center, 0.25, (5, 5)).tolist() == [7, 2, 18]
+
+def test_region_report():
+    """
+    Testing truths to validate the named report of the default grid and the
+    grid of counts otherwise.
+    """
+    lat, lon = DOWNTOWN_AUSTIN
+    report = region_report(region_counts([lat, lat + 1, lat + 1], [lon, lon + 1, lon - 1]))
+    assert list(report)[0] == 'Downtown' and report['Downtown'] == 1 and report['NE'] == 1 and report['NW'] == 1
+    assert sum(report.values()) == 3
+    assert region_report(region_counts([lat], [lon], grid=(1, 3))) == {'grid': [[0, 1, 0]]}
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Imports
+from rollups import rollup_deltas, load_rollups
+from histograms import CHART_STEPS
+from regions import DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID
+from dates import NO_TIMESTAMP
+from collections import defaultdict
+from datetime import date, datetime, timezone
+import numpy as np
+import random
+import json
+import ingest
+import rollups
+import shards
+import worker
+
+# Global variables / constants
+START = date(2021, 11, 20)
+END = date(2022, 2, 10)
+
+# Function definitions
+def _published(when):
+    """Formats a time as a 'Published Date' of the feed"""
+    return when.strftime('%m/%d/%Y %I:%M:%S %p +0000')
+
+def _rows(size, seed=1):
+    """Incident rows spread over START to END, some without a usable location"""
+    random.seed(seed)
+    first = datetime(START.year, START.month, START.day, tzinfo=timezone.utc).timestamp()
+    last = datetime(END.year, END.month, END.day, 23, 59, 59, tzinfo=timezone.utc).timestamp()
+    rows = []
+    for i in range(size):
+        lat = DOWNTOWN_AUSTIN[0] + random.uniform(-0.03, 0.03)
+        lon = DOWNTOWN_AUSTIN[1] + random.uniform(-0.03, 0.03)
+        rows.append({'Traffic Report ID': f'{i:040X}_{1600000000 + i}',
+                     'Published Date': _published(datetime.fromtimestamp(random.randint(int(first), int(last)), tz=timezone.utc)),
+                     'Issue Reported': 'Crash', 'Location': f'POINT ({lon} {lat})',
+                     'Latitude': '' if i % 40 == 0 else str(lat), 'Longitude': str(lon),
+                     'Address': f'{i} Main St', 'Status': 'ARCHIVED', 'Agency': 'AUSTIN PD'})
+    return rows
+
+def _compare(start_date, end_date, step):
+    """Job partials from the rollups and from the raw incidents"""
+    options = {'map': None, 'map_cell': None, 'chart_step': step, 'regions': (DOWNTOWN_AUSTIN, REGION_TOLERANCE, REGION_GRID)}
+    from_rollups = worker.rollup_partial(load_rollups(start_date, end_date), start_date, end_date, options)
+    from_incidents = shards.analyze_window(start_date, end_date, options)
+    return from_rollups.to_json(), from_incidents.to_json()
+
+def test_rollup_deltas():
+    """
+    Testing truths to validate the daily counters of a batch of incidents,
+    and that removing the batch cancels them.
+    """
+    timestamps = np.array([int(datetime(2022, 1, 31, 23, 0, tzinfo=timezone.utc).timestamp()),
+                           int(datetime(2022, 2, 1, 7, 30, tzinfo=timezone.utc).timestamp()),
+                           NO_TIMESTAMP])
+    deltas = defaultdict(int)
+    rollup_deltas(timestamps, [30.2672, np.nan, 30.3], [-97.7431, np.nan, -97.7], 1, deltas)
+    assert deltas[('2022-01-31', 'count')] == 1 and deltas[('2022-02-01', 'count')] == 1
+    assert deltas[('2022-01-31', 'located')] == 1 and deltas[('2022-02-01', 'located')] == 0
+    assert deltas[('2022-01-31', 'lat_sum')] == 30267200
+    assert deltas[('2022-01-31', 'region:Downtown')] == 1
+    assert deltas[('2022-01-31', 'hour:23')] == 1 and deltas[('2022-02-01', 'tod:Morning')] == 1
+    rollup_deltas(timestamps, [30.2672, np.nan, 30.3], [-97.7431, np.nan, -97.7], -1, deltas)
+    assert not any(deltas.values())
+
+def test_rollups_match_incidents_after_delta(redis_server):
+    """
+    Testing truths to validate that jobs answered from the rollups equal the
+    same jobs computed from the stored incidents, after a full load and
+    after a delta load that adds, moves, relocates and invalidates rows.
+    """
+    rows = _rows(1500)
+    ingest.store_rows(rows)
+    assert rollups.rollups_ready()
+    for step in CHART_STEPS:
+        from_rollups, from_incidents = _compare(START, END, step)
+        assert from_rollups == from_incidents
+
+    rows[1]['Published Date'] = _published(datetime(2022, 1, 1, 0, 0, tzinfo=timezone.utc)) # Moved across a year
+    rows[2]['Latitude'] = str(DOWNTOWN_AUSTIN[0]) # Moved downtown
+    rows[3]['Latitude'] = 'abc' # No longer located
+    rows[40]['Latitude'] = '30.25' # Located again
+    rows[5]['Published Date'] = 'not a date'
+    rows += [dict(rows[6], **{'Traffic Report ID': f'NEW_{i}', 'Published Date': _published(datetime(2021, 12, 31, 23, i, tzinfo=timezone.utc))}) for i in range(5)]
+    counts = ingest.store_rows(rows, delta=True)
+    assert counts['added'] == 5 and counts['updated'] == 5
+    for start_date, end_date in ((START, END), (date(2021, 12, 31), date(2022, 1, 1)), (date(2022, 1, 1), date(2022, 1, 1))):
+        for step in CHART_STEPS:
+            from_rollups, from_incidents = _compare(start_date, end_date, step)
+            assert from_rollups == from_incidents
+
+def test_rollups_need_an_empty_database(redis_server):
+    """
+    Testing truths to validate that rollups are only marked ready when they
+    were kept since the database was empty, and not over incidents stored
+    as JSON before the rollups existed.
+    """
+    rows = _rows(60)
+    ingest.rd.mset({row['Traffic Report ID']: json.dumps(row) for row in rows})
+    ingest.store_rows(rows[:30])
+    assert not rollups.rollups_ready()
+    ingest.rd.flushdb()
+    ingest.store_rows(rows[:30])
+    assert rollups.rollups_ready()
+    ingest.store_rows(rows, delta=True)
+    assert rollups.rollups_ready()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+# Imports
+from incidents import load_incidents
+from datetime import date, datetime, timezone
+import pandas as pd
+import random
+import ingest
+import snapshot
+
+# Global variables / constants
+START = date(2021, 12, 25)
+END = date(2022, 1, 10)
+WINDOWS = ((START, END), (date(2021, 12, 31), date(2022, 1, 1)), (date(2022, 1, 5), date(2022, 1, 5)), (date(2020, 1, 1), date(2020, 1, 2)))
+
+# Function definitions
+def _rows(size, seed=1):
+    """Incident rows over START to END with repeated times, unicode and empty addresses, missing coordinates and bad dates"""
+    random.seed(seed)
+    first = datetime(START.year, START.month, START.day, tzinfo=timezone.utc).timestamp()
+    rows = []
+    for i in range(size):
+        published = datetime.fromtimestamp(first + random.randrange(0, 17 * 86400, 1800), tz=timezone.utc)
+        rows.append({'Traffic Report ID': f'ID_{i}', 'Published Date': 'not a date' if i % 50 == 0 else published.strftime('%m/%d/%Y %I:%M:%S %p +0000'),
+                     'Latitude': '' if i % 7 == 0 else str(30.2672 + random.uniform(-0.05, 0.05)), 'Longitude': str(-97.7431 + random.uniform(-0.05, 0.05)),
+                     'Address': '' if i % 11 == 0 else f'{i} Calle Señora'})
+    return rows
+
+def _sorted(frame):
+    """A frame of incidents in a fixed order, whatever the order of equal publish times"""
+    return frame.sort_values(['published', 'address']).reset_index(drop=True)
+
+def _assert_matches(windows):
+    """Asserts that the snapshot slices of windows equal the incidents read from redis"""
+    for start_date, end_date in windows:
+        sliced = snapshot.snapshot_incidents(start_date, end_date)
+        assert sliced is not None
+        pd.testing.assert_frame_equal(_sorted(sliced), _sorted(load_incidents(start_date, end_date)))
+        without_addresses = snapshot.snapshot_incidents(start_date, end_date, addresses=False)
+        pd.testing.assert_frame_equal(without_addresses.drop(columns='address'), sliced.drop(columns='address'))
+
+def test_snapshot_matches_redis(redis_server, monkeypatch, tmp_path):
+    """
+    Testing truths to validate that the incidents sliced out of a snapshot
+    equal the ones read from redis, across batches and with index entries
+    whose incident is gone, and that changes retire it until republished.
+    """
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(snapshot, 'SCAN_BATCH_SIZE', 37)
+    monkeypatch.setattr(snapshot, '_loaded', None)
+    rows = _rows(600)
+    ingest.store_rows(rows)
+    snapshot.rd.delete('ID_3', 'ID_4') # Still indexed
+    assert snapshot.publish_snapshot() is not None
+    _assert_matches(WINDOWS)
+
+    rows[5]['Address'] = 'Moved'
+    ingest.store_rows(rows, delta=True)
+    assert snapshot.snapshot_incidents(START, END) is None
+    assert snapshot.publish_snapshot() is not None
+    _assert_matches(WINDOWS[:1])
+    assert len([path for path in tmp_path.iterdir() if path.name.isdigit()]) == 2 # The first version is kept for open memory maps
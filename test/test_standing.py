@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Imports
+from datetime import datetime, timezone
+import numpy as np
+import random
+import time
+import ingest
+import standing
+
+# Global variables / constants
+NOW = time.time()
+DAY = 86400
+
+# Function definitions
+def _row(i, published, lat=30.2672, lon=-97.7431):
+    """An incident row of the feed, published at the UNIX time published"""
+    return {'Traffic Report ID': f'ID_{i}', 'Published Date': datetime.fromtimestamp(published, tz=timezone.utc).strftime('%m/%d/%Y %I:%M:%S %p +0000'),
+            'Issue Reported': 'Crash', 'Latitude': str(lat), 'Longitude': str(lon), 'Address': f'{i} Main St', 'Status': 'ARCHIVED'}
+
+def _rows(size, days, seed=1):
+    """Incident rows around downtown published over the last days days"""
+    random.seed(seed)
+    return [_row(i, NOW - random.uniform(60, days * DAY), 30.2672 + random.uniform(-0.05, 0.05), -97.7431 + random.uniform(-0.05, 0.05)) for i in range(size)]
+
+def _date(timestamp):
+    """MM/DD/YYYY job date of a UNIX time"""
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).strftime('%m/%d/%Y')
+
+def test_refresh_matches_recompute(redis_server):
+    """
+    Testing truths to validate that standing queries refreshed from the
+    delta of a load equal the same queries computed from scratch.
+    """
+    rows = _rows(800, 30)
+    ingest.store_rows(rows)
+    definitions = [{'days': 7, 'chart_step': 'day'},
+                   {'start': _date(NOW - 20 * DAY), 'end': _date(NOW - 10 * DAY), 'region_grid': [5, 5]},
+                   {'days': 3, 'incident_graph': 'no'}]
+    sids = [standing.add_standing_query(definition)['id'] for definition in definitions]
+    rows[1] = _row(1, NOW - 2 * DAY) # Moved into the short windows
+    rows[2] = _row(2, NOW - 40 * DAY) # Moved out of every window
+    rows[3]['Latitude'] = 'abc' # No longer located
+    rows[4]['Longitude'] = str(float(rows[4]['Longitude']) + 0.02) # Relocated
+    rows += [_row(1000 + i, NOW - i * 3 * DAY - 3600) for i in range(8)]
+    counts = ingest.store_rows(rows, batch_size=100, delta=True)
+    assert counts['added'] == 8 and counts['updated'] == 4
+    for sid, definition in zip(sids, definitions):
+        refreshed = standing.get_standing_query(sid)['result']
+        assert refreshed == standing.add_standing_query(definition)['result']
+
+def test_changes_kept_for_standing_windows(redis_server, monkeypatch):
+    """
+    Testing truths to validate that a load only keeps the changes inside
+    the timeframes of the standing queries or of live mode.
+    """
+    rows = _rows(300, 400)
+    sid = standing.add_standing_query({'start': _date(NOW - 200 * DAY), 'end': _date(NOW - 100 * DAY)})['id']
+    start, end = (datetime.strptime(_date(NOW - days * DAY), '%m/%d/%Y').replace(tzinfo=timezone.utc).timestamp() for days in (200, 99))
+    refreshed = []
+    monkeypatch.setattr(ingest, 'refresh_standing', lambda changes, sids: refreshed.append((changes, sids)))
+    ingest.store_rows(rows, batch_size=50)
+    (changes, sids), = refreshed
+    assert sids == [sid]
+    timestamps = np.concatenate([change[0] for change in changes])
+    assert ((timestamps >= start) & (timestamps < end) | (timestamps >= NOW - ingest.CHANGES_MAX_AGE - 60)).all()
+    published = np.array([datetime.strptime(row['Published Date'], '%m/%d/%Y %I:%M:%S %p +0000').replace(tzinfo=timezone.utc).timestamp() for row in rows])
+    assert len(timestamps) == ((published >= start) & (published < end) | (published >= NOW - ingest.CHANGES_MAX_AGE)).sum()